@@ -9,6 +9,27 @@ class Settings(BaseSettings):
     google_ai_api_key: str
     gemini_model: str = "gemini-3-pro-preview"
     
+    # Model Routing (tiers: fast, standard = gemini_model, reasoning)
+    gemini_fast_model: str = "gemini-2.5-flash"  # Empty uses gemini_model
+    gemini_reasoning_model: str = ""  # Empty uses gemini_model
+    model_routes: dict = {  # Pipeline stage -> tier
+        "evidence": "fast",
+        "batch_validation": "fast",
+        "batch_remediation": "fast",
+        "narratives": "fast",
+        "mapping": "standard",
+        "validation": "standard",
+        "remediation_plan": "standard",
+        "deep_remediation": "standard"
+    }
+    model_risk_routes: dict = {"critical": "reasoning"}  # Risk tier/level -> tier, overrides the stage route
+    model_fallback_order: list = ["standard", "fast"]  # Tiers tried when a call on the routed tier fails
+    model_costs: dict = {  # Tier -> [USD per 1M input tokens, USD per 1M output tokens] (estimates)
+        "fast": [0.30, 2.50],
+        "standard": [2.00, 12.00],
+        "reasoning": [2.00, 12.00]
+    }
+    
     # Database
     database_url: str
     
@@ -42,18 +63,57 @@ class Settings(BaseSettings):
         "application/x-yaml",
         "application/octet-stream"  # Fallback for files with unknown mime types
     ]
+    image_max_dimension: int = 1536  # Longest image side sent to the model (pixels)
+    image_jpeg_quality: int = 85  # Re-encode quality for JPEG evidence
+    pdf_table_extraction: str = "auto"  # auto (pages with ruled table geometry), all, off
+    extraction_cache_enabled: bool = False  # Reuse PDF/DOCX extraction for identical files (stores evidence text on disk)
+    extraction_cache_dir: str = ""  # Empty uses ~/.cache/dave/extraction-cache
+    extraction_cache_max_mb: int = 512  # Least recently used entries evicted beyond this
+    long_document_threshold_tokens: int = 30000  # Longer documents are summarized section by section
+    summary_chunk_tokens: int = 6000  # Section chunk size for long-document summarization
     
     # Scalability & Performance Settings
     batch_validation_size: int = 10  # Controls validated per batch API call
     batch_remediation_size: int = 15  # Controls remediated per batch
+    batch_autotune: bool = True  # Tune batch sizes per stage from latency, output tokens and parse failures
+    batch_size_min: int = 3  # Lower bound for tuned batch sizes
+    batch_size_max: int = 30  # Upper bound for tuned batch sizes
     deep_reasoning_risk_levels: list = ["high", "critical"]  # Risk levels requiring deep reasoning
-    nist_cache_size: int = 1000  # LRU cache size for NIST control requirements
+    nist_cache_size: int = 1200  # LRU cache size for NIST control requirements (catalog: 1,100 controls)
+    nist_catalog_mode: str = "memory"  # memory (parsed per process) or mmap (compiled snapshot shared by worker processes)
+    nist_catalog_snapshot_path: str = ""  # Empty uses ~/.cache/dave/nist-catalog.snapshot
     skip_passing_controls: bool = True  # Skip full analysis for fully implemented controls
     max_concurrent_batches: int = 3  # Max parallel batch operations
+    mapping_shard_size: int = 40  # Max in-scope controls per control-mapping call
+    speculative_validation: bool = True  # Quick/smart modes: batch-validate evidence-cited controls while mapping runs
+    speculative_validation_max_controls: int = 50  # Most-cited controls speculated per run
     
     # Token Management
     max_tokens_per_request: int = 8000  # Max tokens for single Gemini request
     validation_prompt_mode: str = "adaptive"  # detailed, concise, minimal, adaptive
+    validation_token_budget: int = 200000  # Prompt tokens per run for per-control validation (adaptive mode)
+    token_calibration_enabled: bool = True  # Fit local token estimates to the prompt token counts the API reports
+    token_calibration_file: str = ""  # Empty uses ~/.cache/dave/token-calibration.jsonl
+    
+    # Prompt Caching (stable prompt prefixes uploaded once per model)
+    prompt_cache_mode: str = "off"  # off, gemini (context caching), local (in-memory, no billing effect)
+    prompt_cache_ttl_seconds: int = 3600
+    prompt_cache_min_tokens: int = 4096  # Smaller prefixes are sent inline (provider minimum)
+    prompt_cache_max_entries: int = 64  # Prefixes tracked per process
+    
+    # OSCAL Generation
+    oscal_generation_mode: str = "local"  # local (deterministic only) or enriched (model-written narratives)
+    oscal_narrative_min_chars: int = 80  # Descriptions shorter than this get a narrative in enriched mode
+    oscal_enrichment_batch_size: int = 15  # Controls per narrative call
+    
+    # OSCAL Validation
+    oscal_cli_path: str = "oscal-cli"
+    oscal_cli_timeout_seconds: int = 30
+    oscal_validator_worker_command: str = ""  # Long-lived validator worker, e.g. "python -m app.services.oscal_validator --worker" (JSON lines over stdio, not oscal-cli); empty uses one-shot oscal-cli
+    oscal_validator_pool_size: int = 2  # Warm validator worker processes kept alive
+    oscal_schema_dir: str = ""  # Directory with OSCAL 1.2.0 JSON schemas; empty uses backend/data/oscal-schemas
+    oscal_validation_cache_size: int = 256  # Validation results cached by canonical document hash
+    oscal_export_cache_size: int = 32  # Sessions whose serialized OSCAL download is kept in memory
     
     class Config:
         env_file = ".env"
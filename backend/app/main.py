@@ -1,6 +1,6 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
 from typing import List, Optional, Dict
 from dataclasses import dataclass, field
 import uuid
@@ -8,13 +8,22 @@ import asyncio
 import json
 import time
 from datetime import datetime
+from contextlib import asynccontextmanager
 
 from app.config import get_settings
 from app.models import ProcessingStatus, AnalysisResult, AssessmentScopeRequest, ProcessingEstimate, RiskLevel
 from app.utils.document_processor import DocumentProcessor
+from app.utils.extraction_cache import get_extraction_cache
+from app.utils import run_metrics
+from app.utils.run_metrics import RunMetricsSink
 from app.services.gemini_service import GeminiService
 from app.services.baseline_service import BaselineService, AssessmentScope
 from app.services.nist_catalog_service import get_nist_catalog_service
+from app.services.pipeline_registry import get_pipeline_registry, PipelineCancelled
+from app.services.oscal_validator import get_oscal_validator_service
+from app.services.speculative_validation import SpeculativeValidation, cited_controls
+from app.services.oscal_export import get_oscal_export_service, negotiate_encoding, etag_matches
+from app.services.token_estimator import get_token_estimator
 
 # ============================================================================
 # Processing Metrics Tracking (Task 14)
@@ -44,16 +53,99 @@ class ProcessingMetrics:
     api_calls_made: int = 0
     api_calls_batch: int = 0
     api_calls_individual: int = 0
+    api_calls_coalesced: int = 0  # Identical concurrent prompts served by another caller's request
     
     # Performance metrics
     tokens_used: int = 0
     tokens_estimated: int = 0
-    cache_hit_rate: float = 0.0
+    cache_hit_rate: float = 0.0  # NIST requirements cache hits / lookups during this run
+    
+    # NIST requirements cache (counts for this run; the cache is shared by all sessions)
+    requirements_cache: dict = field(default_factory=dict)
+    
+    # Batch response quality: retries of unresolved controls in this run, and
+    # process-wide parse-failure rates by stage and batch size
+    batch_retry_calls: int = 0
+    parse_failure_rates: dict = field(default_factory=dict)
+    
+    # Batch sizes at the end of the run and tuner decisions made during it
+    batch_sizes: dict = field(default_factory=dict)
+    batch_size_decisions: list = field(default_factory=list)
+    
+    # Speculative batch validation of evidence-cited controls during mapping
+    speculative_controls: int = 0
+    speculative_reused: int = 0
+    speculative_discarded: int = 0
+    speculative_batch_calls: int = 0
+    
+    # Document extraction (cache hits skipped parsing entirely)
+    files_processed: int = 0
+    extraction_cache_hits: int = 0
     
     # Results
     gaps_found: int = 0
     critical_gaps: int = 0
     
+    # OSCAL generation (latency saved is relative to this run's average model round trip)
+    oscal_generation_mode: str = "local"
+    oscal_generation_seconds: float = 0.0
+    oscal_narratives_enriched: int = 0
+    oscal_enrichment_calls: int = 0
+    oscal_latency_saved_seconds: Optional[float] = None
+    
+    # Prompt prefix caching (counts for this run; the cache is shared by all sessions)
+    prompt_cache_mode: str = "off"
+    prompt_cache_uploads: int = 0
+    prompt_cache_reuses: int = 0
+    prompt_cache_reused_tokens: int = 0
+    
+    # Model tiers used in this run: calls, latency, tokens and estimated cost per tier
+    model_tiers: dict = field(default_factory=dict)
+    
+    # Cancellation (partial metrics are recorded when a session is deleted mid-run)
+    cancelled: bool = False
+    last_stage: str = "initializing"
+    
+    def record_requirements_cache(self, run: RunMetricsSink, cache_stats: dict):
+        """This run's requirements cache lookups (size and maxsize are the shared cache's)"""
+        counts = run.counters("requirements_cache")
+        hits = counts.get("hits", 0)
+        misses = counts.get("misses", 0)
+        self.cache_hit_rate = hits / (hits + misses) if hits + misses else 0.0
+        self.requirements_cache = {
+            "hits": hits,
+            "misses": misses,
+            "evictions": counts.get("evictions", 0),
+            "size": cache_stats["size"],
+            "maxsize": cache_stats["maxsize"]
+        }
+    
+    def record_prompt_cache(self, run: RunMetricsSink):
+        """This run's prompt prefix uploads and reuses"""
+        counts = run.counters("prompt_cache")
+        self.prompt_cache_uploads = counts.get("uploads", 0)
+        self.prompt_cache_reuses = counts.get("reuses", 0)
+        self.prompt_cache_reused_tokens = counts.get("reused_tokens", 0)
+    
+    def record_model_tiers(self, run: RunMetricsSink, tier_stats: dict):
+        """This run's calls per tier (tier_stats supplies the models and counter names)"""
+        self.model_tiers = {}
+        for tier, totals in tier_stats.items():
+            counts = run.counters(f"model_tiers.{tier}")
+            if counts.get("calls"):
+                self.model_tiers[tier] = {
+                    "model": totals["model"],
+                    **{name: counts.get(name, 0) for name in totals if name != "model"}
+                }
+    
+    def record_oscal_latency_saved(self, run: RunMetricsSink):
+        """Average latency of this run's model calls minus OSCAL generation time (never negative)"""
+        counts = run.counters("model_tiers")
+        calls = sum(value for name, value in counts.items() if name.endswith(".calls"))
+        if calls:
+            round_trip = sum(value for name, value in counts.items() if name.endswith(".latency_seconds")) / calls
+            self.oscal_latency_saved_seconds = max(0.0, round_trip - self.oscal_generation_seconds)
+    
     def finish(self):
         """Mark processing as complete and calculate duration"""
         self.end_time = time.time()
@@ -78,6 +170,8 @@ class ProcessingMetrics:
         """Convert to dictionary for logging"""
         return {
             "session_id": self.session_id,
+            "status": "cancelled" if self.cancelled else ("complete" if self.end_time else "running"),
+            "last_stage": self.last_stage,
             "duration_minutes": round(self.duration_minutes(), 2),
             "scope": {
                 "baseline": self.baseline,
@@ -98,13 +192,60 @@ class ProcessingMetrics:
                 "total_calls": self.api_calls_made,
                 "batch_calls": self.api_calls_batch,
                 "individual_calls": self.api_calls_individual,
+                "coalesced_calls": self.api_calls_coalesced,
                 "average_controls_per_call": round(self.total_controls / self.api_calls_made, 2) if self.api_calls_made > 0 else 0
             },
             "performance": {
                 "tokens_used": self.tokens_used,
                 "tokens_estimated": self.tokens_estimated,
                 "token_efficiency_percent": round(self.token_efficiency(), 2),
-                "cache_hit_rate_percent": round(self.cache_hit_rate * 100, 2)
+                "cache_hit_rate_percent": round(self.cache_hit_rate * 100, 2),
+                "requirements_cache": self.requirements_cache
+            },
+            "batch_quality": {
+                "retry_calls": self.batch_retry_calls,
+                "parse_failure_rates": self.parse_failure_rates,
+                "batch_sizes": self.batch_sizes,
+                "batch_size_decisions": self.batch_size_decisions
+            },
+            "speculative_validation": {
+                "controls": self.speculative_controls,
+                "reused": self.speculative_reused,
+                "discarded": self.speculative_discarded,
+                "batch_calls": self.speculative_batch_calls
+            },
+            "extraction": {
+                "files": self.files_processed,
+                "cache_hits": self.extraction_cache_hits
+            },
+            "oscal_generation": {
+                "mode": self.oscal_generation_mode,
+                "seconds": round(self.oscal_generation_seconds, 3),
+                "narratives_enriched": self.oscal_narratives_enriched,
+                "enrichment_calls": self.oscal_enrichment_calls,
+                "latency_saved_seconds": (
+                    round(self.oscal_latency_saved_seconds, 2)
+                    if self.oscal_latency_saved_seconds is not None else None
+                )
+            },
+            "model_tiers": {
+                tier: {
+                    "model": entry["model"],
+                    "calls": entry["calls"],
+                    "failures": entry["failures"],
+                    "fallbacks": entry["fallbacks"],
+                    "average_latency_seconds": round(entry["latency_seconds"] / entry["calls"], 3),
+                    "input_tokens": entry["input_tokens"],
+                    "output_tokens": entry["output_tokens"],
+                    "estimated_cost_usd": round(entry["cost_usd"], 4)
+                }
+                for tier, entry in self.model_tiers.items()
+            },
+            "prompt_cache": {
+                "mode": self.prompt_cache_mode,
+                "uploads": self.prompt_cache_uploads,
+                "reuses": self.prompt_cache_reuses,
+                "reused_prompt_tokens": self.prompt_cache_reused_tokens
             },
             "results": {
                 "gaps_found": self.gaps_found,
@@ -119,11 +260,25 @@ processing_metrics = {}
 # FastAPI Application Setup
 # ============================================================================
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application lifespan: on shutdown stop warm OSCAL validator workers,
+    delete cached prompt prefixes and write buffered token calibration samples
+    """
+    yield
+    await get_oscal_validator_service().close()
+    if gemini_service.prompt_cache is not None:
+        await gemini_service.prompt_cache.close()
+    await asyncio.to_thread(get_token_estimator().flush)
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="D.A.V.E - Document Analysis & Validation Engine",
     description="AI-Powered Compliance Automation using Google Gemini",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Settings
@@ -143,6 +298,9 @@ document_processor = DocumentProcessor()
 gemini_service = GeminiService()
 baseline_service = BaselineService()
 nist_catalog_service = get_nist_catalog_service()
+pipeline_registry = get_pipeline_registry()
+oscal_exports = get_oscal_export_service()
+extraction_cache = get_extraction_cache()
 
 # In-memory storage for demo (use Redis/DB in production)
 processing_sessions = {}
@@ -348,7 +506,8 @@ async def estimate_scope(scope_request: AssessmentScopeRequest):
         # Calculate estimate (pass count, not list)
         estimate = baseline_service.estimate_processing(
             control_count=len(filtered_controls),
-            mode=scope_request.mode
+            mode=scope_request.mode,
+            control_requirements=nist_catalog_service.get_control_requirements_batch(filtered_controls)
         )
         
         return estimate
@@ -442,8 +601,10 @@ async def analyze_documents(
         )
         processing_sessions[session_id] = status
         
-        # Process files in background with scope filtering
-        asyncio.create_task(process_documents_async(session_id, file_data, scope_request))
+        # Process files in background with scope filtering; the task is tracked
+        # so DELETE /api/sessions/{session_id} can cancel it
+        task = asyncio.create_task(process_documents_async(session_id, file_data, scope_request))
+        pipeline_registry.register(session_id, task)
         
         return {
             "session_id": session_id,
@@ -472,8 +633,12 @@ async def process_documents_async(
     update_status(session_id, "initializing", 1, "Initializing AI agents and processing pipeline...")
     
     # Initialize metrics tracking
-    metrics = ProcessingMetrics(session_id=session_id)
+    metrics = ProcessingMetrics(session_id=session_id, prompt_cache_mode=settings.prompt_cache_mode)
     processing_metrics[session_id] = metrics
+    # Shared services count this run's work (and only this run's) into its own sink
+    run = RunMetricsSink()
+    run_token = run_metrics.bind(run)
+    speculation = None
     
     try:
         # Step 0: Apply scope filtering if provided
@@ -510,7 +675,8 @@ async def process_documents_async(
             # Get estimate for token tracking
             estimate = baseline_service.estimate_processing(
                 control_count=len(filtered_control_ids),
-                mode=assessment_mode
+                mode=assessment_mode,
+                control_requirements=nist_catalog_service.get_control_requirements_batch(filtered_control_ids)
             )
             metrics.tokens_estimated = estimate["estimated_tokens"]
             
@@ -525,6 +691,11 @@ async def process_documents_async(
         update_status(session_id, "processing", 10, "Processing uploaded documents")
         
         # Step 1: Process all uploaded files with progress updates
+        # Extraction runs in a worker thread so the event loop stays responsive;
+        # the worker polls the pipeline's cancel event between pages
+        handle = pipeline_registry.get(session_id)
+        cancel_event = handle.cancel_event if handle else None
+        
         processed_files = []
         total_files = len(file_data)
         for idx, file_info in enumerate(file_data):
@@ -532,14 +703,24 @@ async def process_documents_async(
             file_progress = 10 + int((idx / total_files) * 8)  # Progress from 10% to 18%
             update_status(session_id, "processing", file_progress, f"Processing file {idx+1}/{total_files}: {file_info['filename']}")
             
-            result = document_processor.process_file(
+            result = await asyncio.to_thread(
+                document_processor.process_file,
                 file_info['content'], 
                 file_info['filename'],
-                file_info['content_type']
+                file_info['content_type'],
+                cancel_event=cancel_event,
+                image_max_dimension=settings.image_max_dimension,
+                image_jpeg_quality=settings.image_jpeg_quality,
+                extraction_cache=extraction_cache,
+                pdf_table_mode=settings.pdf_table_extraction,
+                session_id=session_id
             )
             result['filename'] = file_info['filename']
             processed_files.append(result)
         
+        metrics.files_processed = total_files
+        metrics.extraction_cache_hits = int(run.count("extraction_cache_hits"))
+        
         update_status(session_id, "analyzing", 20, "Agent 1: Analyzing evidence with Gemini 3...")
         
         # Step 2: Agent 1 - Evidence Analysis
@@ -549,6 +730,27 @@ async def process_documents_async(
         print(f"[{session_id}] ✅ GEMINI RESPONSE: {len(evidence_artifacts)} evidence artifacts created")
         update_status(session_id, "analyzing", 30, f"Agent 1: Completed - {len(evidence_artifacts)} evidence artifacts identified")
         
+        # Batch validation needs only control IDs and evidence: start it for
+        # the most cited in-scope controls now and reconcile once mapping is done
+        if settings.speculative_validation and assessment_mode in ("quick", "smart"):
+            speculation = SpeculativeValidation(
+                gemini_service,
+                cited_controls(
+                    evidence_artifacts,
+                    nist_catalog_service,
+                    filtered_control_ids,
+                    limit=settings.speculative_validation_max_controls
+                ),
+                evidence_artifacts
+            ).start()
+            metrics.speculative_controls = len(speculation.control_ids)
+            print(f"[{session_id}] 🔮 Speculatively validating {metrics.speculative_controls} cited controls")
+        
+        async def validate_in_batches(control_ids: List[str]):
+            if speculation:
+                return await speculation.validate(control_ids)
+            return await gemini_service.validate_controls_by_family(control_ids, evidence_artifacts)
+        
         update_status(session_id, "mapping", 35, "Agent 2: Mapping controls to NIST 800-53...")
         
         # Step 3: Agent 2 - Control Mapping & Gap Analysis
@@ -569,15 +771,38 @@ async def process_documents_async(
         
         update_status(session_id, "generating", 50, "Agent 3: Generating OSCAL 1.2.0 artifacts...")
         
-        # Step 4: Agent 3 - OSCAL Generation
-        print(f"[{session_id}] 🤖 CALLING GEMINI API: generate_oscal_artifacts")
-        update_status(session_id, "generating", 53, "Agent 3: AI creating System Security Plan components...")
-        oscal_components, poam_entries = await gemini_service.generate_oscal_artifacts(
+        # Step 4: Agent 3 - OSCAL Generation (deterministic; model only writes
+        # narratives for thin descriptions when enrichment is enabled)
+        update_status(session_id, "generating", 53, "Agent 3: Building System Security Plan and POA&M...")
+        oscal_start = time.perf_counter()
+        metrics.oscal_generation_mode = settings.oscal_generation_mode
+        if settings.oscal_generation_mode == "enriched":
+            thin = sum(1 for m in control_mappings if gemini_service.needs_narrative(m))
+            update_status(session_id, "generating", 55, f"Agent 3: AI writing narratives for {thin} controls...")
+            control_mappings, enrichment_calls, enriched = await gemini_service.enrich_control_narratives(
+                control_mappings,
+                evidence_artifacts
+            )
+            metrics.oscal_narratives_enriched = enriched
+            metrics.oscal_enrichment_calls = enrichment_calls
+        generated_at = datetime.utcnow()
+        oscal_artifacts = gemini_service.generate_oscal_artifacts(
             control_mappings,
             control_gaps,
-            evidence_artifacts
+            evidence_artifacts,
+            session_id=session_id,
+            generated_at=generated_at
+        )
+        oscal_components = oscal_artifacts.components
+        poam_entries = oscal_artifacts.poam_entries
+        metrics.oscal_generation_seconds = time.perf_counter() - oscal_start
+        metrics.record_oscal_latency_saved(run)
+        print(
+            f"[{session_id}] ✅ OSCAL BUILT ({metrics.oscal_generation_mode}): {len(oscal_components)} components, "
+            f"{len(poam_entries)} POAM entries in {metrics.oscal_generation_seconds:.3f}s"
+            + (f", ~{metrics.oscal_latency_saved_seconds:.1f}s saved vs. a model round trip"
+               if metrics.oscal_latency_saved_seconds is not None else "")
         )
-        print(f"[{session_id}] ✅ GEMINI RESPONSE: {len(oscal_components)} components, {len(poam_entries)} POAM entries")
         update_status(session_id, "generating", 60, f"Agent 3: Completed - {len(oscal_components)} SSP components, {len(poam_entries)} POA&M entries")
         
         update_status(session_id, "validating_nist", 65, "Agent 4: Validating against NIST 800-53 Rev 5...")
@@ -587,13 +812,9 @@ async def process_documents_async(
             # Quick mode: Use batch validation for all controls
             update_status(session_id, "validating_nist", 65, "Quick validation: Batch processing controls")
             control_ids = [m.control_id for m in control_mappings]
-            nist_validation_results = await gemini_service.validate_controls_batch(
-                control_ids,
-                evidence_artifacts,
-                batch_size=settings.batch_validation_size
-            )
+            nist_validation_results, batch_calls = await validate_in_batches(control_ids)
             metrics.controls_validated = len(control_ids)
-            metrics.api_calls_batch = len(control_ids) // settings.batch_validation_size + 1
+            metrics.api_calls_batch = batch_calls
             metrics.api_calls_made = metrics.api_calls_batch
             
         elif assessment_mode == "smart":
@@ -606,37 +827,26 @@ async def process_documents_async(
             metrics.standard_controls = len(prioritized["standard"])
             metrics.passing_controls = len(prioritized["passing"])
             
-            # Batch validate standard controls
-            standard_results = []
-            if prioritized["standard"]:
-                standard_results = await gemini_service.validate_controls_batch(
-                    prioritized["standard"],
-                    evidence_artifacts,
-                    batch_size=settings.batch_validation_size
-                )
-                metrics.api_calls_batch += len(prioritized["standard"]) // settings.batch_validation_size + 1
+            # Batch validate standard controls in token-packed family batches
+            standard_results, batch_calls = await validate_in_batches(prioritized["standard"])
+            metrics.api_calls_batch += batch_calls
             
-            # Deep validate critical controls (use existing detailed validation)
-            critical_results = []
-            for control_id in prioritized["critical"]:
-                mapping = next((m for m in control_mappings if m.control_id == control_id), None)
-                if mapping:
-                    result = await gemini_service.validate_against_nist_requirements(
-                        [mapping],
-                        evidence_artifacts
-                    )
-                    critical_results.extend(result)
-                    metrics.api_calls_individual += 1
+            # Deep validate critical controls (one call each, prompt detail
+            # adapted to the run's token budget)
+            critical_ids = set(prioritized["critical"])
+            critical_mappings = [m for m in control_mappings if m.control_id in critical_ids]
+            critical_results = await gemini_service.validate_against_nist_requirements(
+                critical_mappings,
+                evidence_artifacts,
+                risk_tier="critical"
+            )
+            metrics.api_calls_individual += len(critical_mappings)
             
             # Skip passing controls if configured
             passing_results = []
             if not settings.skip_passing_controls and prioritized["passing"]:
-                passing_results = await gemini_service.validate_controls_batch(
-                    prioritized["passing"],
-                    evidence_artifacts,
-                    batch_size=settings.batch_validation_size
-                )
-                metrics.api_calls_batch += len(prioritized["passing"]) // settings.batch_validation_size + 1
+                passing_results, batch_calls = await validate_in_batches(prioritized["passing"])
+                metrics.api_calls_batch += batch_calls
             else:
                 metrics.controls_skipped = len(prioritized["passing"])
             
@@ -645,22 +855,35 @@ async def process_documents_async(
             
             nist_validation_results = standard_results + critical_results + passing_results
         else:
-            # Deep mode: Full validation for all (existing behavior)
+            # Deep mode: Full validation for all, riskiest controls first so
+            # they get the detailed prompts if the token budget runs short
+            prioritized = gemini_service.prioritize_controls(control_mappings, control_gaps)
+            rank = {
+                control_id: position
+                for position, control_id in enumerate(
+                    prioritized["critical"] + prioritized["standard"] + prioritized["passing"]
+                )
+            }
             nist_validation_results = await gemini_service.validate_against_nist_requirements(
-                control_mappings,
+                sorted(control_mappings, key=lambda m: rank.get(m.control_id, len(rank))),
                 evidence_artifacts
             )
             metrics.controls_validated = len(control_mappings)
             metrics.api_calls_individual = len(control_mappings)
             metrics.api_calls_made = metrics.api_calls_individual
         
+        if speculation:
+            # Results for controls not mapped or not batch-validated are dropped
+            metrics.speculative_reused = speculation.reused
+            metrics.speculative_discarded = speculation.discard()
+            metrics.speculative_batch_calls = speculation.batch_calls
+            metrics.api_calls_batch += speculation.batch_calls
+            metrics.api_calls_made += speculation.batch_calls
+        
         update_status(session_id, "validating_oscal", 75, "Validating OSCAL artifacts with OSCAL-CLI")
         
         # Step 6: OSCAL Validation
-        oscal_validation_result = await gemini_service.validate_oscal_artifacts(
-            oscal_components,
-            poam_entries
-        )
+        oscal_validation_result = await gemini_service.validate_oscal_artifacts(oscal_artifacts)
         
         update_status(session_id, "planning", 85, "Agent 5: Generating remediation recommendations...")
         
@@ -727,6 +950,7 @@ async def process_documents_async(
         # Create final analysis result with all validation data
         result = AnalysisResult(
             session_id=session_id,
+            created_at=generated_at,  # Same timestamp as the OSCAL documents
             evidence_artifacts=evidence_artifacts,
             control_mappings=control_mappings,
             control_gaps=control_gaps,
@@ -747,6 +971,16 @@ async def process_documents_async(
         analysis_results[session_id] = result
         
         # Finalize metrics and log
+        metrics.record_prompt_cache(run)
+        metrics.api_calls_coalesced = int(run.count("coalesced_calls"))
+        metrics.batch_retry_calls = int(run.count("batch_retry_calls"))
+        metrics.parse_failure_rates = gemini_service.batch_stats.snapshot()
+        metrics.record_model_tiers(run, gemini_service.router.stats())
+        metrics.record_requirements_cache(run, nist_catalog_service.cache_stats())
+        metrics.batch_sizes = {
+            stage: gemini_service.batch_size(stage) for stage in ("validation", "remediation")
+        }
+        metrics.batch_size_decisions = run.events("batch_size_decisions")
         metrics.finish()
         print(f"\n{'='*80}")
         print(f"PROCESSING METRICS - Session {session_id}")
@@ -756,11 +990,23 @@ async def process_documents_async(
         
         update_status(session_id, "complete", 100, "Analysis complete with NIST & OSCAL validation!")
         
+    except (asyncio.CancelledError, PipelineCancelled):
+        # Session was deleted mid-run: record partial metrics but never write
+        # status/results back, so the freed session is not resurrected
+        metrics.cancelled = True
+        if speculation:
+            speculation.discard()
+        if not metrics.end_time:
+            metrics.finish()
+        print(f"[{session_id}] 🛑 Pipeline cancelled during '{metrics.last_stage}'")
+        raise
     except Exception as e:
         error_msg = f"Error during processing: {str(e)}"
         print(error_msg)
         import traceback
         traceback.print_exc()
+        if speculation:
+            speculation.discard()
         
         # Log metrics even on error
         if session_id in processing_metrics:
@@ -769,10 +1015,15 @@ async def process_documents_async(
             print(f"\nMetrics before error: {json.dumps(metrics.to_dict(), indent=2)}\n")
         
         update_status(session_id, "error", 0, error_msg, error=str(e))
+    finally:
+        run_metrics.unbind(run_token)
 
 
 def update_status(session_id: str, stage: str, progress: int, message: str, error: str = None):
     """Helper to update processing status"""
+    if session_id in processing_metrics:
+        processing_metrics[session_id].last_stage = stage
+    
     status = ProcessingStatus(
         session_id=session_id,
         stage=stage,
@@ -830,10 +1081,22 @@ async def delete_session(session_id: str):
     """
     Clean up session data to prevent memory leaks
     
-    Removes session from processing_sessions, processing_metrics, and analysis_results.
+    Cancels the session's pipeline if it is still running (pending Gemini batch
+    calls and document extraction stop at their next checkpoint), then removes
+    the session from processing_sessions, processing_metrics, and analysis_results.
     Should be called after downloading results or when session is no longer needed.
     """
     deleted = []
+    partial_metrics = None
+    
+    if pipeline_registry.cancel(session_id):
+        deleted.append("pipeline")
+        metrics = processing_metrics.get(session_id)
+        if metrics:
+            metrics.cancelled = True
+            metrics.finish()
+            partial_metrics = metrics.to_dict()
+            print(f"\nPartial metrics for cancelled session: {json.dumps(partial_metrics, indent=2)}\n")
     
     if session_id in processing_sessions:
         del processing_sessions[session_id]
@@ -845,48 +1108,66 @@ async def delete_session(session_id: str):
     
     if session_id in analysis_results:
         del analysis_results[session_id]
+        oscal_exports.invalidate(session_id)
         deleted.append("results")
     
+    # Extracted evidence text must not outlive the session on disk
+    if extraction_cache and extraction_cache.purge_session(session_id):
+        deleted.append("extraction_cache")
+    
     if not deleted:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    return {
+    response = {
         "session_id": session_id,
         "deleted": deleted,
         "message": f"Session cleaned up successfully. Deleted: {', '.join(deleted)}"
     }
+    if partial_metrics:
+        response["partial_metrics"] = partial_metrics
+    return response
 
 
 @app.get("/api/results/{session_id}/oscal")
-async def download_oscal(session_id: str):
-    """Download OSCAL artifacts as JSON"""
+async def download_oscal(session_id: str, request: Request):
+    """
+    Download OSCAL artifacts as JSON
+    
+    The first download streams the document as it is serialized (compressed
+    on the fly for gzip/br per Accept-Encoding); completed bodies are cached
+    per session. The strong ETag is known up front, so clients revalidating
+    with If-None-Match get 304 Not Modified.
+    """
     if session_id not in analysis_results:
         raise HTTPException(status_code=404, detail="Results not found")
     
     result = analysis_results[session_id]
     
-    oscal_output = {
-        "system-security-plan": {
-            "metadata": {
-                "title": "D.A.V.E Generated SSP",
-                "last-modified": datetime.utcnow().isoformat(),
-                "version": "1.0.0",
-                "oscal-version": "1.2.0"
-            },
-            "components": [c.dict() for c in result.oscal_components]
-        },
-        "plan-of-action-and-milestones": {
-            "metadata": {
-                "title": "D.A.V.E Generated POA&M",
-                "last-modified": datetime.utcnow().isoformat(),
-                "version": "1.0.0",
-                "oscal-version": "1.2.0"
-            },
-            "poam-items": [p.dict() for p in result.poam_entries]
-        }
+    export = oscal_exports.get_cached(session_id, result)
+    if export is None:
+        export = await asyncio.to_thread(oscal_exports.build, session_id, result)
+    
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding is None:
+        raise HTTPException(status_code=406, detail="No acceptable content encoding")
+    etag = export.etag(encoding)
+    headers = {
+        **export.headers,
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "private, no-cache"
     }
     
-    return JSONResponse(content=oscal_output)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    
+    body = export.cached_body(encoding)
+    if body is not None:
+        return Response(content=body, media_type="application/json", headers=headers)
+    return StreamingResponse(export.stream(encoding), media_type="application/json", headers=headers)
 
 
 @app.websocket("/ws/{session_id}")
@@ -901,13 +1182,16 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     
     try:
         while True:
-            if session_id in processing_sessions:
-                status = processing_sessions[session_id]
-                await websocket.send_json(status.dict())
-                
-                # Stop if complete or error
-                if status.stage in ["complete", "error"]:
-                    break
+            if session_id not in processing_sessions:
+                # Session was deleted (and its pipeline cancelled)
+                break
+            
+            status = processing_sessions[session_id]
+            await websocket.send_json(status.dict())
+            
+            # Stop if complete or error
+            if status.stage in ["complete", "error"]:
+                break
             
             await asyncio.sleep(1)  # Update every second
             
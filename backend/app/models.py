@@ -147,6 +147,7 @@ class OSCALValidationResult(BaseModel):
     is_valid: bool
     document_type: str  # ssp, poam, assessment-results, etc.
     oscal_version: str = "1.2.0"
+    schema_validated: bool = False  # False: only structure checks ran (no OSCAL-CLI or JSON schema)
     error_count: int = 0
     warning_count: int = 0
     validation_messages: List[str] = Field(default_factory=list)
@@ -12,6 +12,16 @@ from typing import List, Dict, Set, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
+from app.services.nist_catalog_service import prompt_fragments
+
+
+# Per-control tokens beyond the control's own catalog text: prompt template,
+# evidence excerpts and the response (quick: share of a batch call; deep:
+# validation, gap analysis and remediation calls)
+QUICK_OVERHEAD_TOKENS = 150
+DEEP_OVERHEAD_TOKENS = 6500
+SMART_DEEP_SHARE = 0.3  # Share of controls smart mode sends to deep reasoning
+
 
 class BaselineLevel(str, Enum):
     """NIST 800-53 Rev 5 baseline impact levels"""
@@ -379,7 +389,8 @@ class BaselineService:
     def estimate_processing(
         self, 
         control_count: int,
-        mode: str
+        mode: str,
+        control_requirements: Optional[Dict[str, Dict]] = None
     ) -> Dict[str, any]:
         """
         Estimate processing time and token usage based on control count and mode
@@ -389,9 +400,15 @@ class BaselineService:
         - smart: 1000 tokens/control, 1.5s/control (selective deep reasoning)
         - deep: 8000 tokens/control, 5s/control (full deep reasoning)
         
+        With the controls' catalog requirements, tokens are instead counted
+        per control from the prompt fragment each mode actually sends
+        (minimal for quick, full statement, guidance and enhancements for
+        deep), plus the mode's overhead.
+        
         Args:
             control_count: Number of controls to process
             mode: Processing mode ("quick", "smart", "deep")
+            control_requirements: Requirements by control ID (optional)
             
         Returns:
             Dictionary with estimated metrics
@@ -412,6 +429,12 @@ class BaselineService:
         total_tokens = control_count * tokens_per_control
         total_seconds = control_count * seconds_per_control
         
+        if control_requirements:
+            total_tokens = sum(
+                self._estimate_control_tokens(control_id, requirements, mode)
+                for control_id, requirements in control_requirements.items() if requirements
+            )
+        
         # Calculate cost at $5 per million tokens (Gemini pricing)
         cost_usd = round(total_tokens / 1_000_000 * 5, 2)
         
@@ -420,9 +443,22 @@ class BaselineService:
             "estimated_tokens": total_tokens,
             "estimated_minutes": round(total_seconds / 60, 1),
             "estimated_cost_usd": cost_usd,
-            "mode": mode
+            "mode": mode,
+            "token_estimate_basis": "catalog" if control_requirements else "average"
         }
     
+    def _estimate_control_tokens(self, control_id: str, requirements: Dict, mode: str) -> int:
+        """Tokens one control is expected to use in a mode, from its catalog prompt fragments"""
+        fragments = prompt_fragments(control_id, requirements)
+        quick = QUICK_OVERHEAD_TOKENS + fragments["minimal"].tokens
+        if mode == "quick":
+            return quick
+        
+        deep = DEEP_OVERHEAD_TOKENS + fragments["full"].tokens
+        if mode == "smart":
+            return round(SMART_DEEP_SHARE * deep + (1 - SMART_DEEP_SHARE) * quick)
+        return deep
+    
     def get_family_controls(
         self,
         family: str,
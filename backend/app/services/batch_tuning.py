@@ -0,0 +1,183 @@
+"""
+Batch Call Quality Tracking and Batch Size Tuning
+
+Batch validation and remediation calls ask the model for one JSON entry per
+control. A response that cannot be parsed, or that omits or garbles some
+entries, is retried for the affected controls only (see
+GeminiService._resolve_batch); the outcome of every call is recorded here per
+stage and batch size so parse-failure rates can be compared across sizes.
+
+BatchSizeTuner adjusts the controls-per-call of each stage online from the
+same calls: latency, output tokens, parse failures and truncation at
+max_output_tokens.
+"""
+
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+from app.utils import run_metrics
+
+
+MAX_RECENT_DECISIONS = 100  # Decisions kept on the process-wide tuner
+
+
+class BatchParseStats:
+    """Parse outcomes of batch calls by stage and batch size"""
+
+    def __init__(self):
+        # stage -> batch size -> counters
+        self._stats: Dict[str, Dict[int, Dict[str, int]]] = defaultdict(dict)
+        self.retry_calls: Dict[str, int] = defaultdict(int)
+
+    def record(self, stage: str, batch_size: int, missing: int) -> None:
+        """Record one batch call and how many of its controls were missing or invalid"""
+        entry = self._stats[stage].setdefault(batch_size, {"calls": 0, "failures": 0, "controls_missing": 0})
+        entry["calls"] += 1
+        if missing:
+            entry["failures"] += 1
+            entry["controls_missing"] += missing
+
+    def record_retries(self, stage: str, calls: int) -> None:
+        self.retry_calls[stage] += calls
+        run_metrics.add("batch_retry_calls", calls)
+
+    @property
+    def total_retry_calls(self) -> int:
+        return sum(self.retry_calls.values())
+
+    def failure_rate(self, stage: str, batch_size: int) -> float:
+        """Share of calls of this size with at least one missing or invalid entry"""
+        entry = self._stats.get(stage, {}).get(batch_size)
+        if not entry or not entry["calls"]:
+            return 0.0
+        return entry["failures"] / entry["calls"]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Failure rates per stage and batch size (sizes ascending)"""
+        return {
+            stage: {
+                "retry_calls": self.retry_calls.get(stage, 0),
+                "by_batch_size": {
+                    size: {**entry, "failure_rate": round(entry["failures"] / entry["calls"], 4)}
+                    for size, entry in sorted(sizes.items())
+                }
+            }
+            for stage, sizes in self._stats.items()
+        }
+
+
+@dataclass
+class BatchObservation:
+    """One batch call at the size the tuner handed out"""
+    size: int
+    resolved: int
+    seconds: float
+    output_tokens: int = 0
+    truncated: bool = False
+
+
+class BatchSizeTuner:
+    """
+    Online hill-climbing of controls per batch call, per stage
+
+    Every `window` calls the stage's throughput (controls resolved per second
+    of call latency) is compared with the previous window: the size keeps
+    moving in the same direction while throughput rises and turns around when
+    it falls. Parse failures above `failure_threshold` or any response cut off
+    at max_output_tokens shrink the size multiplicatively, and the observed
+    output tokens per control cap it below the output limit. Sizes stay within
+    [min_size, max_size].
+    """
+
+    def __init__(
+        self,
+        initial_sizes: Dict[str, int],
+        min_size: int = 3,
+        max_size: int = 30,
+        max_output_tokens: int = 8192,
+        window: int = 3,
+        failure_threshold: float = 0.25
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_output_tokens = max_output_tokens
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self._sizes = {stage: self._clamp(size) for stage, size in initial_sizes.items()}
+        self._direction: Dict[str, int] = defaultdict(lambda: 1)
+        self._observations: Dict[str, List[BatchObservation]] = defaultdict(list)
+        self._last_throughput: Dict[str, float] = {}
+        # Most recent decisions for logs/debugging; each run's own go to its metrics sink
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=MAX_RECENT_DECISIONS)
+
+    def _clamp(self, size: int) -> int:
+        return max(self.min_size, min(self.max_size, size))
+
+    def size(self, stage: str, default: Optional[int] = None) -> int:
+        """Current controls-per-call for a stage"""
+        if stage not in self._sizes:
+            self._sizes[stage] = self._clamp(default or self.min_size)
+        return self._sizes[stage]
+
+    def sizes(self) -> Dict[str, int]:
+        return dict(self._sizes)
+
+    def observe(
+        self,
+        stage: str,
+        size: int,
+        resolved: int,
+        seconds: float,
+        output_tokens: int = 0,
+        truncated: bool = False
+    ) -> None:
+        """Record one top-level batch call and re-tune once a window is complete"""
+        window = self._observations[stage]
+        window.append(BatchObservation(size, resolved, seconds, output_tokens, truncated))
+        if len(window) >= self.window:
+            self._tune(stage, window)
+            window.clear()
+
+    def _tune(self, stage: str, window: List[BatchObservation]) -> None:
+        current = self.size(stage)
+        failures = sum(1 for obs in window if obs.resolved < obs.size)
+        truncated = any(obs.truncated for obs in window)
+        resolved = sum(obs.resolved for obs in window)
+        throughput = resolved / max(sum(obs.seconds for obs in window), 1e-6)
+
+        # Largest size whose expected output still fits under max_output_tokens
+        output_tokens = sum(obs.output_tokens for obs in window)
+        ceiling = self.max_size
+        if output_tokens and resolved:
+            ceiling = max(self.min_size, int(0.8 * self.max_output_tokens / (output_tokens / resolved)))
+
+        if truncated or failures / len(window) > self.failure_threshold:
+            target = int(current * 0.7)
+            self._direction[stage] = -1
+            reason = "truncated response" if truncated else f"parse failures {failures}/{len(window)}"
+        else:
+            previous = self._last_throughput.get(stage)
+            if previous is not None and throughput < previous:
+                self._direction[stage] = -self._direction[stage]
+                reason = "throughput fell"
+            else:
+                reason = "throughput rose" if previous is not None else "probe"
+            target = current + self._direction[stage] * max(1, current // 5)
+
+        new_size = self._clamp(min(target, ceiling))
+        self._last_throughput[stage] = throughput
+        if new_size != current:
+            self._sizes[stage] = new_size
+            decision = {
+                "stage": stage,
+                "from": current,
+                "to": new_size,
+                "reason": reason,
+                "controls_per_second": round(throughput, 3),
+                "at": time.time()
+            }
+            self.decisions.append(decision)
+            run_metrics.append("batch_size_decisions", decision)
+            print(f"🎛️  Batch size {stage}: {current} -> {new_size} ({reason}, {throughput:.2f} controls/s)")
@@ -0,0 +1,341 @@
+"""
+Compiled NIST Catalog Snapshot
+
+Every worker process (uvicorn workers, celery workers) otherwise parses the
+catalog JSON and holds its own copy of every control. In the `mmap` catalog
+mode the parsed catalog, with its precomputed prompt fragments, is compiled
+once into a binary snapshot file that each process memory-maps read-only, so
+the text lives in shared page cache and a worker only keeps a small index of
+row objects. Text is decoded when a field is read.
+
+Layout (little-endian):
+- header: magic, version, row counts, source catalog size and mtime, blob
+  offset, the catalog metadata JSON and a fingerprint of the code that
+  renders prompt fragments and counts their token features
+- control rows: string refs (offset, length) for each field and prompt
+  fragment, the range of the control's enhancement rows, each fragment's
+  length and raw (uncalibrated) token count
+- enhancement rows, family rows (controls are stored in family order)
+- string blob: UTF-8 text, each distinct string stored once
+
+Build it ahead of starting workers with `python -m app.services.catalog_snapshot`;
+otherwise the first process to load a missing or outdated snapshot compiles it.
+A snapshot is outdated when the source catalog, the format version or the
+fragment fingerprint changed.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+from types import MappingProxyType
+from types import CodeType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from app.services.nist_catalog_service import (
+    PROMPT_FRAGMENT_LEVELS,
+    CatalogControl,
+    CatalogEnhancement,
+    NISTCatalogService,
+    build_prompt_fragments,
+)
+from app.services.token_estimator import get_token_estimator, raw_token_count, token_features
+from app.utils.cache_paths import cache_path
+
+
+SNAPSHOT_MAGIC = b"DAVECAT\x00"
+SNAPSHOT_VERSION = 2
+
+DEFAULT_SNAPSHOT_FILE = cache_path("nist-catalog.snapshot")
+
+_NONE = 0xFFFFFFFF  # Length of a ref to None
+
+_HEADER = struct.Struct("<8sIIIIQQQII16s")
+_REF = struct.Struct("<II")
+_CONTROL_FIELDS = (
+    "id", "title", "class_type", "family", "statement", "guidance", "related_controls", "properties"
+)
+_ENHANCEMENT_FIELDS = ("id", "title", "statement", "guidance", "related_controls")
+_CONTROL_ROW = struct.Struct("<" + "II" * (len(_CONTROL_FIELDS) + len(PROMPT_FRAGMENT_LEVELS)) + "II" + "II" * len(PROMPT_FRAGMENT_LEVELS))
+_ENHANCEMENT_ROW = struct.Struct("<" + "II" * len(_ENHANCEMENT_FIELDS))
+_FAMILY_ROW = struct.Struct("<IIIIII")
+
+
+class _StringTable:
+    """Blob of distinct UTF-8 strings being written"""
+
+    def __init__(self):
+        self._refs: Dict[str, Tuple[int, int]] = {}
+        self._chunks: List[bytes] = []
+        self._size = 0
+
+    def ref(self, text: Optional[str]) -> Tuple[int, int]:
+        if text is None:
+            return (0, _NONE)
+        if text not in self._refs:
+            data = text.encode("utf-8")
+            self._refs[text] = (self._size, len(data))
+            self._chunks.append(data)
+            self._size += len(data)
+        return self._refs[text]
+
+    def data(self) -> bytes:
+        return b"".join(self._chunks)
+
+
+def _hash_code(digest, code: CodeType, namespace: Dict) -> None:
+    """Feed a function's bytecode, constants and the module constants it reads to a digest"""
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _hash_code(digest, const, namespace)  # Nested comprehensions and functions
+        elif isinstance(const, frozenset):
+            digest.update(repr(sorted(map(repr, const))).encode("utf-8"))  # Hash-seed independent
+        else:
+            digest.update(repr(const).encode("utf-8"))
+    for name in code.co_names:
+        value = namespace.get(name)
+        value = getattr(value, "pattern", value)  # Compiled regexes by their pattern
+        if isinstance(value, (str, bytes, int, float, tuple)):
+            digest.update(f"{name}={value!r}".encode("utf-8"))
+
+
+def fragment_fingerprint() -> bytes:
+    """Digest of the fragment templates and token counting code the stored fragments depend on"""
+    digest = hashlib.sha256(repr(PROMPT_FRAGMENT_LEVELS).encode("utf-8"))
+    for function in (build_prompt_fragments, token_features, raw_token_count):
+        _hash_code(digest, function.__code__, function.__globals__)
+    return digest.digest()[:16]
+
+
+def _source_signature(catalog_path: Path) -> Tuple[int, int]:
+    """(size, mtime_ns) of the source catalog, or zeros when it is absent"""
+    try:
+        stat = catalog_path.stat()
+    except OSError:
+        return 0, 0
+    return stat.st_size, stat.st_mtime_ns
+
+
+def compile_snapshot(catalog_path: Path, snapshot_path: Path) -> Path:
+    """Parse the catalog JSON and write its snapshot (atomically replacing any existing one)"""
+    catalog_path, snapshot_path = Path(catalog_path), Path(snapshot_path)
+    service = NISTCatalogService(catalog_path)
+    service.load_catalog()
+
+    strings = _StringTable()
+    control_rows, enhancement_rows, family_rows = [], [], []
+    for family in service.get_all_families():
+        start = len(control_rows)
+        for control_id in family.controls:
+            control = service.get_control_record(control_id)
+            fragments = service._prompt_fragments[control.id]
+            enhancement_start = len(enhancement_rows)
+            for enhancement in control.enhancements:
+                enhancement_rows.append(_ENHANCEMENT_ROW.pack(*(
+                    value for text in (
+                        enhancement.id, enhancement.title, enhancement.statement, enhancement.guidance,
+                        ",".join(enhancement.related_controls)
+                    ) for value in strings.ref(text)
+                )))
+            texts = (
+                control.id, control.title, control.class_type, control.family, control.statement,
+                control.guidance, ",".join(control.related_controls), json.dumps(control.properties),
+                *(fragments[level].text for level in PROMPT_FRAGMENT_LEVELS)
+            )
+            control_rows.append(_CONTROL_ROW.pack(
+                *(value for text in texts for value in strings.ref(text)),
+                enhancement_start, len(control.enhancements),
+                *(count for level in PROMPT_FRAGMENT_LEVELS
+                  for count in (fragments[level].chars, fragments[level].raw_tokens))
+            ))
+        family_rows.append(_FAMILY_ROW.pack(
+            *strings.ref(family.id), *strings.ref(family.title), start, len(control_rows) - start
+        ))
+
+    metadata_ref = strings.ref(json.dumps(service._catalog_data.get("catalog", {})))
+    tables = b"".join(control_rows) + b"".join(enhancement_rows) + b"".join(family_rows)
+    source_size, source_mtime = _source_signature(catalog_path)
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(control_rows), len(enhancement_rows), len(family_rows),
+        source_size, source_mtime, _HEADER.size + len(tables), *metadata_ref, fragment_fingerprint()
+    )
+
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = snapshot_path.with_name(f"{snapshot_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(tables)
+        f.write(strings.data())
+    os.replace(tmp, snapshot_path)
+    return snapshot_path
+
+
+def snapshot_is_current(snapshot_path: Path, catalog_path: Path) -> bool:
+    """Whether the snapshot exists, has this format version and fragment code, and matches the source catalog"""
+    try:
+        with open(snapshot_path, "rb") as f:
+            header = f.read(_HEADER.size)
+    except OSError:
+        return False
+    if len(header) < _HEADER.size:
+        return False
+    magic, version, *_, source_size, source_mtime, _, _, _, fingerprint = _HEADER.unpack(header)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or fingerprint != fragment_fingerprint():
+        return False
+    # A snapshot shipped without the source catalog is used as is
+    signature = _source_signature(Path(catalog_path))
+    return signature == (0, 0) or signature == (source_size, source_mtime)
+
+
+class CatalogSnapshot:
+    """Read-only memory map of a compiled catalog snapshot"""
+
+    def __init__(self, snapshot_path: Path):
+        self.path = Path(snapshot_path)
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.control_count, self.enhancement_count, self.family_count,
+         _, _, self._blob, *metadata_ref, _) = _HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"Not a version {SNAPSHOT_VERSION} catalog snapshot: {self.path}")
+        self._controls_at = _HEADER.size
+        self._enhancements_at = self._controls_at + self.control_count * _CONTROL_ROW.size
+        self._families_at = self._enhancements_at + self.enhancement_count * _ENHANCEMENT_ROW.size
+        self.metadata = json.loads(self._text(*metadata_ref))
+
+    def _text(self, offset: int, length: int) -> Optional[str]:
+        if length == _NONE:
+            return None
+        start = self._blob + offset
+        return self._map[start:start + length].decode("utf-8")
+
+    def _ref(self, table_at: int, row_size: int, row: int, index: int) -> Tuple[int, int]:
+        return _REF.unpack_from(self._map, table_at + row * row_size + index * _REF.size)
+
+    def control_field(self, row: int, index: int) -> Optional[str]:
+        return self._text(*self._ref(self._controls_at, _CONTROL_ROW.size, row, index))
+
+    def enhancement_field(self, row: int, index: int) -> Optional[str]:
+        return self._text(*self._ref(self._enhancements_at, _ENHANCEMENT_ROW.size, row, index))
+
+    def _control_tail(self, row: int) -> Tuple[int, ...]:
+        """(enhancement start, enhancement count, (fragment length, raw token count) per level...)"""
+        offset = self._controls_at + row * _CONTROL_ROW.size + _REF.size * (len(_CONTROL_FIELDS) + len(PROMPT_FRAGMENT_LEVELS))
+        return struct.unpack_from("<II" + "II" * len(PROMPT_FRAGMENT_LEVELS), self._map, offset)
+
+    def enhancement_rows(self, row: int) -> range:
+        start, count = self._control_tail(row)[:2]
+        return range(start, start + count)
+
+    def fragments(self, row: int) -> Mapping[str, "MappedPromptFragment"]:
+        counts = self._control_tail(row)[2:]
+        return MappingProxyType({
+            level: MappedPromptFragment(self, row, len(_CONTROL_FIELDS) + i, counts[2 * i], counts[2 * i + 1])
+            for i, level in enumerate(PROMPT_FRAGMENT_LEVELS)
+        })
+
+    def families(self) -> List[Tuple[str, str, range]]:
+        """(family ID, title, control rows) in catalog order"""
+        families = []
+        for row in range(self.family_count):
+            id_off, id_len, title_off, title_len, start, count = _FAMILY_ROW.unpack_from(
+                self._map, self._families_at + row * _FAMILY_ROW.size
+            )
+            families.append((
+                sys.intern(self._text(id_off, id_len)), self._text(title_off, title_len), range(start, start + count)
+            ))
+        return families
+
+
+def _mapped_field(index: int, reader: str) -> property:
+    return property(lambda self: getattr(self._snapshot, reader)(self._row, index))
+
+
+class MappedEnhancement(CatalogEnhancement):
+    """Enhancement record whose text is read from the snapshot on access"""
+    __slots__ = ("_snapshot", "_row")
+
+    def __init__(self, snapshot: CatalogSnapshot, row: int):
+        object.__setattr__(self, "_snapshot", snapshot)
+        object.__setattr__(self, "_row", row)
+
+    id = _mapped_field(0, "enhancement_field")
+    title = _mapped_field(1, "enhancement_field")
+    statement = _mapped_field(2, "enhancement_field")
+    guidance = _mapped_field(3, "enhancement_field")
+
+    @property
+    def related_controls(self) -> tuple:
+        related = self._snapshot.enhancement_field(self._row, 4)
+        return tuple(related.split(",")) if related else ()
+
+
+class MappedControl(CatalogControl):
+    """Control record whose text is read from the snapshot on access"""
+    __slots__ = ("_snapshot", "_row")
+
+    def __init__(self, snapshot: CatalogSnapshot, row: int):
+        object.__setattr__(self, "_snapshot", snapshot)
+        object.__setattr__(self, "_row", row)
+
+    id = _mapped_field(0, "control_field")
+    title = _mapped_field(1, "control_field")
+    class_type = _mapped_field(2, "control_field")
+    family = _mapped_field(3, "control_field")
+    statement = _mapped_field(4, "control_field")
+    guidance = _mapped_field(5, "control_field")
+
+    @property
+    def related_controls(self) -> tuple:
+        related = self._snapshot.control_field(self._row, 6)
+        return tuple(related.split(",")) if related else ()
+
+    @property
+    def properties(self) -> tuple:
+        return tuple(tuple(pair) for pair in json.loads(self._snapshot.control_field(self._row, 7)))
+
+    @property
+    def enhancements(self) -> tuple:
+        return tuple(MappedEnhancement(self._snapshot, row) for row in self._snapshot.enhancement_rows(self._row))
+
+
+class MappedPromptFragment:
+    """Prompt fragment whose text is read from the snapshot on access"""
+    __slots__ = ("_snapshot", "_row", "_index", "chars", "raw_tokens")
+
+    def __init__(self, snapshot: CatalogSnapshot, row: int, index: int, chars: int, raw_tokens: int):
+        self._snapshot = snapshot
+        self._row = row
+        self._index = index
+        self.chars = chars
+        self.raw_tokens = raw_tokens
+
+    @property
+    def text(self) -> str:
+        return self._snapshot.control_field(self._row, self._index)
+
+    @property
+    def tokens(self) -> int:
+        """Estimated tokens under the token estimator's current calibration"""
+        return get_token_estimator().estimate_counted(self.chars, self.raw_tokens)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile the NIST catalog snapshot used by the mmap catalog mode")
+    parser.add_argument("--catalog", default=None, help="Source catalog JSON (default: bundled catalog)")
+    parser.add_argument("--output", default=DEFAULT_SNAPSHOT_FILE)
+    args = parser.parse_args()
+
+    catalog_path = NISTCatalogService(args.catalog).catalog_path
+    path = compile_snapshot(catalog_path, Path(args.output))
+    print(f"Wrote catalog snapshot {path} ({path.stat().st_size / 2**20:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,118 @@
 import google.generativeai as genai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Optional
+import asyncio
 import json
 import base64
+import hashlib
+import time
 import uuid
 from datetime import datetime
 
 from app.config import get_settings
 from app.models import (
     EvidenceArtifact, EvidenceType, ControlMapping, ControlGap, 
-    OSCALComponent, POAMEntry, RemediationTask, RiskLevel, ControlFamily,
+    RemediationTask, RiskLevel, ControlFamily,
     NISTValidationResult, OSCALValidationResult
 )
-from app.services.nist_catalog_service import get_nist_catalog_service
-from app.services.oscal_validator import get_oscal_validator_service
+from app.services.nist_catalog_service import get_nist_catalog_service, prompt_fragments
+from app.services.oscal_validator import OSCALDocumentType, get_oscal_validator_service
+from app.services.oscal_builder import OSCALBuilder, OSCALArtifacts
+from app.services.token_estimator import (
+    DEFAULT_CALIBRATION_FILE, PromptBudget, estimate_tokens, get_token_estimator
+)
+from app.services.prompt_cache import PromptPrefix, create_prompt_cache
+from app.services.batch_tuning import BatchParseStats, BatchSizeTuner
+from app.services.model_router import DEFAULT_TIER, MODEL_TIERS, create_model_router
+from app.utils.single_flight import SingleFlight
+from app.utils.text_sections import chunk_sections
+
+
+RESPONSE_TOKENS_PER_CONTROL = 150  # Typical size of one control's entry in a batch validation response
+ENTRY_SEPARATOR_TOKENS = 3  # Blank lines around one control's entry in a batch prompt
+
+# Per-control validation prompt modes, richest first
+PROMPT_MODES = ("detailed", "concise", "minimal")
+# Richest mode each priority tier may use in adaptive mode
+PROMPT_MODE_BY_TIER = {"critical": "detailed", "standard": "concise", "passing": "minimal"}
+MINIMAL_PROMPT_TOKENS = 200  # Reserved per not-yet-sent control in adaptive mode
+
+VALIDATION_RESPONSE_FORMAT = """Respond with these sections, one bullet per item:
+Requirements satisfied:
+- ...
+Requirements not satisfied:
+- ...
+Recommendations:
+- ..."""
+
+# System instructions of cached validation prefixes (family guidance blocks)
+VALIDATION_INSTRUCTIONS = """You are a NIST 800-53 Rev 5 assessor validating submitted evidence against control requirements.
+The family catalog in context is the authoritative statement, guidance and enhancement text for each control.
+Judge each control only on the evidence supplied in the request and follow the response format the request gives."""
+
+REMEDIATION_REASONING_INTRO = """You are an expert cybersecurity implementation consultant with deep knowledge of NIST 800-53 Rev 5.
+
+Use deep reasoning and step-by-step thinking to analyze this compliance gap and provide actionable remediation guidance."""
+
+REMEDIATION_REASONING_TASK = """**REASONING TASK:**
+Using deep, step-by-step reasoning:
+
+1. **ANALYZE THE ROOT CAUSE:**
+   - Why does this gap exist?
+   - What are the underlying issues?
+   - What context from the NIST guidance is relevant?
+
+2. **CONSIDER MULTIPLE APPROACHES:**
+   - What are 2-3 different ways to address this?
+   - What are the trade-offs (cost, complexity, time)?
+   - Which approach best aligns with NIST guidance?
+
+3. **RECOMMEND THE OPTIMAL SOLUTION:**
+   - What is your recommended approach and why?
+   - What specific steps should be taken?
+   - What tools, configurations, or processes are needed?
+
+4. **PROVIDE IMPLEMENTATION DETAILS:**
+   - Concrete code snippets or configuration examples
+   - Step-by-step implementation guide
+   - Verification procedures
+
+5. **CONNECT TO NIST GUIDANCE:**
+   - How does your recommendation align with the supplemental guidance?
+   - What related controls should be considered?
+   - How does this fit into the broader security posture?
+
+**FORMAT:** Provide your reasoning process, then the final recommendation with implementation details.
+"""
+
+
+def _update_prompt_digest(digest, contents) -> None:
+    """Feed prompt contents (text, inline data parts, lists of either) into a hash"""
+    if isinstance(contents, str):
+        digest.update(b"s" + contents.encode("utf-8"))
+    elif isinstance(contents, (bytes, bytearray)):
+        digest.update(b"b" + bytes(contents))
+    elif isinstance(contents, dict):
+        for name in sorted(contents):
+            digest.update(b"k" + str(name).encode("utf-8"))
+            _update_prompt_digest(digest, contents[name])
+    elif isinstance(contents, (list, tuple)):
+        digest.update(b"[%d" % len(contents))
+        for part in contents:
+            _update_prompt_digest(digest, part)
+    else:
+        digest.update(b"r" + repr(contents).encode("utf-8"))
+    digest.update(b"\x00")
+
+
+def prompt_key(model, contents) -> str:
+    """Identity of a request: the model object it goes to and a hash of its contents"""
+    digest = hashlib.sha256()
+    _update_prompt_digest(digest, contents)
+    return f"{id(model)}:{digest.hexdigest()}"
+
+
+class ControlMappingError(RuntimeError):
+    """Control mapping could not assess an in-scope control"""
 
 
 class GeminiService:
@@ -23,20 +123,171 @@ class GeminiService:
         genai.configure(api_key=self.settings.google_ai_api_key)
         
         # Use Gemini 3 with thinking/reasoning mode
-        self.model = genai.GenerativeModel(
-            self.settings.gemini_model,
-            generation_config={
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-            }
+        generation_config = {
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+        }
+        # One client per model tier (fast, standard, reasoning); calls are routed by stage and risk
+        self.router = create_model_router(self.settings, generation_config, genai.GenerativeModel)
+        self.model = self.router.model(DEFAULT_TIER)
+        
+        # Stable prompt prefixes uploaded once per model (None when prompt_cache_mode is off)
+        self.prompt_cache = create_prompt_cache(
+            self.settings,
+            self.model,
+            generation_config,
+            models={self.router.model_name(tier): self.router.model(tier) for tier in MODEL_TIERS}
         )
+        self._family_prefixes: Dict[str, PromptPrefix] = {}
         
         # Initialize NIST catalog service
         self.nist_service = get_nist_catalog_service()
         self.oscal_validator = get_oscal_validator_service()
         
+        # Identical prompts in flight at the same time (e.g. the same policy
+        # uploaded by several sessions) share one request
+        self.single_flight = SingleFlight()
+        
+        # Parse outcomes of batch calls per stage and batch size
+        self.batch_stats = BatchParseStats()
+        
+        # Controls per batch call, tuned online per stage (None: static config sizes)
+        self.batch_tuner = BatchSizeTuner(
+            {
+                "validation": self.settings.batch_validation_size,
+                "remediation": self.settings.batch_remediation_size
+            },
+            min_size=self.settings.batch_size_min,
+            max_size=self.settings.batch_size_max,
+            max_output_tokens=generation_config["max_output_tokens"]
+        ) if self.settings.batch_autotune else None
+        
+        # Local token counts calibrated against the counts the API reports
+        if self.settings.token_calibration_enabled:
+            get_token_estimator().use_calibration_file(
+                self.settings.token_calibration_file or DEFAULT_CALIBRATION_FILE
+            )
+    
+    async def _generate_content(self, contents, model=None, stage: str = None, risk=None, tier: str = DEFAULT_TIER):
+        """
+        Call the model routed for a stage (or a model bound to a cached prefix)
+        
+        The stage and risk tier select the model tier; a failed call is
+        retried on the next tier in model_fallback_order. Concurrent calls
+        with the same contents for the same model are coalesced into one
+        request whose response every caller receives.
+        """
+        if model is not None:
+            tiers = [tier]
+        else:
+            tiers = self.router.candidates(stage, risk)
+        
+        for index, tier in enumerate(tiers):
+            call_model = model or self.router.model(tier)
+            try:
+                return await self.single_flight.do(
+                    prompt_key(call_model, contents),
+                    lambda: self._call_model(call_model, contents, tier)
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if index == len(tiers) - 1:
+                    raise
+                self.router.record_fallback(tier)
+                print(f"⚠️  {tier} model failed for {stage} ({e}); falling back to {tiers[index + 1]}")
+    
+    async def _call_model(self, model, contents, tier: str = DEFAULT_TIER):
+        """Send one request and record its latency, tokens and cost on its tier"""
+        start = time.perf_counter()
+        try:
+            response = await model.generate_content_async(contents)
+        except Exception:
+            self.router.record(tier, time.perf_counter() - start, failed=True)
+            raise
+        elapsed = time.perf_counter() - start
+        self.router.record(tier, elapsed, contents, response)
+        self._calibrate_tokens(contents, response)
+        estimator = get_token_estimator()
+        if estimator.flush_due:
+            await asyncio.to_thread(estimator.flush)
+        return response
+    
+    def _calibrate_tokens(self, contents, response) -> None:
+        """Feed the prompt token count of a plain-text call to the local token estimator"""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        cached_tokens = getattr(usage, "cached_content_token_count", 0)
+        if not isinstance(contents, str) or not isinstance(prompt_tokens, int):
+            return
+        if isinstance(cached_tokens, int) and cached_tokens:
+            return  # Count covers a cached prefix that is not in contents
+        get_token_estimator().observe(contents, prompt_tokens)
+    
+    async def _generate_with_prefix(self, prefix: PromptPrefix, suffix: str, stage: str = None, risk=None):
+        """
+        Send a prompt whose stable prefix may be cached
+        
+        With a cached prefix (held per model of the routed tier) only the
+        suffix is sent; otherwise (prefix too small, or the cached content was
+        rejected) the whole prompt goes inline, with tier fallback.
+        """
+        tier = self.router.tier_for(stage, risk)
+        model_name = self.router.model_name(tier)
+        model = await self.prompt_cache.model_for(prefix, model_name) if self.prompt_cache else None
+        if model is not None:
+            try:
+                return await self._generate_content(suffix, model=model, tier=tier)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  Cached prefix {prefix.kind} {prefix.name} rejected ({e}); sending inline")
+                self.prompt_cache.invalidate(prefix, model_name)
+        return await self._generate_content(prefix.inline(suffix), stage=stage, risk=risk)
+    
+    def _uses_cached_prefix(self, prefix: PromptPrefix) -> bool:
+        return self.prompt_cache is not None and self.prompt_cache.is_cacheable(prefix)
+    
+    def family_guidance_prefix(self, family_code: str) -> PromptPrefix:
+        """
+        Family guidance block: statement, guidance and enhancements of every
+        control in the family, identical across sessions
+        """
+        if family_code not in self._family_prefixes:
+            family_info = self._get_family_info(family_code)
+            blocks = [
+                f"NIST 800-53 Rev 5 {family_code} ({family_info['name']}) family catalog",
+                f"The {family_code} family focuses on {family_info['focus']}."
+            ]
+            for control in self.nist_service.get_controls_by_family(family_code):
+                req = self.nist_service.get_control_requirements(control["id"])
+                full = prompt_fragments(control["id"], req)["full"]
+                blocks.append(f"### {req['control_id']}: {req['title']}\n{full.text}")
+            self._family_prefixes[family_code] = PromptPrefix(
+                kind="family-guidance",
+                name=family_code,
+                instructions=VALIDATION_INSTRUCTIONS,
+                text="\n\n".join(blocks)
+            )
+        return self._family_prefixes[family_code]
+    
+    def evidence_digest_prefix(self, evidence_artifacts: List[EvidenceArtifact]) -> PromptPrefix:
+        """Session evidence digest behind the deep-reasoning remediation instructions"""
+        digest = "\n".join(
+            f"--- {a.id}: {a.filename} ({a.file_type.value}) ---\n{a.content_summary}\n"
+            f"Controls mentioned: {', '.join(a.controls_mentioned) or 'none'}"
+            for a in evidence_artifacts
+        ) or "No evidence artifacts."
+        text = f"**EVIDENCE DIGEST ({len(evidence_artifacts)} artifacts):**\n{digest}"
+        return PromptPrefix(
+            kind="evidence-digest",
+            name=hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+            instructions=f"{REMEDIATION_REASONING_INTRO}\n\n{REMEDIATION_REASONING_TASK}",
+            text=text
+        )
+        
     def _encode_image(self, image_data: bytes) -> str:
         """Encode image data to base64"""
         return base64.b64encode(image_data).decode('utf-8')
@@ -100,13 +351,13 @@ class GeminiService:
         Args:
             control_ids: List of control IDs to validate
             evidence_artifacts: Evidence to check against
-            batch_size: Controls per batch (default from config)
+            batch_size: Controls per batch (default: tuned or configured size)
         
         Returns:
             List of NISTValidationResult for all controls
         """
         if batch_size is None:
-            batch_size = self.settings.batch_validation_size
+            batch_size = self.batch_size("validation")
         
         results = []
         
@@ -117,19 +368,20 @@ class GeminiService:
             # Load NIST requirements for batch (uses caching)
             batch_requirements = self.nist_service.get_control_requirements_batch(batch)
             
-            # Build concise validation prompt
-            prompt = self._build_batch_validation_prompt(
-                batch_requirements,
-                evidence_artifacts
-            )
-            
-            # Call Gemini with structured output
-            print(f"🔄 GEMINI API CALL: validate_controls_batch ({len(batch)} controls)")
-            response = await self.model.generate_content_async(prompt)
-            print(f"✅ GEMINI API RESPONSE: {len(response.text)} chars")
-            batch_results = self._parse_batch_validation_response(response.text, batch, batch_requirements)
+            async def attempt(control_ids: List[str]):
+                # Call Gemini with structured output
+                print(f"🔄 GEMINI API CALL: validate_controls_batch ({len(control_ids)} controls)")
+                response = await self._generate_content(self._build_batch_validation_prompt(
+                    {cid: batch_requirements[cid] for cid in control_ids}, evidence_artifacts
+                ), stage="batch_validation")
+                print(f"✅ GEMINI API RESPONSE: {len(response.text)} chars")
+                return self._parse_batch_validation_items(response.text, control_ids, batch_requirements), response
             
-            results.extend(batch_results)
+            resolved = await self._resolve_batch("validation", batch, attempt)
+            results.extend(
+                resolved.get(cid) or self._validation_fallback(cid, batch_requirements, "no valid entry in batch response")
+                for cid in batch
+            )
         
         return results
     
@@ -146,12 +398,10 @@ class GeminiService:
             evidence_summary.append(f"- {artifact.filename}: {artifact.content_summary[:100]}")
         
         # Build control requirements
-        controls_section = []
-        for control_id, req in batch_requirements.items():
-            controls_section.append(f"""
-{control_id}: {req['title']}
-Statement: {req['statement'][:200]}...
-""")
+        controls_section = [
+            f"\n{prompt_fragments(control_id, req)['minimal'].text}\n"
+            for control_id, req in batch_requirements.items()
+        ]
         
         prompt = f"""Validate NIST 800-53 controls against evidence. Respond in JSON only.
 
@@ -176,49 +426,152 @@ Response format (JSON only, no markdown):
         
         return prompt
     
-    def _parse_batch_validation_response(
-        self,
-        response_text: str,
-        control_ids: List[str],
-        batch_requirements: Dict[str, Dict[str, Any]]
-    ) -> List[NISTValidationResult]:
-        """Parse batch validation JSON response"""
+    def _load_batch_json(self, response_text: str) -> Optional[Dict[str, Any]]:
+        """JSON object of a batch response (markdown fences stripped), or None"""
         try:
-            # Clean markdown if present
             if "```json" in response_text:
                 response_text = response_text.split("```json")[1].split("```")[0]
             elif "```" in response_text:
                 response_text = response_text.split("```")[1].split("```")[0]
-            
             data = json.loads(response_text.strip())
-            results = []
-            
-            for validation in data.get("validations", []):
-                results.append(NISTValidationResult(
-                    control_id=validation["control_id"],
-                    control_title=validation.get("control_title", batch_requirements.get(validation["control_id"], {}).get("title", "Unknown")),
+        except (ValueError, IndexError):
+            return None
+        return data if isinstance(data, dict) else None
+    
+    def batch_size(self, stage: str) -> int:
+        """Controls per batch call for a stage (tuned when batch_autotune is on)"""
+        default = (
+            self.settings.batch_validation_size if stage == "validation"
+            else self.settings.batch_remediation_size
+        )
+        if self.batch_tuner is None:
+            return default
+        return self.batch_tuner.size(stage, default)
+    
+    def _response_usage(self, response) -> tuple[int, bool]:
+        """(output tokens, cut off at max_output_tokens) from a response's metadata"""
+        usage = getattr(response, "usage_metadata", None)
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        truncated = False
+        candidates = getattr(response, "candidates", None) or []
+        if candidates:
+            finish_reason = getattr(candidates[0], "finish_reason", None)
+            truncated = getattr(finish_reason, "name", finish_reason) in ("MAX_TOKENS", 2)
+        return (output_tokens if isinstance(output_tokens, int) else 0), truncated
+    
+    async def _resolve_batch(
+        self,
+        stage: str,
+        keys: List[str],
+        attempt,
+        top_level: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Batch Failure Bisection
+        Run one batch call and retry only what it did not resolve
+        
+        attempt(keys) makes the call and returns the parsed entries it could
+        validate, by key, with the raw response. When every entry is missing
+        (unparseable or truncated response) the keys are split in half and
+        each half retried; when only some are missing, just those are retried
+        together. Each retry is a strictly smaller batch, so recursion ends at
+        single controls, and keys still missing then are left for the caller's
+        fallback. The first call of each batch is reported to the batch size
+        tuner; retries are not, as their size was not the tuner's choice.
+        """
+        start = time.perf_counter()
+        resolved, response = await attempt(keys)
+        missing = [key for key in keys if key not in resolved]
+        self.batch_stats.record(stage, len(keys), len(missing))
+        if top_level and self.batch_tuner is not None:
+            output_tokens, truncated = self._response_usage(response)
+            self.batch_tuner.observe(
+                stage,
+                len(keys),
+                len(keys) - len(missing),
+                time.perf_counter() - start,
+                output_tokens=output_tokens,
+                truncated=truncated
+            )
+        if not missing or len(keys) == 1:
+            return resolved
+        
+        if len(missing) == len(keys):
+            middle = len(missing) // 2
+            retries = [missing[:middle], missing[middle:]]
+        else:
+            retries = [missing]
+        self.batch_stats.record_retries(stage, len(retries))
+        print(f"↩️  {stage} batch of {len(keys)}: {len(missing)} unresolved, retrying as {[len(r) for r in retries]}")
+        
+        # Sequential, so retries stay within the caller's concurrency slot
+        for retry in retries:
+            resolved.update(await self._resolve_batch(stage, retry, attempt, top_level=False))
+        return resolved
+    
+    def _parse_batch_validation_items(
+        self,
+        response_text: str,
+        control_ids: List[str],
+        batch_requirements: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, NISTValidationResult]:
+        """Valid entries of a batch validation response for the requested controls"""
+        data = self._load_batch_json(response_text)
+        if data is None:
+            return {}
+        
+        wanted = set(control_ids)
+        results = {}
+        for validation in data.get("validations") or []:
+            try:
+                control_id = validation["control_id"]
+                if control_id not in wanted or control_id in results:
+                    continue
+                results[control_id] = NISTValidationResult(
+                    control_id=control_id,
+                    control_title=validation.get("control_title", batch_requirements.get(control_id, {}).get("title", "Unknown")),
                     is_valid=validation["is_valid"],
                     coverage_score=float(validation["coverage_score"]),
                     requirements_met=validation.get("requirements_met", []),
                     requirements_not_met=validation.get("requirements_not_met", []),
                     recommendations=[]
-                ))
-            
-            return results
-        except Exception as e:
-            # Fallback: create non-valid results
-            return [
-                NISTValidationResult(
-                    control_id=cid,
-                    control_title="Unknown",
-                    is_valid=False,
-                    coverage_score=0.0,
-                    requirements_met=[],
-                    requirements_not_met=[f"Validation error: {str(e)}"],
-                    recommendations=[]
                 )
-                for cid in control_ids
-            ]
+            except (KeyError, TypeError, ValueError):
+                continue  # Invalid entry: treated as missing
+        
+        return results
+    
+    def _validation_fallback(
+        self,
+        control_id: str,
+        batch_requirements: Dict[str, Dict[str, Any]],
+        reason: str
+    ) -> NISTValidationResult:
+        """Non-valid result for a control the model gave no usable entry for"""
+        return NISTValidationResult(
+            control_id=control_id,
+            control_title=(batch_requirements.get(control_id) or {}).get("title", "Unknown"),
+            is_valid=False,
+            coverage_score=0.0,
+            requirements_met=[],
+            requirements_not_met=[f"Validation error: {reason}"],
+            recommendations=[]
+        )
+    
+    def _parse_batch_validation_response(
+        self,
+        response_text: str,
+        control_ids: List[str],
+        batch_requirements: Dict[str, Dict[str, Any]]
+    ) -> List[NISTValidationResult]:
+        """Parse batch validation JSON response (non-valid results if nothing parses)"""
+        results = self._parse_batch_validation_items(response_text, control_ids, batch_requirements)
+        if results:
+            return list(results.values())
+        return [
+            self._validation_fallback(cid, batch_requirements, "unparseable batch response")
+            for cid in control_ids
+        ]
     
     async def _batch_remediation(
         self,
@@ -234,25 +587,40 @@ Response format (JSON only, no markdown):
         Args:
             control_gaps: Gaps to remediate
             evidence_artifacts: Context evidence
-            batch_size: Gaps per batch (default from config)
+            batch_size: Gaps per batch (default: tuned or configured size)
         
         Returns:
             List of RemediationTask with concise recommendations
         """
         if batch_size is None:
-            batch_size = self.settings.batch_remediation_size
+            batch_size = self.batch_size("remediation")
         
         tasks = []
         
         # Process in batches
         for i in range(0, len(control_gaps), batch_size):
             batch = control_gaps[i:i + batch_size]
+            gaps_by_control = {gap.control_id: gap for gap in batch}
+            
+            async def attempt(control_ids: List[str]):
+                gaps = [gaps_by_control[cid] for cid in control_ids]
+                response = await self._generate_content(self._build_batch_remediation_prompt(gaps), stage="batch_remediation")
+                return self._parse_batch_remediation_items(response.text, gaps), response
             
-            # Build concise remediation prompt
-            prompt = f"""Generate concise remediation tasks for these control gaps.
+            resolved = await self._resolve_batch("remediation", list(gaps_by_control), attempt)
+            tasks.extend(
+                resolved.get(gap.control_id) or self._remediation_fallback(gap)
+                for gap in batch
+            )
+        
+        return tasks
+    
+    def _build_batch_remediation_prompt(self, control_gaps: List[ControlGap]) -> str:
+        """Build concise remediation prompt"""
+        return f"""Generate concise remediation tasks for these control gaps.
 
 Gaps:
-{chr(10).join([f"- {gap.control_id}: {gap.gap_description[:100]}" for gap in batch])}
+{chr(10).join([f"- {gap.control_id}: {gap.gap_description[:100]}" for gap in control_gaps])}
 
 For each gap, provide:
 1. action (string): What to do (max 30 words)
@@ -264,154 +632,169 @@ Response format (JSON only):
     {{"control_id": "AC-2", "action": "...", "priority": "medium"}}
   ]
 }}"""
-            
-            response = await self.model.generate_content_async(prompt)
-            batch_tasks = self._parse_batch_remediation_response(response.text, batch)
-            tasks.extend(batch_tasks)
-        
-        return tasks
     
-    def _parse_batch_remediation_response(
+    def _parse_batch_remediation_items(
         self,
         response_text: str,
         control_gaps: List[ControlGap]
-    ) -> List[RemediationTask]:
-        """Parse batch remediation JSON response"""
-        try:
-            # Clean markdown
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0]
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0]
-            
-            data = json.loads(response_text.strip())
-            tasks = []
-            
-            gap_lookup = {gap.control_id: gap for gap in control_gaps}
-            
-            for task_data in data.get("tasks", []):
-                gap = gap_lookup.get(task_data["control_id"])
-                if gap:
-                    # Map priority string to RiskLevel enum
-                    priority_map = {"high": RiskLevel.HIGH, "medium": RiskLevel.MEDIUM, "low": RiskLevel.LOW}
-                    priority = priority_map.get(task_data.get("priority", "medium"), RiskLevel.MEDIUM)
-
-                    impl_guide = self._generate_fallback_implementation_guide(gap)
-                    verification = self._generate_fallback_verification_steps(gap)
-                    
-                    tasks.append(RemediationTask(
-                        task_id=str(uuid.uuid4()),
-                        title=f"Remediate {task_data['control_id']}",
-                        description=task_data["action"],
-                        priority=priority,
-                        effort_estimate="medium",
-                        related_gaps=[task_data["control_id"]],
-                        implementation_guide=impl_guide,
-                        code_snippets=[],
-                        verification_steps=verification
-                    ))
-            
-            return tasks
-        except Exception as e:
-            # Fallback: basic tasks
-            return [
-                RemediationTask(
+    ) -> Dict[str, RemediationTask]:
+        """Valid entries of a batch remediation response for the requested gaps"""
+        data = self._load_batch_json(response_text)
+        if data is None:
+            return {}
+        
+        gap_lookup = {gap.control_id: gap for gap in control_gaps}
+        # Map priority string to RiskLevel enum
+        priority_map = {"high": RiskLevel.HIGH, "medium": RiskLevel.MEDIUM, "low": RiskLevel.LOW}
+        tasks = {}
+        
+        for task_data in data.get("tasks") or []:
+            try:
+                control_id = task_data["control_id"]
+                gap = gap_lookup.get(control_id)
+                if not gap or control_id in tasks:
+                    continue
+                priority = priority_map.get(task_data.get("priority", "medium"), RiskLevel.MEDIUM)
+                
+                tasks[control_id] = RemediationTask(
                     task_id=str(uuid.uuid4()),
-                    title=f"Remediate {gap.control_id}",
-                    description=gap.gap_description,
-                    priority=RiskLevel.MEDIUM,
+                    title=f"Remediate {control_id}",
+                    description=task_data["action"],
+                    priority=priority,
                     effort_estimate="medium",
-                    related_gaps=[gap.control_id],
+                    related_gaps=[control_id],
                     implementation_guide=self._generate_fallback_implementation_guide(gap),
                     code_snippets=[],
                     verification_steps=self._generate_fallback_verification_steps(gap)
                 )
-                for gap in control_gaps
-            ]
+            except (KeyError, TypeError, ValueError):
+                continue  # Invalid entry: treated as missing
+        
+        return tasks
+    
+    def _remediation_fallback(self, gap: ControlGap) -> RemediationTask:
+        """Basic task for a gap the model gave no usable entry for"""
+        return RemediationTask(
+            task_id=str(uuid.uuid4()),
+            title=f"Remediate {gap.control_id}",
+            description=gap.gap_description,
+            priority=RiskLevel.MEDIUM,
+            effort_estimate="medium",
+            related_gaps=[gap.control_id],
+            implementation_guide=self._generate_fallback_implementation_guide(gap),
+            code_snippets=[],
+            verification_steps=self._generate_fallback_verification_steps(gap)
+        )
+    
+    def _parse_batch_remediation_response(
+        self,
+        response_text: str,
+        control_gaps: List[ControlGap]
+    ) -> List[RemediationTask]:
+        """Parse batch remediation JSON response (basic tasks if nothing parses)"""
+        tasks = self._parse_batch_remediation_items(response_text, control_gaps)
+        if tasks:
+            return list(tasks.values())
+        return [self._remediation_fallback(gap) for gap in control_gaps]
     
     def build_validation_prompt(
         self,
         control_id: str,
         control_requirements: Dict[str, Any],
         evidence_artifacts: List[EvidenceArtifact],
-        mode: str = "detailed"
+        mode: str = "detailed",
+        catalog_in_context: bool = False
     ) -> str:
         """
         Token-Aware Prompt Building (Task 7)
         Dynamically adjust prompt verbosity based on control priority
         
         Modes:
-        - detailed: 2000 tokens (full requirements, all evidence, deep analysis)
-        - concise: 800 tokens (summary requirements, key evidence, focused analysis)
-        - minimal: 200 tokens (control statement only, quick yes/no validation)
+        - detailed: 2000 tokens (full requirements, guidance, enhancements, all evidence)
+        - concise: 800 tokens (summary requirements, enhancement titles, key evidence)
+        - minimal: 200 tokens (control statement only, evidence file names)
+        
+        Every mode asks for the same response sections so the result is parsed
+        the same way whichever mode was chosen.
         
         Args:
             control_id: Control to validate
             control_requirements: NIST requirements dict
-            evidence_artifacts: Available evidence
+            evidence_artifacts: Evidence cited for this control
             mode: "detailed" | "concise" | "minimal"
+            catalog_in_context: The control's family guidance block is a cached
+                prefix, so statement, guidance and enhancements are referenced
+                instead of repeated (detailed and concise modes)
         
         Returns:
             Prompt string tailored to mode
         """
+        title = control_requirements.get('title', control_id)
+        fragments = prompt_fragments(control_id, control_requirements)
+        catalog_reference = (
+            f"Statement, guidance and enhancements: see {control_id} in the "
+            f"{control_requirements.get('family', '')} family catalog above."
+        )
         
         if mode == "minimal":
             # 200 tokens: Quick validation
-            return f"""Validate {control_id} against evidence.
+            evidence_files = ", ".join(a.filename for a in evidence_artifacts) or "none"
+            return f"""Validate NIST 800-53 {control_id} ({title}) against evidence.
 
-Control: {control_requirements['statement'][:150]}
+{fragments['minimal'].text}
 
-Evidence: {len(evidence_artifacts)} files available
+Evidence files: {evidence_files}
 
-Is this control implemented? (yes/no/partial)
-Confidence: (high/medium/low)
-Findings: (max 20 words)"""
+{VALIDATION_RESPONSE_FORMAT}
+Keep each section to at most two bullets."""
         
         elif mode == "concise":
             # 800 tokens: Focused analysis
             evidence_summary = "\n".join([
-                f"- {a.filename}: {a.summary[:80]}"
+                f"- {a.filename}: {a.content_summary[:80]}"
                 for a in evidence_artifacts[:3]
-            ])
+            ]) or "- none"
             
-            return f"""Validate NIST 800-53 control against evidence.
+            if catalog_in_context:
+                return f"""Validate NIST 800-53 control against evidence.
 
 Control ID: {control_id}
-Title: {control_requirements['title']}
+Title: {title}
 
-Statement: {control_requirements['statement'][:400]}
-
-Guidance (summary): {control_requirements.get('guidance', '')[:300]}
+{catalog_reference}
 
 Evidence:
 {evidence_summary}
 
-Assess:
-1. Compliance (compliant/non-compliant/partial)
-2. Confidence (high/medium/low)
-3. Key findings (max 100 words)
-4. Missing items (if any)
+{VALIDATION_RESPONSE_FORMAT}"""
+            
+            return f"""Validate NIST 800-53 control against evidence.
 
-Provide concise JSON response."""
+Control ID: {control_id}
+Title: {title}
+
+{fragments['concise'].text}
+
+Evidence:
+{evidence_summary}
+
+{VALIDATION_RESPONSE_FORMAT}"""
         
         else:  # detailed mode
             # 2000 tokens: Full deep analysis
             evidence_details = "\n".join([
-                f"--- {a.filename} ---\n{a.summary}\nControls: {', '.join([c.control_id for c in a.controls_identified][:5])}"
+                f"--- {a.filename} ---\n{a.content_summary}\nControls: {', '.join(a.controls_mentioned[:5])}"
                 for a in evidence_artifacts[:5]
-            ])
+            ]) or "None provided"
+            control_text = catalog_reference if catalog_in_context else fragments['full'].text
             
             return f"""Perform comprehensive NIST 800-53 validation with deep reasoning.
 
 Control ID: {control_id}
-Title: {control_requirements['title']}
+Title: {title}
 Family: {control_requirements.get('family', 'N/A')}
 
-Full Statement:
-{control_requirements['statement']}
-
-Guidance:
-{control_requirements.get('guidance', '')}
+{control_text}
 
 Related Controls: {', '.join(control_requirements.get('related_controls', [])[:5])}
 
@@ -420,17 +803,55 @@ Assessment Methods: {', '.join(control_requirements.get('assessment_methods', []
 Evidence Artifacts:
 {evidence_details}
 
-Analyze:
-1. Compliance status (compliant/non-compliant/partial) with detailed reasoning
-2. Confidence level (high/medium/low) with justification
-3. Detailed findings covering all requirement aspects
-4. Specific missing items or gaps
-5. Evidence quality assessment
-6. Recommendations for improvement
+Analyze whether the evidence meets each part of the control statement, citing
+the NIST guidance, and judge the quality of the evidence.
 
-Provide comprehensive JSON response with detailed analysis."""
+{VALIDATION_RESPONSE_FORMAT}"""
+    
+    def select_validation_prompt(
+        self,
+        control_id: str,
+        control_requirements: Dict[str, Any],
+        evidence_artifacts: List[EvidenceArtifact],
+        risk_tier: str,
+        budget: PromptBudget,
+        controls_after: int,
+        catalog_in_context: bool = False
+    ) -> tuple[str, str, int]:
+        """
+        Choose the prompt mode for one control
         
-        return ""
+        With validation_prompt_mode "adaptive", the risk tier sets the richest
+        mode allowed (critical: detailed, standard: concise, passing: minimal)
+        and the mode is stepped down until the measured prompt fits both
+        max_tokens_per_request and what the run budget can spare while still
+        covering the remaining controls. Any other setting forces that mode.
+        With catalog_in_context only the uncached part of the prompt is measured.
+        
+        Returns:
+            (mode, prompt, estimated prompt tokens)
+        """
+        configured = self.settings.validation_prompt_mode
+        if configured != "adaptive":
+            mode = configured if configured in PROMPT_MODES else "detailed"
+            prompt = self.build_validation_prompt(
+                control_id, control_requirements, evidence_artifacts, mode, catalog_in_context
+            )
+            return mode, prompt, estimate_tokens(prompt)
+        
+        ceiling = PROMPT_MODE_BY_TIER.get(risk_tier, "concise")
+        allowance = budget.allowance(controls_after, MINIMAL_PROMPT_TOKENS)
+        
+        for mode in PROMPT_MODES[PROMPT_MODES.index(ceiling):]:
+            prompt = self.build_validation_prompt(
+                control_id, control_requirements, evidence_artifacts, mode, catalog_in_context
+            )
+            tokens = estimate_tokens(prompt)
+            if tokens <= allowance:
+                break
+        # Falls through with the minimal prompt: a control is never skipped
+        
+        return mode, prompt, tokens
     
     def group_by_family(
         self,
@@ -482,22 +903,33 @@ Provide comprehensive JSON response with detailed analysis."""
         # Load requirements for all controls in family
         batch_requirements = self.nist_service.get_control_requirements_batch(control_ids)
         
-        # Get family metadata for shared context
+        # With a cached family guidance block only the evidence and control IDs are sent
+        prefix = self.family_guidance_prefix(family_code) if self.prompt_cache else None
+        cached = prefix is not None and self._uses_cached_prefix(prefix)
         family_info = self._get_family_info(family_code)
         
-        # Build family-aware prompt
-        prompt = self._build_family_validation_prompt(
-            family_code,
-            family_info,
-            batch_requirements,
-            evidence_artifacts
-        )
+        async def attempt(batch: List[str]):
+            if cached:
+                suffix = self._build_family_batch_suffix(family_code, batch, evidence_artifacts)
+                response = await self._generate_with_prefix(prefix, suffix, stage="batch_validation")
+            else:
+                # Build family-aware prompt
+                prompt = self._build_family_validation_prompt(
+                    family_code,
+                    family_info,
+                    {cid: batch_requirements[cid] for cid in batch},
+                    evidence_artifacts
+                )
+                response = await self._generate_content(prompt, stage="batch_validation")
+            return self._parse_batch_validation_items(response.text, batch, batch_requirements), response
         
-        # Call Gemini
-        response = await self.model.generate_content_async(prompt)
-        results = self._parse_batch_validation_response(response.text, control_ids, batch_requirements)
+        # Controls missing from a response are retried in smaller batches
+        resolved = await self._resolve_batch("validation", control_ids, attempt)
         
-        return results
+        return [
+            resolved.get(cid) or self._validation_fallback(cid, batch_requirements, "no valid entry in batch response")
+            for cid in control_ids
+        ]
     
     def _get_family_info(self, family_code: str) -> Dict[str, str]:
         """Get family-level information for context"""
@@ -541,12 +973,11 @@ Provide comprehensive JSON response with detailed analysis."""
             evidence_summary.append(f"- {artifact.filename}: {artifact.content_summary[:100]}")
         
         # Build control requirements with family context
-        controls_section = []
-        for control_id, req in batch_requirements.items():
-            controls_section.append(f"""
-{control_id}: {req['title']}
-Statement: {req['statement'][:200]}...
-""")
+        controls_section = [
+            self._format_family_control(control_id, req)
+            for control_id, req in batch_requirements.items()
+        ]
+        example_id = next(iter(batch_requirements), f"{family_code}-1")
         
         prompt = f"""Validate NIST 800-53 {family_code} ({family_info['name']}) family controls against evidence.
 
@@ -570,12 +1001,129 @@ For each control, provide:
 Response format (JSON only, no markdown):
 {{
   "validations": [
-    {{\"control_id\": \"{control_id}\", \"control_title\": \"Control Title\", \"is_valid\": true, \"coverage_score\": 0.85, \"requirements_met\": [\"...\"], \"requirements_not_met\": []}}
+    {{\"control_id\": \"{example_id}\", \"control_title\": \"Control Title\", \"is_valid\": true, \"coverage_score\": 0.85, \"requirements_met\": [\"...\"], \"requirements_not_met\": []}}
   ]
 }}"""
         
         return prompt
     
+    def _build_family_batch_suffix(
+        self,
+        family_code: str,
+        control_ids: List[str],
+        evidence_artifacts: List[EvidenceArtifact]
+    ) -> str:
+        """Per-call part of a family validation prompt whose catalog block is cached"""
+        evidence_summary = "\n".join(
+            f"- {artifact.filename}: {artifact.content_summary[:100]}"
+            for artifact in evidence_artifacts[:5]
+        )
+        
+        return f"""Validate these {family_code} family controls against the evidence, using the family catalog above for each control's statement and guidance.
+
+Evidence:
+{evidence_summary}
+
+Controls to validate: {', '.join(control_ids)}
+
+For each control, provide:
+1. is_valid (true/false): Does evidence satisfy requirements?
+2. coverage_score (0.0-1.0): Evidence coverage completeness
+3. requirements_met (list): Requirements satisfied by evidence
+4. requirements_not_met (list): Requirements not covered
+
+Response format (JSON only, no markdown):
+{{
+  "validations": [
+    {{"control_id": "{control_ids[0]}", "control_title": "Control Title", "is_valid": true, "coverage_score": 0.85, "requirements_met": ["..."], "requirements_not_met": []}}
+  ]
+}}"""
+    
+    def _format_family_control(self, control_id: str, req: Dict[str, Any]) -> str:
+        """One control's requirement text for a family validation prompt"""
+        return f"\n{prompt_fragments(control_id, req)['minimal'].text}\n"
+    
+    def pack_family_batches(
+        self,
+        control_ids: List[str],
+        evidence_artifacts: List[EvidenceArtifact]
+    ) -> List[tuple[str, List[str]]]:
+        """
+        Token-Aware Family Batch Packing
+        Group controls by family and fill each request up to max_tokens_per_request
+        
+        Each control costs the precomputed tokens of its requirement text (the
+        catalog's minimal prompt fragment) plus its expected share of the
+        response; the prompt template and evidence summary are paid once per
+        request. A
+        family that does not fit in one request is split across several. With
+        batch_autotune on, a batch also holds at most the tuned validation size.
+        
+        Returns:
+            List of (family_code, control_ids) batches
+        """
+        budget = self.settings.max_tokens_per_request
+        max_controls = self.batch_size("validation") if self.batch_tuner is not None else None
+        requirements = self.nist_service.get_control_requirements_batch(control_ids)
+        batches = []
+        
+        for family_code, family_controls in self.group_by_family(control_ids).items():
+            overhead = estimate_tokens(self._build_family_validation_prompt(
+                family_code,
+                self._get_family_info(family_code),
+                {},
+                evidence_artifacts
+            ))
+            
+            current: List[str] = []
+            used = overhead
+            for control_id in family_controls:
+                minimal = prompt_fragments(control_id, requirements.get(control_id) or {})["minimal"]
+                cost = minimal.tokens + ENTRY_SEPARATOR_TOKENS + RESPONSE_TOKENS_PER_CONTROL
+                if current and (used + cost > budget or len(current) == max_controls):
+                    batches.append((family_code, current))
+                    current, used = [], overhead
+                current.append(control_id)
+                used += cost
+            
+            if current:
+                batches.append((family_code, current))
+        
+        return batches
+    
+    async def validate_controls_by_family(
+        self,
+        control_ids: List[str],
+        evidence_artifacts: List[EvidenceArtifact],
+        on_call: Optional[Callable[[], None]] = None
+    ) -> tuple[List[NISTValidationResult], int]:
+        """
+        Validate controls in token-packed family batches, running batches concurrently
+        
+        Args:
+            on_call: Called before each batch call, so a caller that cancels
+                the run can still count the calls already made
+        
+        Returns:
+            (validation results, number of batch calls made)
+        """
+        if not control_ids:
+            return [], 0
+        
+        batches = self.pack_family_batches(control_ids, evidence_artifacts)
+        semaphore = asyncio.Semaphore(self.settings.max_concurrent_batches)
+        
+        async def run(family_code: str, batch: List[str]) -> List[NISTValidationResult]:
+            async with semaphore:
+                print(f"🔄 GEMINI API CALL: validate_family_batch {family_code} ({len(batch)} controls)")
+                if on_call is not None:
+                    on_call()
+                return await self.validate_family_batch(family_code, batch, evidence_artifacts)
+        
+        batch_results = await asyncio.gather(*(run(family, batch) for family, batch in batches))
+        
+        return [result for results in batch_results for result in results], len(batches)
+    
     # ========================================================================
     # END SCALABILITY OPTIMIZATION METHODS
     # ========================================================================
@@ -587,6 +1135,10 @@ Response format (JSON only, no markdown):
         """
         Agent 1: Evidence Analyzer
         Multimodal extraction of security controls, configs, and policies
+        
+        Documents above long_document_threshold_tokens are summarized section
+        by section first (see _summarize_long_document) and analyzed from the
+        combined summaries.
         """
         evidence_artifacts = []
         
@@ -609,27 +1161,37 @@ Filename: {file_data['filename']}
                 # Build multimodal input
                 parts = [prompt]
                 
-                # Add text content if available
-                if file_data.get('text'):
+                # Add text content if available (section summaries for long documents)
+                mention_index = None
+                text_tokens = estimate_tokens(file_data.get('text') or '')
+                if text_tokens > self.settings.long_document_threshold_tokens:
+                    summaries, mention_index, sections, levels = await self._summarize_long_document(
+                        file_data['filename'], file_data['text']
+                    )
+                    parts.append(f"Content (section summaries of a ~{text_tokens}-token document):\n{summaries}")
+                elif file_data.get('text'):
                     parts.append(f"Content:\n{file_data['text']}")
                 
                 # Add image if available (for screenshots/diagrams)
                 if file_data.get('image_data'):
-                    # For Gemini, we need to pass the image directly
+                    # Sent inline with the MIME type of the preprocessed bytes
                     parts.append({
-                        'mime_type': 'image/jpeg',
+                        'mime_type': file_data.get('image_mime_type', 'image/png'),
                         'data': file_data['image_data']
                     })
                 
                 # Generate analysis
-                response = self.model.generate_content(parts)
+                response = await self._generate_content(parts, stage="evidence")
                 analysis = response.text
                 
                 # Parse the response (in production, use structured output)
                 # For now, we'll extract key information
-                raw_text = file_data.get('text', '')
+                raw_text = file_data.get('text') or ''  # None for images
                 controls_from_analysis = self._extract_control_ids(analysis)
-                controls_from_text = self._extract_control_ids(raw_text)
+                if mention_index is not None:
+                    controls_from_text = list(mention_index)  # Every section, not just the first 50 IDs
+                else:
+                    controls_from_text = self._extract_control_ids(raw_text)
                 merged_controls = []
                 seen_controls = set()
                 for control_id in controls_from_analysis + controls_from_text:
@@ -642,8 +1204,16 @@ Filename: {file_data['filename']}
                     filename=file_data['filename'],
                     file_type=file_data['type'],
                     content_summary=self._extract_summary(analysis),
-                    extracted_text=file_data.get('text', '')[:500],  # First 500 chars
-                    metadata=file_data.get('metadata', {}),
+                    extracted_text=raw_text[:500],  # First 500 chars
+                    metadata=(
+                        {
+                            **file_data.get('metadata', {}),
+                            'control_mention_index': mention_index,
+                            'summary_sections': sections,
+                            'summary_levels': levels
+                        }
+                        if mention_index is not None else file_data.get('metadata', {})
+                    ),
                     controls_mentioned=merged_controls,
                     confidence_score=0.85  # Could be derived from model confidence
                 )
@@ -664,6 +1234,74 @@ Filename: {file_data['filename']}
         
         return evidence_artifacts
     
+    async def _summarize_long_document(self, filename: str, text: str) -> tuple[str, Dict[str, List[int]], int, int]:
+        """
+        Map-Reduce Document Summarization
+        Summarize a long document section by section, then combine the summaries
+        
+        The text is split at section headings into chunks of at most
+        summary_chunk_tokens, which are summarized concurrently (map). While the
+        joined summaries are still larger than one chunk they are grouped and
+        summarized again (reduce), so a document of any length ends up as a
+        bounded set of summaries. Control IDs found in each chunk's text or
+        summary form the mention index.
+        
+        Returns:
+            (combined summaries, control ID -> 1-based section numbers, sections, reduce levels)
+        """
+        chunk_tokens = self.settings.summary_chunk_tokens
+        chunks = chunk_sections(text, chunk_tokens)
+        semaphore = asyncio.Semaphore(self.settings.max_concurrent_batches)
+        
+        async def summarize(prompt: str) -> str:
+            async with semaphore:
+                response = await self._generate_content(prompt, stage="evidence")
+                return response.text.strip()
+        
+        print(f"🔄 GEMINI API CALL: summarize {filename} in {len(chunks)} sections")
+        summaries = await asyncio.gather(*(
+            summarize(f"""You are a security compliance expert summarizing one section of a long document.
+
+Document: {filename} (section {chunk.index + 1} of {len(chunks)}: {chunk.title or 'untitled'})
+
+Summarize this section in at most 5 sentences. Keep security controls, configuration details,
+policy statements and NIST 800-53 control IDs (e.g., AC-2, IA-5) exactly as written.
+
+Section text:
+{chunk.text}""")
+            for chunk in chunks
+        ))
+        
+        mention_index: Dict[str, List[int]] = {}
+        for chunk, summary in zip(chunks, summaries):
+            for control_id in self._extract_control_ids(f"{chunk.text}\n{summary}", max_count=len(chunk.text)):
+                sections = mention_index.setdefault(control_id, [])
+                if chunk.index + 1 not in sections:
+                    sections.append(chunk.index + 1)
+        
+        parts = [
+            f"[Section {chunk.index + 1}: {chunk.title or 'untitled'}]\n{summary}"
+            for chunk, summary in zip(chunks, summaries)
+        ]
+        levels = 1
+        while len(parts) > 1 and estimate_tokens("\n\n".join(parts)) > chunk_tokens:
+            groups = chunk_sections("\n\n".join(parts), chunk_tokens)
+            if len(groups) >= len(parts):
+                break  # Summaries no longer shrink when grouped
+            print(f"🔄 GEMINI API CALL: combine {len(parts)} summaries of {filename} into {len(groups)}")
+            combined = await asyncio.gather(*(
+                summarize(f"""Combine these consecutive section summaries of {filename} into one summary
+of at most 8 sentences. Keep security controls, configuration details, policy statements and
+NIST 800-53 control IDs exactly as written.
+
+{group.text}""")
+                for group in groups
+            ))
+            parts = [f"[Part {index + 1} of {len(groups)}]\n{summary}" for index, summary in enumerate(combined)]
+            levels += 1
+        
+        return "\n\n".join(parts), mention_index, len(chunks), levels
+    
     async def map_controls_and_gaps(
         self,
         evidence_artifacts: List[EvidenceArtifact],
@@ -673,6 +1311,15 @@ Filename: {file_data['filename']}
         Agent 2: Control Mapper & Gap Analyzer
         Map evidence to NIST 800-53 controls and identify gaps
         
+        A scoped assessment is sharded by control family (large families are
+        split into fixed-size chunks) so every in-scope control is listed in a
+        prompt and each response stays well under the output token limit.
+        Shards run concurrently; each shard keeps only results for its own
+        controls, and the merged results have duplicates removed. A shard whose
+        call fails or whose response does not parse is split and retried (see
+        _map_shard_bisecting); if a control still cannot be mapped the run
+        fails with ControlMappingError rather than silently omitting it.
+        
         Args:
             evidence_artifacts: Evidence to analyze
             control_filter: Optional list of control IDs to focus on (from baseline/scope filtering)
@@ -686,13 +1333,134 @@ Filename: {file_data['filename']}
             for idx, art in enumerate(evidence_artifacts)
         ])
         
+        if not control_filter:
+            return await self._map_controls_shard(evidence_summary, evidence_artifacts, None)
+        
+        shards = self._mapping_shards(control_filter)
+        semaphore = asyncio.Semaphore(self.settings.max_concurrent_batches)
+        
+        async def run(shard: List[str]):
+            async with semaphore:
+                print(f"🔄 GEMINI API CALL: map_controls_and_gaps shard ({len(shard)} controls)")
+                return await self._map_shard_bisecting(evidence_summary, evidence_artifacts, shard)
+        
+        tasks = [asyncio.ensure_future(run(shard)) for shard in shards]
+        try:
+            shard_results = await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed shard fails the mapping: stop the others' calls
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        return self._merge_mapping_results(shard_results, shards)
+    
+    async def _map_shard_bisecting(
+        self,
+        evidence_summary: str,
+        evidence_artifacts: List[EvidenceArtifact],
+        shard: List[str]
+    ) -> tuple[List[ControlMapping], List[ControlGap]]:
+        """
+        Map one shard, splitting it in half and retrying each half when the
+        call fails or the response does not parse (as _resolve_batch does for
+        batch validation). Raises ControlMappingError for a single control
+        that still fails.
+        """
+        try:
+            return await self._map_controls_shard(evidence_summary, evidence_artifacts, shard)
+        except Exception as e:
+            if len(shard) == 1:
+                raise ControlMappingError(f"Control mapping failed for {shard[0]}: {e}") from e
+            middle = len(shard) // 2
+            halves = [shard[:middle], shard[middle:]]
+            self.batch_stats.record_retries("mapping", len(halves))
+            print(f"↩️  mapping shard of {len(shard)} failed ({e}), retrying as {[len(h) for h in halves]}")
+        
+        # Sequential, so retries stay within the shard's concurrency slot
+        mappings: List[ControlMapping] = []
+        gaps: List[ControlGap] = []
+        for half in halves:
+            half_mappings, half_gaps = await self._map_shard_bisecting(evidence_summary, evidence_artifacts, half)
+            mappings.extend(half_mappings)
+            gaps.extend(half_gaps)
+        return mappings, gaps
+    
+    def _mapping_shards(self, control_ids: List[str]) -> List[List[str]]:
+        """
+        Split a scope into mapping shards of at most mapping_shard_size controls
+        
+        Controls stay grouped by family; small families share a shard and
+        large ones are split into fixed-size chunks.
+        """
+        shard_size = max(1, self.settings.mapping_shard_size)
+        shards: List[List[str]] = []
+        current: List[str] = []
+        
+        for family_controls in self.group_by_family(list(dict.fromkeys(control_ids))).values():
+            for i in range(0, len(family_controls), shard_size):
+                chunk = family_controls[i:i + shard_size]
+                if current and len(current) + len(chunk) > shard_size:
+                    shards.append(current)
+                    current = []
+                current.extend(chunk)
+        
+        if current:
+            shards.append(current)
+        
+        return shards
+    
+    def _merge_mapping_results(
+        self,
+        shard_results: List[tuple[List[ControlMapping], List[ControlGap]]],
+        shards: List[List[str]]
+    ) -> tuple[List[ControlMapping], List[ControlGap]]:
+        """
+        Merge shard results, keeping the most confident mapping and riskiest gap per control
+        
+        A shard's response only counts for the controls it was assigned; the
+        model sometimes also reports controls from other shards or outside
+        the scope, which are dropped.
+        """
+        mappings: Dict[str, ControlMapping] = {}
+        gaps: Dict[str, ControlGap] = {}
+        
+        for (shard_mappings, shard_gaps), shard in zip(shard_results, shards):
+            assigned = {control_id.upper() for control_id in shard}
+            for mapping in shard_mappings:
+                if mapping.control_id.upper() not in assigned:
+                    continue
+                existing = mappings.get(mapping.control_id)
+                if existing is None or mapping.confidence_score > existing.confidence_score:
+                    mappings[mapping.control_id] = mapping
+            for gap in shard_gaps:
+                if gap.control_id.upper() not in assigned:
+                    continue
+                existing = gaps.get(gap.control_id)
+                if existing is None or gap.risk_score > existing.risk_score:
+                    gaps[gap.control_id] = gap
+        
+        return list(mappings.values()), list(gaps.values())
+    
+    async def _map_controls_shard(
+        self,
+        evidence_summary: str,
+        evidence_artifacts: List[EvidenceArtifact],
+        control_filter: Optional[List[str]]
+    ) -> tuple[List[ControlMapping], List[ControlGap]]:
+        """
+        Map evidence against one shard of the scope (or the whole catalog if None)
+        
+        For a shard, a failed call or unparseable response raises so the
+        caller can retry it; an unscoped call returns no results instead.
+        """
         # Add scope filtering instruction if provided
         scope_instruction = ""
         if control_filter:
             scope_instruction = f"""
 SCOPE FILTER APPLIED:
 Focus ONLY on these {len(control_filter)} controls in scope:
-{', '.join(control_filter[:50])}{'...' if len(control_filter) > 50 else ''}
+{', '.join(control_filter)}
 
 Do not analyze controls outside this scope.
 """
@@ -761,9 +1529,13 @@ REMINDER: If implementation_status is "partially_implemented" or "not_implemente
 Return ONLY the JSON object, no additional text."""
         
         try:
-            response = self.model.generate_content(prompt)
+            response = await self._generate_content(prompt, stage="mapping")
             analysis = response.text
             
+            # Free-text fallback parsing would invent results for a shard
+            if control_filter and self._load_batch_json(analysis) is None:
+                raise ValueError(f"unparseable mapping response for {len(control_filter)} controls")
+            
             # Parse JSON response with structured output
             control_mappings = self._parse_control_mappings_json(analysis, evidence_artifacts)
             control_gaps = self._parse_control_gaps_json(analysis)
@@ -777,70 +1549,133 @@ Return ONLY the JSON object, no additional text."""
             return control_mappings, control_gaps
             
         except Exception as e:
+            if control_filter:
+                raise
             print(f"Error in control mapping: {str(e)}")
             import traceback
             traceback.print_exc()
             return [], []
     
-    async def generate_oscal_artifacts(
+    def generate_oscal_artifacts(
         self,
         control_mappings: List[ControlMapping],
         control_gaps: List[ControlGap],
-        evidence_artifacts: List[EvidenceArtifact]
-    ) -> tuple[List[OSCALComponent], List[POAMEntry]]:
+        evidence_artifacts: List[EvidenceArtifact],
+        session_id: str,
+        generated_at: Optional[datetime] = None
+    ) -> OSCALArtifacts:
         """
         Agent 3: OSCAL Generator
-        Generate valid OSCAL SSP components and POA&M entries
+        Build the OSCAL SSP and POA&M deterministically from all mappings and gaps
+        
+        No model call: every field of the OSCAL documents is already known from
+        Agent 2's structured output, so the build is local and linear time.
         """
-        mappings_summary = "\n".join([
-            f"- {m.control_id}: {m.implementation_status} - {m.implementation_description[:100]}"
-            for m in control_mappings
-        ])
+        builder = OSCALBuilder(session_id, generated_at)
+        return builder.build(control_mappings, control_gaps, evidence_artifacts)
+    
+    def needs_narrative(self, mapping: ControlMapping) -> bool:
+        """Whether a mapping's implementation description is too thin for an SSP statement"""
+        return len(mapping.implementation_description.strip()) < self.settings.oscal_narrative_min_chars
+    
+    async def enrich_control_narratives(
+        self,
+        control_mappings: List[ControlMapping],
+        evidence_artifacts: List[EvidenceArtifact]
+    ) -> tuple[List[ControlMapping], int, int]:
+        """
+        Optional Agent 3 enrichment: write implementation narratives
         
-        gaps_summary = "\n".join([
-            f"- {g.control_id} ({g.risk_level}): {g.gap_description[:100]}"
-            for g in control_gaps
-        ])
+        Only mappings whose description is too short to serve as an SSP
+        implementation statement are sent, several per call, and calls run
+        concurrently. Narratives replace the mapping descriptions, so the
+        deterministic builder (and later rebuilds for download) pick them up.
         
-        prompt = f"""You are an OSCAL expert. Generate valid OSCAL artifacts:
-
-TASK 1: Create OSCAL SSP Component Definitions
-For each implemented control, create a component that describes:
-- Component title and description
-- Control implementation statements
-- Links to evidence artifacts
-- Properties (implementation status, validation date, etc.)
-
-TASK 2: Create OSCAL POA&M Entries
-For each gap, create a Plan of Action and Milestones entry with:
-- Title and description of the gap
-- Related controls
-- Risk level
-- Remediation plan
-- Milestones with target dates
+        Returns:
+            (mappings with narratives applied, number of model calls made,
+            number of narratives applied)
+        """
+        pending = [m for m in control_mappings if self.needs_narrative(m)]
+        if not pending:
+            return control_mappings, 0, 0
+        
+        batch_size = self.settings.oscal_enrichment_batch_size
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        semaphore = asyncio.Semaphore(self.settings.max_concurrent_batches)
+        
+        async def run(batch: List[ControlMapping]) -> Dict[str, str]:
+            async with semaphore:
+                prompt = self._build_narrative_prompt(batch, evidence_artifacts)
+                print(f"🔄 GEMINI API CALL: enrich_control_narratives ({len(batch)} controls)")
+                try:
+                    response = await self._generate_content(prompt, stage="narratives")
+                except Exception as e:
+                    print(f"Error enriching narratives: {str(e)}")
+                    return {}
+                return self._parse_narrative_response(response.text)
+        
+        narratives: Dict[str, str] = {}
+        for batch_narratives in await asyncio.gather(*(run(batch) for batch in batches)):
+            narratives.update(batch_narratives)
+        
+        enriched = [
+            m.model_copy(update={"implementation_description": narratives[m.control_id]})
+            if self.needs_narrative(m) and narratives.get(m.control_id) else m
+            for m in control_mappings
+        ]
+        applied = sum(1 for before, after in zip(control_mappings, enriched) if after is not before)
+        return enriched, len(batches), applied
+    
+    def _build_narrative_prompt(
+        self,
+        mappings: List[ControlMapping],
+        evidence_artifacts: List[EvidenceArtifact]
+    ) -> str:
+        """Build prompt asking for SSP implementation statements"""
+        evidence_by_id = {a.id: a for a in evidence_artifacts}
+        controls_section = []
+        for m in mappings:
+            evidence = "; ".join(
+                f"{evidence_by_id[e].filename}: {evidence_by_id[e].content_summary[:150]}"
+                for e in m.evidence_ids if e in evidence_by_id
+            ) or "none cited"
+            controls_section.append(
+                f"- {m.control_id} ({m.control_name}), status {m.implementation_status}. "
+                f"Notes: {m.implementation_description or 'none'}. Evidence: {evidence}"
+            )
+        
+        return f"""Write OSCAL SSP implementation statements. Respond in JSON only.
 
-Control Mappings:
-{mappings_summary}
+For each control, write 2-4 sentences describing how the system implements it,
+based only on the notes and evidence given. Do not invent capabilities.
 
-Identified Gaps:
-{gaps_summary}
+Controls:
+{chr(10).join(controls_section)}
 
-Generate valid OSCAL JSON structures following the OSCAL 1.2.0 specification.
-"""
-        
+Response format (JSON only, no markdown):
+{{
+  "narratives": [
+    {{"control_id": "AC-2", "narrative": "..."}}
+  ]
+}}"""
+    
+    def _parse_narrative_response(self, response_text: str) -> Dict[str, str]:
+        """Parse narrative JSON response (empty on malformed output)"""
         try:
-            response = self.model.generate_content(prompt)
-            oscal_content = response.text
-            
-            # Parse OSCAL artifacts
-            components = self._parse_oscal_components(control_mappings, evidence_artifacts)
-            poam_entries = self._parse_poam_entries(control_gaps)
-            
-            return components, poam_entries
+            if "```json" in response_text:
+                response_text = response_text.split("```json")[1].split("```")[0]
+            elif "```" in response_text:
+                response_text = response_text.split("```")[1].split("```")[0]
             
+            data = json.loads(response_text.strip())
+            return {
+                item["control_id"]: item["narrative"].strip()
+                for item in data.get("narratives", [])
+                if item.get("control_id") and item.get("narrative", "").strip()
+            }
         except Exception as e:
-            print(f"Error generating OSCAL: {str(e)}")
-            return [], []
+            print(f"Error parsing narratives: {str(e)}")
+            return {}
     
     async def generate_remediation_plan(
         self,
@@ -904,7 +1739,7 @@ Return ONLY valid JSON, no markdown code blocks.
 """
         
         try:
-            response = self.model.generate_content(prompt)
+            response = await self._generate_content(prompt, stage="remediation_plan")
             remediation_content = response.text
             
             # Parse remediation tasks
@@ -1110,58 +1945,6 @@ Return ONLY valid JSON, no markdown code blocks.
         
         return gaps[:3]  # Return top 3 gaps
     
-    def _parse_oscal_components(
-        self,
-        control_mappings: List[ControlMapping],
-        evidence_artifacts: List[EvidenceArtifact]
-    ) -> List[OSCALComponent]:
-        """Generate OSCAL components from mappings"""
-        components = []
-        
-        for mapping in control_mappings[:5]:  # Top 5 controls
-            component = OSCALComponent(
-                uuid=str(uuid.uuid4()),
-                component_id=f"component-{mapping.control_id.lower().replace('-', '-')}",
-                title=f"{mapping.control_name} Implementation",
-                description=mapping.implementation_description,
-                component_type="software",
-                control_implementations=[{
-                    "control_id": mapping.control_id,
-                    "status": mapping.implementation_status,
-                    "evidence": mapping.evidence_ids
-                }],
-                props={
-                    "compliance_status": mapping.implementation_status,
-                    "confidence": str(mapping.confidence_score)
-                }
-            )
-            components.append(component)
-        
-        return components
-    
-    def _parse_poam_entries(self, control_gaps: List[ControlGap]) -> List[POAMEntry]:
-        """Generate POA&M entries from gaps"""
-        poam_entries = []
-        
-        for gap in control_gaps:
-            poam = POAMEntry(
-                uuid=str(uuid.uuid4()),
-                poam_id=f"poam-{gap.control_id.lower().replace('-', '-')}",
-                title=f"Remediate {gap.control_name}",
-                description=gap.gap_description,
-                related_controls=[gap.control_id],
-                risk_level=gap.risk_level,
-                remediation_plan="\n".join(gap.recommended_actions),
-                milestones=[
-                    {"milestone": "Assessment", "target_date": "2026-02-15"},
-                    {"milestone": "Implementation", "target_date": "2026-03-15"},
-                    {"milestone": "Validation", "target_date": "2026-04-01"}
-                ]
-            )
-            poam_entries.append(poam)
-        
-        return poam_entries
-    
     def _parse_remediation_tasks(
         self,
         content: str,
@@ -1289,16 +2072,33 @@ Return ONLY valid JSON, no markdown code blocks.
     async def validate_against_nist_requirements(
         self,
         control_mappings: List[ControlMapping],
-        evidence_artifacts: List[EvidenceArtifact]
+        evidence_artifacts: List[EvidenceArtifact],
+        risk_tier: str = "critical",
+        budget: Optional[PromptBudget] = None
     ) -> List[NISTValidationResult]:
         """
         Agent 4: NIST Validator & Gap Analyzer
         Validate evidence against NIST 800-53 Rev 5 control requirements
         and assessment objectives
+        
+        Prompt detail per control follows validation_prompt_mode (see
+        select_validation_prompt); the chosen mode is logged for every call.
+        
+        Args:
+            control_mappings: Mappings to validate, one call each
+            evidence_artifacts: All evidence (each control sees its cited evidence)
+            risk_tier: Priority tier of these controls (critical, standard, passing)
+            budget: Prompt token budget for the run (default from settings)
         """
+        if budget is None:
+            budget = PromptBudget(
+                total=self.settings.validation_token_budget,
+                per_request=self.settings.max_tokens_per_request
+            )
+        
         validation_results = []
         
-        for mapping in control_mappings:
+        for index, mapping in enumerate(control_mappings):
             try:
                 # Get full NIST control requirements
                 control_requirements = self.nist_service.get_control_requirements(mapping.control_id)
@@ -1311,47 +2111,34 @@ Return ONLY valid JSON, no markdown code blocks.
                     art for art in evidence_artifacts 
                     if art.id in mapping.evidence_ids
                 ]
-                evidence_summary = "\n".join([
-                    f"- {art.filename}: {art.content_summary}"
-                    for art in control_evidence
-                ])
                 
-                # Use Gemini to validate evidence against NIST requirements
-                prompt = f"""You are a NIST 800-53 Rev 5 compliance validator.
-
-**NIST CONTROL: {control_requirements['control_id']} - {control_requirements['title']}**
-
-**Control Statement:**
-{control_requirements['statement']}
-
-**Guidance (Implementation Guidance & Discussion):**
-{control_requirements.get('guidance', 'N/A')}
-
-**Related Controls:**
-{', '.join(control_requirements.get('related_controls', []))}
-
-**Assessment Methods:**
-{', '.join(control_requirements.get('assessment_methods', []))}
-
----
-
-**EVIDENCE PROVIDED:**
-{evidence_summary}
-
----
-
-**VALIDATION TASK:**
-Analyze the evidence and determine:
-1. Does the evidence meet the control statement requirements?
-2. Which specific requirements are satisfied?
-3. Which requirements are NOT satisfied?
-4. What assessment methods were used (Examine/Interview/Test)?
-5. What additional evidence or actions are needed?
-
-Provide a structured assessment with specific citations from the NIST guidance.
-"""
+                # The family guidance block is sent as a cached prefix when it can be
+                prefix = (
+                    self.family_guidance_prefix(control_requirements['family'])
+                    if self.prompt_cache else None
+                )
+                cached = prefix is not None and self._uses_cached_prefix(prefix)
                 
-                response = self.model.generate_content(prompt)
+                mode, prompt, prompt_tokens = self.select_validation_prompt(
+                    mapping.control_id,
+                    control_requirements,
+                    control_evidence,
+                    risk_tier,
+                    budget,
+                    controls_after=len(control_mappings) - index - 1,
+                    catalog_in_context=cached
+                )
+                budget.charge(prompt_tokens)
+                print(
+                    f"🔄 GEMINI API CALL: validate {mapping.control_id} "
+                    f"[mode={mode}, tier={risk_tier}, ~{prompt_tokens} tokens, {budget.remaining} budget left"
+                    f"{', cached family guidance' if cached else ''}]"
+                )
+                
+                if cached:
+                    response = await self._generate_with_prefix(prefix, prompt, stage="validation", risk=risk_tier)
+                else:
+                    response = await self._generate_content(prompt, stage="validation", risk=risk_tier)
                 analysis = response.text
                 
                 # Parse validation result
@@ -1363,7 +2150,7 @@ Provide a structured assessment with specific citations from the NIST guidance.
                     requirements_met=self._extract_met_requirements(analysis),
                     requirements_not_met=self._extract_unmet_requirements(analysis),
                     recommendations=self._extract_recommendations(analysis),
-                    nist_guidance_applied=True
+                    nist_guidance_applied=mode != "minimal"
                 )
                 
                 validation_results.append(validation)
@@ -1384,7 +2171,28 @@ Provide a structured assessment with specific citations from the NIST guidance.
         Agent 5: Remediation Planner with Gemini 3 Deep Reasoning
         Use deep reasoning to generate context-aware recommendations
         based on NIST requirements and guidance prose
+        
+        With prompt caching the reasoning instructions and the session's
+        evidence digest form one cached prefix shared by every gap. No other
+        session reuses the digest, so it is deleted once the gaps are planned.
         """
+        evidence_prefix = self.evidence_digest_prefix(evidence_artifacts) if self.prompt_cache else None
+        if evidence_prefix is not None and not self._uses_cached_prefix(evidence_prefix):
+            evidence_prefix = None
+        
+        try:
+            return await self._plan_remediations(control_gaps, nist_validation_results, evidence_prefix)
+        finally:
+            if evidence_prefix is not None:
+                await self.prompt_cache.release(evidence_prefix)
+    
+    async def _plan_remediations(
+        self,
+        control_gaps: List[ControlGap],
+        nist_validation_results: List[NISTValidationResult],
+        evidence_prefix: Optional[PromptPrefix]
+    ) -> List[RemediationTask]:
+        """Deep-reasoning remediation for each gap (evidence_prefix: cached session prefix, if any)"""
         remediation_tasks = []
         
         for gap in control_gaps:
@@ -1401,21 +2209,15 @@ Provide a structured assessment with specific citations from the NIST guidance.
                     None
                 )
                 
-                # Build deep reasoning prompt with full NIST context
-                prompt = f"""You are an expert cybersecurity implementation consultant with deep knowledge of NIST 800-53 Rev 5.
-
-Use deep reasoning and step-by-step thinking to analyze this compliance gap and provide actionable remediation guidance.
-
-**CONTROL INFORMATION:**
+                # Gap-specific context; the instructions (and, when cached, the
+                # session's evidence digest) are the stable prefix
+                context = f"""**CONTROL INFORMATION:**
 - Control ID: {control_requirements['control_id']}
 - Title: {control_requirements['title']}
 - Family: {control_requirements['family']} ({control_requirements['class']})
 
-**Control Statement:**
-{control_requirements['statement']}
-
-**Guidance (Implementation Guidance & Discussion):**
-{control_requirements.get('guidance', 'N/A')}
+**Control Requirements (statement, guidance and enhancements):**
+{prompt_fragments(gap.control_id, control_requirements)['full'].text}
 
 **Related Controls to Consider:**
 {', '.join(control_requirements.get('related_controls', [])[:5])}
@@ -1427,43 +2229,16 @@ Use deep reasoning and step-by-step thinking to analyze this compliance gap and
 **Risk Score:** {gap.risk_score}/100
 
 **Current Assessment:**
-{validation.requirements_not_met if validation else 'Assessment pending'}
-
----
-
-**REASONING TASK:**
-Using deep, step-by-step reasoning:
-
-1. **ANALYZE THE ROOT CAUSE:**
-   - Why does this gap exist?
-   - What are the underlying issues?
-   - What context from the NIST guidance is relevant?
-
-2. **CONSIDER MULTIPLE APPROACHES:**
-   - What are 2-3 different ways to address this?
-   - What are the trade-offs (cost, complexity, time)?
-   - Which approach best aligns with NIST guidance?
-
-3. **RECOMMEND THE OPTIMAL SOLUTION:**
-   - What is your recommended approach and why?
-   - What specific steps should be taken?
-   - What tools, configurations, or processes are needed?
-
-4. **PROVIDE IMPLEMENTATION DETAILS:**
-   - Concrete code snippets or configuration examples
-   - Step-by-step implementation guide
-   - Verification procedures
-
-5. **CONNECT TO NIST GUIDANCE:**
-   - How does your recommendation align with the supplemental guidance?
-   - What related controls should be considered?
-   - How does this fit into the broader security posture?
-
-**FORMAT:** Provide your reasoning process, then the final recommendation with implementation details.
-"""
+{validation.requirements_not_met if validation else 'Assessment pending'}"""
                 
                 # Generate response with reasoning
-                response = self.model.generate_content(prompt)
+                if evidence_prefix is not None:
+                    response = await self._generate_with_prefix(
+                        evidence_prefix, context, stage="deep_remediation", risk=gap.risk_level
+                    )
+                else:
+                    prompt = f"{REMEDIATION_REASONING_INTRO}\n\n{context}\n\n---\n\n{REMEDIATION_REASONING_TASK}"
+                    response = await self._generate_content(prompt, stage="deep_remediation", risk=gap.risk_level)
                 recommendation_content = response.text
                 
                 # For AC-1 and AC-2, always use detailed fallback (extraction not reliable)
@@ -1520,57 +2295,36 @@ Using deep, step-by-step reasoning:
         
         return remediation_tasks
     
-    async def validate_oscal_artifacts(
-        self,
-        oscal_components: List[OSCALComponent],
-        poam_entries: List[POAMEntry]
-    ) -> OSCALValidationResult:
+    async def validate_oscal_artifacts(self, artifacts: OSCALArtifacts) -> OSCALValidationResult:
         """
-        Validate generated OSCAL artifacts using OSCAL-CLI
+        Validate the generated SSP and POA&M (each only when generated) using OSCAL-CLI
         """
         try:
-            # Build a minimal SSP structure for validation
-            ssp_document = {
-                "system-security-plan": {
-                    "uuid": str(uuid.uuid4()),
-                    "metadata": {
-                        "title": "D.A.V.E Generated SSP",
-                        "last-modified": datetime.utcnow().isoformat() + "Z",
-                        "version": "1.0",
-                        "oscal-version": "1.2.0"
-                    },
-                    "import-profile": {
-                        "href": "#nist-800-53-rev5"
-                    },
-                    "system-characteristics": {
-                        "system-ids": [
-                            {"id": "dave-system"}
-                        ],
-                        "system-name": "DAVE Analysis System",
-                        "description": "Auto-generated system security plan",
-                        "security-sensitivity-level": "moderate"
-                    },
-                    "system-implementation": {
-                        "users": [],
-                        "components": []
-                    },
-                    "control-implementation": {
-                        "description": "Control implementation status",
-                        "implemented-requirements": []
-                    }
-                }
-            }
+            documents = [
+                (name, self.oscal_validator.validate_document(document, OSCALDocumentType(name)))
+                for name, document in artifacts.documents()
+            ]
+            if not documents:
+                return OSCALValidationResult(
+                    is_valid=True,
+                    document_type="none",
+                    validation_messages=["No control mappings or gaps; no OSCAL documents were generated"]
+                )
+            
+            results = await asyncio.gather(*(validation for _, validation in documents))
             
-            # Validate using OSCAL validator service
-            validation_result = await self.oscal_validator.validate_ssp(ssp_document)
+            messages = []
+            for (document_type, _), result in zip(documents, results):
+                messages.extend(f"[{document_type}] {msg.message}" for msg in result.messages)
             
             return OSCALValidationResult(
-                is_valid=validation_result.is_valid,
-                document_type="ssp",
+                is_valid=all(result.is_valid for result in results),
+                document_type="+".join(document_type for document_type, _ in documents),
                 oscal_version="1.2.0",
-                error_count=validation_result.error_count,
-                warning_count=validation_result.warning_count,
-                validation_messages=[msg.message for msg in validation_result.messages]
+                schema_validated=all(result.schema_validated for result in results),
+                error_count=sum(result.error_count for result in results),
+                warning_count=sum(result.warning_count for result in results),
+                validation_messages=messages
             )
             
         except Exception as e:
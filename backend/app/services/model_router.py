@@ -0,0 +1,146 @@
+"""
+Model Routing
+
+Pipeline stages differ in what they need from the model: bulk batch
+validation and evidence summaries are short structured answers that a fast
+model handles well, while remediation of critical gaps benefits from the
+reasoning model. The router maps each stage (and optionally each risk tier)
+to a model tier, keeps one client per configured model, falls back to other
+tiers when a call fails, and accounts latency, tokens and estimated cost per
+tier.
+
+Tiers:
+- fast: bulk batches, evidence summaries, OSCAL narratives
+- standard: everything not routed elsewhere (Settings.gemini_model)
+- reasoning: critical controls and gaps
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services.token_estimator import estimate_tokens
+from app.utils import run_metrics
+
+
+MODEL_TIERS = ("fast", "standard", "reasoning")
+
+DEFAULT_TIER = "standard"
+
+
+class ModelRouter:
+    """Stage and risk-tier routing over one model client per tier"""
+
+    def __init__(
+        self,
+        models: Dict[str, Any],
+        model_names: Optional[Dict[str, str]] = None,
+        routes: Optional[Dict[str, str]] = None,
+        risk_routes: Optional[Dict[str, str]] = None,
+        fallback_order: Optional[List[str]] = None,
+        costs: Optional[Dict[str, List[float]]] = None
+    ):
+        """
+        Args:
+            models: Client per tier; tiers without one use the standard client
+            model_names: Model name per tier (for logs, metrics and prompt caching)
+            routes: Stage -> tier (unlisted stages use the standard tier)
+            risk_routes: Risk tier or level -> tier, overriding the stage route
+            fallback_order: Tiers tried in order when a call on the routed tier fails
+            costs: Tier -> [USD per million input tokens, USD per million output tokens]
+        """
+        self.models = {tier: models.get(tier, models[DEFAULT_TIER]) for tier in MODEL_TIERS}
+        names = model_names or {}
+        self.model_names = {tier: names.get(tier) or names.get(DEFAULT_TIER, DEFAULT_TIER) for tier in MODEL_TIERS}
+        self.routes = routes or {}
+        self.risk_routes = risk_routes or {}
+        self.fallback_order = [tier for tier in (fallback_order or []) if tier in MODEL_TIERS]
+        self.costs = costs or {}
+        self._stats = {
+            tier: {"calls": 0, "failures": 0, "fallbacks": 0, "latency_seconds": 0.0,
+                   "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+            for tier in MODEL_TIERS
+        }
+
+    def tier_for(self, stage: Optional[str], risk: Optional[str] = None) -> str:
+        """Tier a stage's call goes to (a routed risk tier wins over the stage route)"""
+        risk = getattr(risk, "value", risk)
+        tier = self.risk_routes.get(risk) if risk else None
+        tier = tier or self.routes.get(stage, DEFAULT_TIER)
+        return tier if tier in MODEL_TIERS else DEFAULT_TIER
+
+    def model(self, tier: str):
+        return self.models[tier]
+
+    def model_name(self, tier: str) -> str:
+        return self.model_names[tier]
+
+    def candidates(self, stage: Optional[str], risk: Optional[str] = None) -> List[str]:
+        """Routed tier followed by its fallbacks, skipping tiers that share a client"""
+        tiers = []
+        for tier in [self.tier_for(stage, risk)] + self.fallback_order:
+            if all(self.models[tier] is not self.models[seen] for seen in tiers):
+                tiers.append(tier)
+        return tiers
+
+    def _usage(self, contents, response) -> tuple[int, int]:
+        """(billed input tokens, output tokens) from usage metadata, else estimated"""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        if isinstance(prompt_tokens, int) and isinstance(output_tokens, int):
+            cached_tokens = getattr(usage, "cached_content_token_count", 0)
+            return prompt_tokens - (cached_tokens if isinstance(cached_tokens, int) else 0), output_tokens
+        text = contents if isinstance(contents, str) else " ".join(
+            part for part in (contents if isinstance(contents, list) else []) if isinstance(part, str)
+        )
+        return estimate_tokens(text), estimate_tokens(getattr(response, "text", "") or "")
+
+    def record(self, tier: str, seconds: float, contents=None, response=None, failed: bool = False) -> None:
+        """Account one call on a tier (also to the current run's metrics sink)"""
+        input_tokens, output_tokens = (0, 0) if failed else self._usage(contents, response)
+        input_rate, output_rate = (self.costs.get(tier) or [0.0, 0.0])[:2]
+        counts = {"calls": 1, "latency_seconds": seconds}
+        if failed:
+            counts["failures"] = 1
+        else:
+            counts.update(
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                cost_usd=(input_tokens * input_rate + output_tokens * output_rate) / 1_000_000
+            )
+        self._count(tier, counts)
+
+    def record_fallback(self, tier: str) -> None:
+        """Count a call that moved on from this tier after it failed"""
+        self._count(tier, {"fallbacks": 1})
+
+    def _count(self, tier: str, counts: Dict[str, float]) -> None:
+        entry = self._stats[tier]
+        for name, amount in counts.items():
+            entry[name] += amount
+            run_metrics.add(f"model_tiers.{tier}.{name}", amount)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Cumulative counters per tier (with the tier's model name)"""
+        return {tier: {"model": self.model_names[tier], **entry} for tier, entry in self._stats.items()}
+
+
+def create_model_router(settings, generation_config: Dict[str, Any], model_factory: Callable) -> ModelRouter:
+    """Router with one client per distinct configured model name"""
+    names = {
+        "fast": settings.gemini_fast_model or settings.gemini_model,
+        "standard": settings.gemini_model,
+        "reasoning": settings.gemini_reasoning_model or settings.gemini_model
+    }
+    clients: Dict[str, Any] = {}
+    for name in names.values():
+        if name not in clients:
+            clients[name] = model_factory(name, generation_config=generation_config)
+
+    return ModelRouter(
+        {tier: clients[name] for tier, name in names.items()},
+        model_names=names,
+        routes=settings.model_routes,
+        risk_routes=settings.model_risk_routes,
+        fallback_order=settings.model_fallback_order,
+        costs=settings.model_costs
+    )
@@ -3,14 +3,44 @@ NIST 800-53 Rev 5 Catalog Service
 
 This service loads and parses the NIST 800-53 Rev 5 control catalog,
 providing search, lookup, and validation capabilities for compliance analysis.
+
+The control text embedded in prompts is rendered once per control and
+verbosity level when the catalog loads (see build_prompt_fragments), so
+prompt builders only concatenate ready fragments. Their token features are
+counted at the same time; the token count itself applies the estimator's
+calibration when it is read, so calibration attached later is honoured.
+
+Control requirements are kept in a bounded LRU cache (Settings.nist_cache_size,
+by default large enough for the whole catalog) whose hit, miss and eviction
+counts are reported in processing metrics. Cached requirements are read-only
+mappings shared by every caller. With a memory-mapped snapshot they are views
+(RequirementsView) that read their fields from the snapshot when accessed, so
+a warm cache holds row references rather than a decoded copy of the catalog
+text; each access decodes the field again.
+
+Controls are held as compact read-only records (CatalogControl): slotted,
+with interned IDs and family codes, tuples instead of lists and identical
+prose stored once. The raw catalog JSON is released after parsing. Pydantic
+NISTControl views are built only where a model is returned to API callers.
 """
 
 import json
+import sys
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Any
 from functools import lru_cache
 from pydantic import BaseModel
 
+from app.config import get_settings
+from app.services.token_estimator import get_token_estimator, raw_token_count, token_features
+from app.utils.bounded_cache import BoundedLRUCache
+
+
+# Prompt verbosity levels, richest first
+PROMPT_FRAGMENT_LEVELS = ("full", "concise", "minimal")
+
 
 class AssessmentMethod(BaseModel):
     """Assessment method for a control"""
@@ -60,6 +90,72 @@ class NISTControl(BaseModel):
     properties: Dict[str, str] = {}
 
 
+class CatalogEnhancement:
+    """Compact read-only control enhancement record"""
+    __slots__ = ("id", "title", "statement", "guidance", "related_controls")
+    
+    def __init__(self, id: str, title: str, statement: str, guidance: Optional[str], related_controls: tuple):
+        for name, value in zip(self.__slots__, (id, title, statement, guidance, related_controls)):
+            object.__setattr__(self, name, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+    
+    def to_model(self) -> ControlEnhancement:
+        return ControlEnhancement(
+            id=self.id,
+            title=self.title,
+            statement=self.statement,
+            guidance=self.guidance,
+            related_controls=list(self.related_controls)
+        )
+
+
+class CatalogControl:
+    """
+    Compact read-only control record
+    
+    Same fields as NISTControl; lists are tuples and properties are
+    (name, value) pairs. Use to_model() for a pydantic view.
+    """
+    __slots__ = (
+        "id", "title", "class_type", "family", "statement", "guidance",
+        "related_controls", "enhancements", "properties"
+    )
+    
+    def __init__(
+        self,
+        id: str,
+        title: str,
+        class_type: str,
+        family: str,
+        statement: str,
+        guidance: Optional[str],
+        related_controls: tuple,
+        enhancements: tuple,
+        properties: tuple
+    ):
+        values = (id, title, class_type, family, statement, guidance, related_controls, enhancements, properties)
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+    
+    def to_model(self) -> NISTControl:
+        return NISTControl(
+            id=self.id,
+            title=self.title,
+            class_type=self.class_type,
+            family=self.family,
+            statement=self.statement,
+            guidance=self.guidance,
+            related_controls=list(self.related_controls),
+            enhancements=[e.to_model() for e in self.enhancements],
+            properties=dict(self.properties)
+        )
+
+
 class ControlFamily(BaseModel):
     """Control family grouping"""
     id: str  # e.g., AC
@@ -67,20 +163,148 @@ class ControlFamily(BaseModel):
     controls: List[str] = []  # List of control IDs
 
 
+@dataclass(frozen=True)
+class PromptFragment:
+    """Ready-to-embed control text for one prompt verbosity level"""
+    text: str
+    chars: int
+    raw_tokens: int  # Uncalibrated count (token_estimator.raw_token_count)
+    
+    @classmethod
+    def of(cls, text: str) -> "PromptFragment":
+        return cls(text, len(text), raw_token_count(token_features(text)))
+    
+    @property
+    def tokens(self) -> int:
+        """Estimated tokens under the token estimator's current calibration"""
+        return get_token_estimator().estimate_counted(self.chars, self.raw_tokens)
+
+
+def build_prompt_fragments(requirements: Dict[str, Any], control_id: Optional[str] = None) -> Dict[str, PromptFragment]:
+    """
+    Render a control's requirement text at each prompt verbosity level
+    
+    - full: complete statement, guidance and enhancement statements
+    - concise: statement and guidance excerpts, first five enhancement titles
+    - minimal: ID, title and statement excerpt (one entry of a batch prompt)
+    """
+    control_id = control_id or requirements.get('control_id', '')
+    statement = requirements.get('statement') or ''
+    guidance = requirements.get('guidance') or ''
+    enhancements = requirements.get('enhancements') or []
+    enhancement_details = "\n".join(
+        f"- {e['id']} {e['title']}: {e['statement']}" for e in enhancements
+    ) or "None"
+    enhancement_titles = ", ".join(f"{e['id']} {e['title']}" for e in enhancements[:5]) or "none"
+    
+    texts = {
+        "full": f"""Full Statement:
+{statement}
+
+Guidance:
+{guidance or 'N/A'}
+
+Control Enhancements:
+{enhancement_details}""",
+        "concise": f"""Statement: {statement[:400]}
+
+Guidance (summary): {guidance[:300]}
+
+Enhancements: {enhancement_titles}""",
+        "minimal": f"""{control_id}: {requirements.get('title', control_id)}
+Statement: {statement[:200]}..."""
+    }
+    return {level: PromptFragment.of(text) for level, text in texts.items()}
+
+
+def prompt_fragments(control_id: str, requirements: Mapping[str, Any]) -> Mapping[str, PromptFragment]:
+    """Fragments precomputed by the catalog, or rendered now for requirements from elsewhere"""
+    return requirements.get('prompt_fragments') or build_prompt_fragments(requirements, control_id)
+
+
+def _freeze(value: Any) -> Any:
+    """Read-only copy of nested dicts and lists (mapping proxies and tuples)"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+# Requirements key -> reader of a control record
+_REQUIREMENT_FIELDS = {
+    'control_id': lambda control: control.id,
+    'title': lambda control: control.title,
+    'statement': lambda control: control.statement,
+    'guidance': lambda control: control.guidance,
+    'related_controls': lambda control: list(control.related_controls),
+    'enhancements': lambda control: [
+        {
+            'id': e.id,
+            'title': e.title,
+            'statement': e.statement
+        }
+        for e in control.enhancements
+    ],
+    'assessment_methods': lambda control: ['EXAMINE', 'INTERVIEW', 'TEST'],  # Default methods
+    'class': lambda control: control.class_type,
+    'family': lambda control: control.family
+}
+
+
+class RequirementsView(Mapping):
+    """Read-only requirements of a control whose fields are read on access"""
+    __slots__ = ("_control", "_fragments")
+    
+    def __init__(self, control: CatalogControl, fragments: Optional[Mapping[str, Any]]):
+        self._control = control
+        self._fragments = fragments
+    
+    def __getitem__(self, key: str) -> Any:
+        if key == 'prompt_fragments':
+            return self._fragments
+        return _freeze(_REQUIREMENT_FIELDS[key](self._control))
+    
+    def __iter__(self):
+        yield from _REQUIREMENT_FIELDS
+        yield 'prompt_fragments'
+    
+    def __len__(self) -> int:
+        return len(_REQUIREMENT_FIELDS) + 1
+
+
 class NISTCatalogService:
     """Service for loading and querying NIST 800-53 Rev 5 catalog"""
     
-    def __init__(self, catalog_path: Optional[str] = None):
-        """Initialize the catalog service"""
+    def __init__(
+        self,
+        catalog_path: Optional[str] = None,
+        cache_size: int = 1200,
+        snapshot_path: Optional[str] = None
+    ):
+        """
+        Initialize the catalog service
+        
+        Args:
+            catalog_path: OSCAL catalog JSON (default: bundled Rev 5 catalog)
+            cache_size: Control requirements kept in the LRU cache
+            snapshot_path: Compiled snapshot to memory-map instead of parsing
+                the JSON in this process (compiled from the JSON when missing
+                or outdated; see catalog_snapshot)
+        """
         if catalog_path is None:
             # Default to the downloaded catalog
             catalog_path = Path(__file__).parent.parent.parent / "data" / "NIST_SP-800-53_rev5_catalog.json"
         
         self.catalog_path = Path(catalog_path)
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self._snapshot = None
         self._catalog_data: Optional[Dict] = None
-        self._controls: Dict[str, NISTControl] = {}
+        self._controls: Dict[str, CatalogControl] = {}
         self._families: Dict[str, ControlFamily] = {}
-        self._requirements_cache: Dict[str, Dict[str, Any]] = {}  # Cache for control requirements
+        self._requirements_cache = BoundedLRUCache(cache_size, metrics_name="requirements_cache")  # Control ID -> read-only requirements
+        self._prompt_fragments: Dict[str, Dict[str, PromptFragment]] = {}  # Control ID -> level -> fragment
+        self._texts: Dict[str, str] = {}  # Distinct prose while parsing (see _shared_text)
         self._loaded = False
     
     def load_catalog(self) -> None:
@@ -88,21 +312,27 @@ class NISTCatalogService:
         if self._loaded:
             return
         
+        if self.snapshot_path is not None:
+            self._load_snapshot()
+            return
+        
         if not self.catalog_path.exists():
             raise FileNotFoundError(f"NIST catalog not found at {self.catalog_path}")
         
         print(f"Loading NIST 800-53 Rev 5 catalog from {self.catalog_path}")
         
         with open(self.catalog_path, 'r', encoding='utf-8') as f:
-            self._catalog_data = json.load(f)
+            catalog_data = json.load(f)
         
-        # Parse the catalog structure
-        catalog = self._catalog_data.get('catalog', {})
+        # Parse the catalog structure; only the metadata of the raw JSON is kept
+        catalog = catalog_data.get('catalog', {})
         groups = catalog.get('groups', [])
+        self._catalog_data = {'catalog': {key: value for key, value in catalog.items() if key != 'groups'}}
+        self._texts = {}
         
         # Process control families and controls
         for group in groups:
-            family_id = group.get('id', '').upper()
+            family_id = sys.intern(group.get('id', '').upper())
             family_title = group.get('title', '')
             
             family = ControlFamily(
@@ -121,25 +351,67 @@ class NISTCatalogService:
             
             self._families[family_id] = family
         
+        self._texts = {}
+        
+        # Prompt text per control and verbosity level, rendered once
+        for control in self._controls.values():
+            self._prompt_fragments[control.id] = MappingProxyType(
+                build_prompt_fragments(self._build_requirements(control))
+            )
+        
         self._loaded = True
         print(f"Loaded {len(self._controls)} controls from {len(self._families)} families")
     
-    def _parse_control(self, control_data: Dict, family_id: str) -> Optional[NISTControl]:
+    def _load_snapshot(self) -> None:
+        """Memory-map the compiled snapshot, compiling it first when missing or outdated"""
+        from app.services.catalog_snapshot import (
+            CatalogSnapshot, MappedControl, compile_snapshot, snapshot_is_current
+        )
+        
+        if not snapshot_is_current(self.snapshot_path, self.catalog_path):
+            if not self.catalog_path.exists():
+                raise FileNotFoundError(f"NIST catalog not found at {self.catalog_path}")
+            print(f"Compiling NIST catalog snapshot {self.snapshot_path}")
+            compile_snapshot(self.catalog_path, self.snapshot_path)
+        
+        snapshot = CatalogSnapshot(self.snapshot_path)
+        self._snapshot = snapshot
+        self._catalog_data = {'catalog': snapshot.metadata}
+        for family_id, family_title, rows in snapshot.families():
+            family = ControlFamily(id=family_id, title=family_title, controls=[])
+            for row in rows:
+                control = MappedControl(snapshot, row)
+                control_id = sys.intern(control.id)
+                self._controls[control_id] = control
+                self._prompt_fragments[control_id] = snapshot.fragments(row)
+                family.controls.append(control_id)
+            self._families[family_id] = family
+        
+        self._loaded = True
+        print(f"Mapped {len(self._controls)} controls from {len(self._families)} families ({self.snapshot_path})")
+    
+    def _shared_text(self, text: Optional[str]) -> Optional[str]:
+        """One string object per distinct prose text in the catalog (during load)"""
+        if not text:
+            return text
+        return self._texts.setdefault(text, text)
+    
+    def _parse_control(self, control_data: Dict, family_id: str) -> Optional[CatalogControl]:
         """Parse a single control from the OSCAL JSON structure"""
         try:
-            control_id = control_data.get('id', '').upper()
-            title = control_data.get('title', '')
+            control_id = sys.intern(control_data.get('id', '').upper())
+            title = self._shared_text(control_data.get('title', ''))
             
             # Extract control statement
-            statement = self._extract_statement(control_data)
+            statement = self._shared_text(self._extract_statement(control_data))
             
             # Extract properties
             properties = {}
             for prop in control_data.get('props', []):
-                properties[prop.get('name', '')] = prop.get('value', '')
+                properties[sys.intern(prop.get('name', ''))] = prop.get('value', '')
             
             # Extract control class
-            class_type = properties.get('label', 'Unknown')
+            class_type = sys.intern(properties.get('label', 'Unknown'))
             
             # Extract guidance
             guidance = None
@@ -147,15 +419,11 @@ class NISTCatalogService:
             for part in parts:
                 part_name = part.get('name', '')
                 if part_name == 'guidance':
-                    guidance = part.get('prose', '')
+                    guidance = self._shared_text(part.get('prose', ''))
                     break
             
             # Extract related controls
-            related_controls = []
-            links = control_data.get('links', [])
-            for link in links:
-                if link.get('rel') == 'related':
-                    related_controls.append(link.get('href', '').replace('#', ''))
+            related_controls = self._related_controls(control_data)
             
             # Extract enhancements
             enhancements = []
@@ -164,8 +432,8 @@ class NISTCatalogService:
                 if enhancement:
                     enhancements.append(enhancement)
             
-            # Create control object
-            control = NISTControl(
+            # Create control record
+            control = CatalogControl(
                 id=control_id,
                 title=title,
                 class_type=class_type,
@@ -173,8 +441,8 @@ class NISTCatalogService:
                 statement=statement,
                 guidance=guidance,
                 related_controls=related_controls,
-                enhancements=enhancements,
-                properties=properties
+                enhancements=tuple(enhancements),
+                properties=tuple(properties.items())
             )
             
             return control
@@ -183,29 +451,25 @@ class NISTCatalogService:
             print(f"Error parsing control: {e}")
             return None
     
-    def _parse_enhancement(self, enhancement_data: Dict) -> Optional[ControlEnhancement]:
+    def _parse_enhancement(self, enhancement_data: Dict) -> Optional[CatalogEnhancement]:
         """Parse a control enhancement"""
         try:
-            enhancement_id = enhancement_data.get('id', '').upper()
-            title = enhancement_data.get('title', '')
-            statement = self._extract_statement(enhancement_data)
+            enhancement_id = sys.intern(enhancement_data.get('id', '').upper())
+            title = self._shared_text(enhancement_data.get('title', ''))
+            statement = self._shared_text(self._extract_statement(enhancement_data))
             
             # Extract guidance
             guidance = None
             parts = enhancement_data.get('parts', [])
             for part in parts:
                 if part.get('name') == 'guidance':
-                    guidance = part.get('prose', '')
+                    guidance = self._shared_text(part.get('prose', ''))
                     break
             
             # Extract related controls
-            related_controls = []
-            links = enhancement_data.get('links', [])
-            for link in links:
-                if link.get('rel') == 'related':
-                    related_controls.append(link.get('href', '').replace('#', ''))
+            related_controls = self._related_controls(enhancement_data)
             
-            return ControlEnhancement(
+            return CatalogEnhancement(
                 id=enhancement_id,
                 title=title,
                 statement=statement,
@@ -216,6 +480,14 @@ class NISTCatalogService:
             print(f"Error parsing enhancement: {e}")
             return None
     
+    def _related_controls(self, control_data: Dict) -> tuple:
+        """Interned IDs of the controls a control or enhancement links as related"""
+        return tuple(
+            sys.intern(link.get('href', '').replace('#', ''))
+            for link in control_data.get('links', [])
+            if link.get('rel') == 'related'
+        )
+    
     def _extract_statement(self, control_data: Dict) -> str:
         """Extract control statement from OSCAL structure"""
         parts = control_data.get('parts', [])
@@ -237,9 +509,9 @@ class NISTCatalogService:
         return ' '.join(statements)
     
     def get_all_controls(self) -> List[NISTControl]:
-        """Get all controls from the catalog"""
+        """Get all controls from the catalog (pydantic views built per call)"""
         self.load_catalog()
-        return list(self._controls.values())
+        return [control.to_model() for control in self._controls.values()]
     
     def get_controls_by_family(self, family_code: str) -> List[Dict[str, str]]:
         """
@@ -265,11 +537,19 @@ class NISTCatalogService:
         return sorted(controls, key=lambda x: x["id"])
     
     def get_control(self, control_id: str) -> Optional[NISTControl]:
-        """Get a control by ID"""
+        """Get a control by ID (pydantic view built per call)"""
+        control = self.get_control_record(control_id)
+        return control.to_model() if control else None
+    
+    def get_control_record(self, control_id: str) -> Optional[CatalogControl]:
+        """Get the compact read-only record of a control by ID"""
         if not self._loaded:
             self.load_catalog()
         return self._controls.get(control_id.upper())
     
+    def has_control(self, control_id: str) -> bool:
+        return self.get_control_record(control_id) is not None
+    
     def get_family(self, family_id: str) -> Optional[ControlFamily]:
         """Get a control family by ID"""
         if not self._loaded:
@@ -299,11 +579,11 @@ class NISTCatalogService:
             if (query_lower in control.title.lower() or
                 query_lower in control.statement.lower() or
                 (control.guidance and query_lower in control.guidance.lower())):
-                results.append(control)
+                results.append(control.to_model())
         
         return results
     
-    def get_control_requirements(self, control_id: str) -> Dict[str, Any]:
+    def get_control_requirements(self, control_id: str) -> Mapping[str, Any]:
         """
         Get comprehensive requirements for a control including:
         - Control statement
@@ -311,42 +591,44 @@ class NISTCatalogService:
         - Recommended assessment methods
         - Related controls
         
-        Results are cached in memory for performance.
+        Results are cached in a bounded LRU cache and shared between callers,
+        so they are read-only (nested mappings and tuples). `prompt_fragments`
+        holds the control's precomputed prompt text per verbosity level.
         """
         cache_key = control_id.upper()
         
         # Check cache first
-        if cache_key in self._requirements_cache:
-            return self._requirements_cache[cache_key]
+        cached = self._requirements_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        control = self.get_control(control_id)
+        control = self.get_control_record(control_id)
         if not control:
             return {}
         
-        requirements = {
-            'control_id': control.id,
-            'title': control.title,
-            'statement': control.statement,
-            'guidance': control.guidance,
-            'related_controls': control.related_controls,
-            'enhancements': [
-                {
-                    'id': e.id,
-                    'title': e.title,
-                    'statement': e.statement
-                }
-                for e in control.enhancements
-            ],
-            'assessment_methods': ['EXAMINE', 'INTERVIEW', 'TEST'],  # Default methods
-            'class': control.class_type,
-            'family': control.family
-        }
+        if self._snapshot is not None:
+            # Keep the text in the shared mapped pages, not in this process's heap
+            requirements = RequirementsView(control, self._prompt_fragments.get(control.id))
+        else:
+            requirements = _freeze(self._build_requirements(control))
+            requirements = MappingProxyType({
+                **requirements,
+                'prompt_fragments': self._prompt_fragments.get(control.id)
+            })
         
         # Cache the result
-        self._requirements_cache[cache_key] = requirements
+        self._requirements_cache.put(cache_key, requirements)
         return requirements
     
-    def get_control_requirements_batch(self, control_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    def cache_stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counts of the requirements cache (process-wide)"""
+        return self._requirements_cache.stats()
+    
+    def _build_requirements(self, control: CatalogControl) -> Dict[str, Any]:
+        """Requirements dict of a parsed control"""
+        return {key: read(control) for key, read in _REQUIREMENT_FIELDS.items()}
+    
+    def get_control_requirements_batch(self, control_ids: List[str]) -> Dict[str, Mapping[str, Any]]:
         """
         Efficiently load multiple control requirements at once
         
@@ -381,7 +663,7 @@ class NISTCatalogService:
         Validate if evidence meets control requirements
         Returns validation result with gaps and recommendations
         """
-        control = self.get_control(control_id)
+        control = self.get_control_record(control_id)
         if not control:
             return {
                 'valid': False,
@@ -404,7 +686,7 @@ class NISTCatalogService:
             'recommendations': self._generate_recommendations(control)
         }
     
-    def _generate_recommendations(self, control: NISTControl) -> List[str]:
+    def _generate_recommendations(self, control: CatalogControl) -> List[str]:
         """Generate basic recommendations for control implementation"""
         recommendations = []
         
@@ -422,6 +704,11 @@ class NISTCatalogService:
 @lru_cache()
 def get_nist_catalog_service() -> NISTCatalogService:
     """Get cached NIST catalog service instance"""
-    service = NISTCatalogService()
+    settings = get_settings()
+    snapshot_path = None
+    if settings.nist_catalog_mode == "mmap":
+        from app.services.catalog_snapshot import DEFAULT_SNAPSHOT_FILE
+        snapshot_path = settings.nist_catalog_snapshot_path or DEFAULT_SNAPSHOT_FILE
+    service = NISTCatalogService(cache_size=settings.nist_cache_size, snapshot_path=snapshot_path)
     service.load_catalog()
     return service
@@ -0,0 +1,352 @@
+"""
+OSCAL Builder
+
+Deterministic (non-LLM) construction of OSCAL 1.2.0 System Security Plan and
+POA&M documents from Agent 2's control mappings and gaps. Every mapping and
+gap is emitted: mappings become SSP components and `by-components` under one
+`implemented-requirement` per control, gaps become POA&M risks and
+`poam-items`. The build is a single pass over the inputs, and identifiers are
+UUIDv5 values derived from the session, so the same inputs always produce the
+same documents. OSCAL requires at least one implemented requirement and one
+POA&M item, so a document with nothing to report is left empty ({}) and is
+neither exported nor validated.
+"""
+
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.models import (
+    ControlGap, ControlMapping, EvidenceArtifact, OSCALComponent, POAMEntry, RiskLevel
+)
+
+
+# Namespace for D.A.V.E-specific props (OSCAL requires ns on non-core names)
+DAVE_NS = "urn:dave:ns:oscal"
+
+OSCAL_VERSION = "1.2.0"
+
+# Published NIST profile the SSP imports (matches its moderate security-sensitivity-level)
+NIST_PROFILE_HREF = (
+    "https://raw.githubusercontent.com/usnistgov/oscal-content/main/nist.gov/SP800-53/rev5/json/"
+    "NIST_SP-800-53_rev5_MODERATE-baseline_profile.json"
+)
+
+# Agent 2 implementation statuses -> OSCAL implementation-status states
+IMPLEMENTATION_STATES = {
+    "implemented": "implemented",
+    "partially_implemented": "partial",
+    "partial": "partial",
+    "planned": "planned",
+    "not_implemented": "planned",
+    "alternative": "alternative",
+    "not_applicable": "not-applicable",
+}
+
+# Days from generation to each POA&M milestone (assessment, implementation, validation)
+MILESTONE_OFFSETS = {
+    RiskLevel.CRITICAL: (7, 30, 45),
+    RiskLevel.HIGH: (14, 45, 60),
+    RiskLevel.MEDIUM: (30, 90, 120),
+    RiskLevel.LOW: (30, 120, 180),
+    RiskLevel.INFO: (60, 180, 240),
+}
+
+_CONTROL_ID_RE = re.compile(r'^([A-Za-z]{2,3})-(\d+)(?:\((\d+)\))?$')
+
+
+def oscal_control_id(control_id: str) -> str:
+    """Convert a NIST control ID (AC-2, AC-2(1)) to its OSCAL token (ac-2, ac-2.1)"""
+    match = _CONTROL_ID_RE.match(control_id.strip())
+    if not match:
+        return control_id.strip().lower()
+    family, number, enhancement = match.groups()
+    token = f"{family.lower()}-{int(number)}"
+    return f"{token}.{int(enhancement)}" if enhancement else token
+
+
+def _timestamp(value: datetime) -> str:
+    text = value.isoformat()
+    return text + "Z" if value.tzinfo is None else text
+
+
+def _prop(name: str, value: Any) -> Dict[str, str]:
+    return {"name": name, "ns": DAVE_NS, "value": str(value)}
+
+
+@dataclass
+class OSCALArtifacts:
+    """Everything Agent 3 produces for one assessment"""
+    components: List[OSCALComponent]
+    poam_entries: List[POAMEntry]
+    ssp: Dict[str, Any]  # {} when there is no mapping or gap
+    poam: Dict[str, Any]  # {} when there is no gap
+
+    def documents(self) -> List[tuple[str, Dict[str, Any]]]:
+        """(document type value, document) for each document that was generated"""
+        return [(name, document) for name, document in (("ssp", self.ssp), ("poam", self.poam)) if document]
+
+
+class OSCALBuilder:
+    """Builds OSCAL SSP and POA&M documents for one assessment session"""
+
+    def __init__(self, session_id: str, generated_at: Optional[datetime] = None):
+        self.session_id = session_id
+        self.generated_at = generated_at or datetime.utcnow()
+        self._namespace = uuid.uuid5(uuid.NAMESPACE_URL, f"urn:dave:session:{session_id}")
+
+    def _uuid(self, *parts: str) -> str:
+        """Stable UUIDv5 for a named element of this session's documents"""
+        return str(uuid.uuid5(self._namespace, "/".join(parts)))
+
+    def _metadata(self, title: str) -> Dict[str, str]:
+        return {
+            "title": title,
+            "last-modified": _timestamp(self.generated_at),
+            "version": "1.0.0",
+            "oscal-version": OSCAL_VERSION
+        }
+
+    def build(
+        self,
+        control_mappings: List[ControlMapping],
+        control_gaps: List[ControlGap],
+        evidence_artifacts: List[EvidenceArtifact]
+    ) -> OSCALArtifacts:
+        """Build components, POA&M entries and both OSCAL documents"""
+        resources = {
+            artifact.id: self._uuid("resource", artifact.id)
+            for artifact in evidence_artifacts
+        }
+
+        components = [
+            self._component(index, mapping)
+            for index, mapping in enumerate(control_mappings)
+        ]
+        poam_entries = [
+            self._poam_entry(index, gap)
+            for index, gap in enumerate(control_gaps)
+        ]
+
+        ssp = self._ssp(control_mappings, control_gaps, components, evidence_artifacts, resources)
+        poam = self._poam(control_gaps, poam_entries)
+
+        return OSCALArtifacts(
+            components=components,
+            poam_entries=poam_entries,
+            ssp=ssp,
+            poam=poam
+        )
+
+    # Summary models (API response / dashboard)
+
+    def _component(self, index: int, mapping: ControlMapping) -> OSCALComponent:
+        return OSCALComponent(
+            uuid=self._uuid("component", str(index), mapping.control_id),
+            component_id=f"component-{oscal_control_id(mapping.control_id).replace('.', '-')}",
+            title=f"{mapping.control_name} Implementation",
+            description=mapping.implementation_description,
+            component_type="software",
+            control_implementations=[{
+                "control_id": mapping.control_id,
+                "status": mapping.implementation_status,
+                "evidence": mapping.evidence_ids
+            }],
+            props={
+                "compliance_status": mapping.implementation_status,
+                "confidence": str(mapping.confidence_score)
+            }
+        )
+
+    def _poam_entry(self, index: int, gap: ControlGap) -> POAMEntry:
+        assess, implement, validate = (
+            (self.generated_at + timedelta(days=days)).date().isoformat()
+            for days in MILESTONE_OFFSETS.get(gap.risk_level, MILESTONE_OFFSETS[RiskLevel.MEDIUM])
+        )
+        return POAMEntry(
+            uuid=self._uuid("poam-item", str(index), gap.control_id),
+            poam_id=f"poam-{oscal_control_id(gap.control_id).replace('.', '-')}",
+            title=f"Remediate {gap.control_name}",
+            description=gap.gap_description,
+            related_controls=[gap.control_id],
+            risk_level=gap.risk_level,
+            scheduled_completion_date=validate,
+            remediation_plan="\n".join(gap.recommended_actions),
+            milestones=[
+                {"milestone": "Assessment", "target_date": assess},
+                {"milestone": "Implementation", "target_date": implement},
+                {"milestone": "Validation", "target_date": validate}
+            ]
+        )
+
+    # OSCAL documents
+
+    def _ssp(
+        self,
+        control_mappings: List[ControlMapping],
+        control_gaps: List[ControlGap],
+        components: List[OSCALComponent],
+        evidence_artifacts: List[EvidenceArtifact],
+        resources: Dict[str, str]
+    ) -> Dict[str, Any]:
+        if not control_mappings and not control_gaps:
+            return {}
+        this_system = self._uuid("component", "this-system")
+
+        # One implemented-requirement per control, in first-seen order
+        requirements: Dict[str, Dict[str, Any]] = {}
+
+        def requirement_for(control_id: str) -> Dict[str, Any]:
+            token = oscal_control_id(control_id)
+            if token not in requirements:
+                requirements[token] = {
+                    "uuid": self._uuid("implemented-requirement", token),
+                    "control-id": token,
+                    "by-components": []
+                }
+            return requirements[token]
+
+        for mapping, component in zip(control_mappings, components):
+            by_component = {
+                "component-uuid": component.uuid,
+                "uuid": self._uuid("by-component", component.uuid),
+                "description": mapping.implementation_description or f"Implementation of {mapping.control_id}",
+                "props": [_prop("confidence", round(mapping.confidence_score, 2))],
+                "implementation-status": {
+                    "state": IMPLEMENTATION_STATES.get(mapping.implementation_status.lower(), "planned")
+                }
+            }
+            links = [
+                {"href": f"#{resources[evidence_id]}", "rel": "evidence"}
+                for evidence_id in mapping.evidence_ids
+                if evidence_id in resources
+            ]
+            if links:
+                by_component["links"] = links
+            requirement_for(mapping.control_id)["by-components"].append(by_component)
+
+        for gap in control_gaps:
+            requirement = requirement_for(gap.control_id)
+            if not requirement["by-components"]:
+                # Gap with no supporting evidence: the system as a whole plans it
+                requirement["by-components"].append({
+                    "component-uuid": this_system,
+                    "uuid": self._uuid("by-component", "this-system", gap.control_id),
+                    "description": gap.gap_description,
+                    "props": [_prop("risk-level", gap.risk_level.value)],
+                    "implementation-status": {"state": "planned"}
+                })
+
+        ssp_components = [{
+            "uuid": this_system,
+            "type": "this-system",
+            "title": "This System",
+            "description": "The information system described by the submitted evidence",
+            "status": {"state": "operational"}
+        }]
+        ssp_components.extend(
+            {
+                "uuid": component.uuid,
+                "type": component.component_type,
+                "title": component.title,
+                "description": component.description or component.title,
+                "props": [_prop(name, value) for name, value in component.props.items()],
+                "status": {"state": "operational"}
+            }
+            for component in components
+        )
+
+        document = {
+            "uuid": self._uuid("ssp"),
+            "metadata": self._metadata("D.A.V.E Generated SSP"),
+            "import-profile": {"href": NIST_PROFILE_HREF},
+            "system-characteristics": {
+                "system-ids": [{"identifier-type": "https://ietf.org/rfc/rfc4122", "id": self.session_id}],
+                "system-name": "D.A.V.E Assessed System",
+                "description": "System security plan generated from evidence analysis",
+                "security-sensitivity-level": "moderate",
+                "system-information": {
+                    "information-types": [{
+                        "uuid": self._uuid("information-type"),
+                        "title": "Assessed System Information",
+                        "description": "Information processed by the assessed system",
+                        "confidentiality-impact": {"base": "fips-199-moderate"},
+                        "integrity-impact": {"base": "fips-199-moderate"},
+                        "availability-impact": {"base": "fips-199-moderate"}
+                    }]
+                },
+                "status": {"state": "operational"},
+                "authorization-boundary": {
+                    "description": "Boundary as described by the submitted evidence"
+                }
+            },
+            "system-implementation": {
+                "users": [{"uuid": self._uuid("user", "assessor"), "title": "Assessor"}],
+                "components": ssp_components
+            },
+            "control-implementation": {
+                "description": "Control implementation status derived from evidence analysis",
+                "implemented-requirements": list(requirements.values())
+            }
+        }
+
+        if evidence_artifacts:
+            document["back-matter"] = {
+                "resources": [
+                    {
+                        "uuid": resources[artifact.id],
+                        "title": artifact.filename,
+                        "description": artifact.content_summary or artifact.filename
+                    }
+                    for artifact in evidence_artifacts
+                ]
+            }
+
+        return {"system-security-plan": document}
+
+    def _poam(self, control_gaps: List[ControlGap], poam_entries: List[POAMEntry]) -> Dict[str, Any]:
+        if not control_gaps:
+            return {}
+        risks = []
+        items = []
+
+        for index, (gap, entry) in enumerate(zip(control_gaps, poam_entries)):
+            risk_uuid = self._uuid("risk", str(index), gap.control_id)
+            remediation = {
+                "uuid": self._uuid("remediation", str(index), gap.control_id),
+                "lifecycle": "planned",
+                "title": entry.title,
+                "description": entry.remediation_plan or entry.title
+            }
+            risks.append({
+                "uuid": risk_uuid,
+                "title": f"{gap.control_id}: {gap.control_name}",
+                "description": gap.gap_description,
+                "statement": gap.gap_description,
+                "props": [
+                    _prop("risk-level", gap.risk_level.value),
+                    _prop("risk-score", gap.risk_score)
+                ],
+                "status": "open",
+                "remediations": [remediation],
+                "deadline": f"{entry.scheduled_completion_date}T00:00:00Z"
+            })
+            items.append({
+                "uuid": entry.uuid,
+                "title": entry.title,
+                "description": entry.description,
+                "props": [_prop("control-id", oscal_control_id(gap.control_id))],
+                "related-risks": [{"risk-uuid": risk_uuid}]
+            })
+
+        document = {
+            "uuid": self._uuid("poam"),
+            "metadata": self._metadata("D.A.V.E Generated POA&M"),
+            "system-id": {"identifier-type": "https://ietf.org/rfc/rfc4122", "id": self.session_id},
+            "poam-items": items,
+            "risks": risks
+        }
+
+        return {"plan-of-action-and-milestones": document}
@@ -0,0 +1,270 @@
+"""
+OSCAL Export Service
+
+Serializes a session's OSCAL SSP and POA&M into the downloadable JSON
+document. The first download streams the encoder's fragments to the client
+in chunks, compressing them on the fly for gzip/br, while keeping a copy; a
+completed pass caches the serialized bytes (and that coding's compressed
+bytes) per session, so repeated downloads are served without re-serializing.
+The strong ETag is a fingerprint of the result fields the deterministic
+builder reads, so it is known before the first byte is sent.
+"""
+
+import hashlib
+import json
+import threading
+import zlib
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.config import get_settings
+from app.models import AnalysisResult
+from app.services.oscal_builder import OSCALArtifacts, OSCALBuilder
+from app.services.oscal_validator import (
+    OSCALDocumentType, OSCALValidatorService, ValidationResult, get_oscal_validator_service
+)
+from app.utils.bounded_cache import BoundedLRUCache
+
+try:
+    import brotli
+except ImportError:  # Optional: br is only offered when the package is installed
+    brotli = None
+
+
+# Bump when the serialized layout changes so stale ETags never match
+EXPORT_FORMAT_VERSION = "3"
+
+# Result fields the OSCAL builder reads (the export is a pure function of them)
+EXPORT_INPUT_FIELDS = {"session_id", "created_at", "control_mappings", "control_gaps", "evidence_artifacts"}
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def build_export_artifacts(result: AnalysisResult) -> OSCALArtifacts:
+    """Rebuild the session's OSCAL documents (deterministic, so identical to the validated ones)"""
+    builder = OSCALBuilder(result.session_id, result.created_at)
+    return builder.build(result.control_mappings, result.control_gaps, result.evidence_artifacts)
+
+
+def export_fingerprint(result: AnalysisResult) -> str:
+    """Digest of everything the serialized export depends on"""
+    digest = hashlib.sha256(EXPORT_FORMAT_VERSION.encode("utf-8"))
+    digest.update(result.model_dump_json(include=EXPORT_INPUT_FIELDS).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def iter_oscal_json(artifacts: OSCALArtifacts) -> Iterator[str]:
+    """Yield the export document (SSP and POA&M side by side, when generated) as JSON text fragments"""
+    yield from _ENCODER.iterencode({**artifacts.ssp, **artifacts.poam})
+
+
+def iter_chunks(data: bytes) -> Iterator[bytes]:
+    for start in range(0, len(data), STREAM_CHUNK_BYTES):
+        yield data[start:start + STREAM_CHUNK_BYTES]
+
+
+def supported_encodings() -> List[str]:
+    """Content codings in server preference order"""
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def _compressor(encoding: str) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes]]:
+    """(compress chunk, finish) for a streaming content coding (deterministic output, so ETags hold)"""
+    if encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # gzip container, mtime 0
+        return compressor.compress, compressor.flush
+    if encoding == "br" and brotli is not None:
+        compressor = brotli.Compressor(quality=5)
+        return compressor.process, compressor.finish
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick a content coding from an Accept-Encoding header
+    
+    Compression is preferred whenever a supported coding is acceptable (highest
+    q-value, server preference on ties); otherwise identity, unless the client
+    refused it ("identity;q=0", or "*;q=0" without an identity entry), in which
+    case None is returned (406 Not Acceptable).
+    """
+    if not accept_encoding:
+        return "identity"
+
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[token] = weight
+
+    wildcard = weights.get("*")
+    best, best_weight = None, 0.0
+    for encoding in supported_encodings():
+        weight = weights.get(encoding, wildcard or 0.0)
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    if best is not None:
+        return best
+
+    identity = weights.get("identity", 1.0 if wildcard is None else wildcard)
+    return "identity" if identity > 0 else None
+
+
+def oscal_valid_header(validations: List[ValidationResult]) -> str:
+    """X-OSCAL-Valid: false on any error, unknown unless every document (at least one) was schema-checked"""
+    if not all(v.is_valid for v in validations):
+        return "false"
+    if not validations or not all(v.schema_validated for v in validations):
+        return "unknown"
+    return "true"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison (RFC 9110 13.1.2)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+@dataclass
+class OSCALExport:
+    """OSCAL export for one analysis result: validated documents, ETag and cached bytes"""
+    result: AnalysisResult
+    digest: str
+    headers: Dict[str, str]
+    artifacts: Optional[OSCALArtifacts]  # Released once the serialized bytes are cached
+    encoded: Dict[str, bytes] = field(default_factory=dict)  # Content coding -> complete body
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def etag(self, encoding: str = "identity") -> str:
+        """Strong ETag; each content coding is a distinct representation"""
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def cached_body(self, encoding: str) -> Optional[bytes]:
+        return self.encoded.get(encoding)
+
+    def _serialized(self) -> Iterator[bytes]:
+        """Uncompressed body in chunks: cached bytes, else serialized from the documents"""
+        artifacts = self.artifacts  # Read first: it is only released after the body is cached
+        body = self.encoded.get("identity")
+        if body is not None:
+            yield from iter_chunks(body)
+            return
+        pending: List[str] = []
+        size = 0
+        for fragment in iter_oscal_json(artifacts):
+            pending.append(fragment)
+            size += len(fragment)
+            if size >= STREAM_CHUNK_BYTES:
+                yield "".join(pending).encode("utf-8")
+                pending, size = [], 0
+        if pending:
+            yield "".join(pending).encode("utf-8")
+
+    def stream(self, encoding: str) -> Iterator[bytes]:
+        """
+        Body chunks in a content coding (blocking; iterated in a worker thread)
+        
+        Compression runs chunk by chunk as the document is serialized. Only a
+        pass that runs to completion caches its bytes, so a client that
+        disconnects midway leaves nothing partial behind.
+        """
+        cached = self.encoded.get(encoding)
+        if cached is not None:
+            yield from iter_chunks(cached)
+            return
+
+        compress, finish = _compressor(encoding) if encoding != "identity" else (None, None)
+        plain: List[bytes] = []
+        compressed: List[bytes] = []
+        for chunk in self._serialized():
+            plain.append(chunk)
+            if compress is not None:
+                chunk = compress(chunk)
+                compressed.append(chunk)
+            if chunk:
+                yield chunk
+        if finish is not None:
+            tail = finish()
+            compressed.append(tail)
+            yield tail
+
+        with self._lock:
+            self.encoded.setdefault("identity", b"".join(plain))
+            if compress is not None:
+                self.encoded.setdefault(encoding, b"".join(compressed))
+            self.artifacts = None
+
+
+class OSCALExportService:
+    """Builds and caches OSCAL exports per session"""
+
+    def __init__(
+        self,
+        cache_size: int = 32,
+        validator: Optional[OSCALValidatorService] = None
+    ):
+        self._cache = BoundedLRUCache(cache_size)
+        self.validator = validator or get_oscal_validator_service()
+
+    def get_cached(self, session_id: str, result: AnalysisResult) -> Optional[OSCALExport]:
+        """Cached export, if it was built from this exact result object"""
+        export = self._cache.get(session_id)
+        if export is not None and export.result is result:
+            return export
+        return None
+
+    def build(self, session_id: str, result: AnalysisResult) -> OSCALExport:
+        """Build, fingerprint and validate a result's documents (blocking; run in a thread)"""
+        artifacts = build_export_artifacts(result)
+
+        # In-process schema validation (no OSCAL-CLI), once per export, of the
+        # documents that were generated
+        validations = [
+            self.validator.validate_with_schema(document, OSCALDocumentType(name))
+            for name, document in artifacts.documents()
+        ]
+        headers = {
+            "X-OSCAL-Valid": oscal_valid_header(validations),
+            "X-OSCAL-Error-Count": str(sum(v.error_count for v in validations))
+        }
+
+        export = OSCALExport(
+            result=result,
+            digest=export_fingerprint(result),
+            headers=headers,
+            artifacts=artifacts
+        )
+        self._cache.put(session_id, export)
+        return export
+
+    def invalidate(self, session_id: str) -> None:
+        self._cache.pop(session_id)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+@lru_cache()
+def get_oscal_export_service() -> OSCALExportService:
+    """Get cached OSCAL export service instance"""
+    settings = get_settings()
+    return OSCALExportService(cache_size=settings.oscal_export_cache_size)
@@ -3,16 +3,56 @@ OSCAL Validator Service
 
 This service wraps OSCAL-CLI commands to validate OSCAL artifacts
 against the official OSCAL 1.2.0 schemas.
+
+OSCAL-CLI runs on the JVM, so a one-shot `oscal-cli validate` pays seconds of
+startup per document. When a validator worker command is configured, a pool of
+long-lived worker processes is kept warm and documents are exchanged with them
+as JSON lines over stdin/stdout:
+
+    request:  {"id": 1, "type": "ssp", "document": {...}}
+    response: {"id": 1, "valid": false, "errors": ["..."], "warnings": ["..."]}
+              {"id": 1, "error": "..."}  (the worker could not check the document)
+
+oscal-cli itself does not speak this protocol. The bundled worker,
+`python -m app.services.oscal_validator --worker` (run from backend/), checks
+documents against the OSCAL JSON schemas with each schema compiled once per
+worker, keeping schema validation off the API process's event loop.
+
+Without OSCAL-CLI, documents are checked in-process against the official
+OSCAL 1.2.0 JSON schemas (oscal_ssp_schema.json, oscal_poam_schema.json,
+oscal_assessment-results_schema.json, oscal_component_schema.json from the
+usnistgov/OSCAL release assets) placed in the schema directory. Fetch them
+with `python -m app.services.oscal_validator --fetch-schemas` (the Docker
+image does this at build time). A document no schema check could be run on
+is reported with `schema_validated=False` and a warning, never as validated.
 """
 
+import argparse
+import asyncio
+import hashlib
 import json
+import os
+import shlex
+import signal
+import shutil
 import tempfile
+import threading
 import subprocess
+import sys
+import urllib.request
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Any
+
+import regex
+from jsonschema import validators as jsonschema_validators
+from jsonschema.exceptions import ValidationError as SchemaValidationError
 from pydantic import BaseModel
 from enum import Enum
 
+from app.config import get_settings
+from app.utils.bounded_cache import BoundedLRUCache
+
 
 class OSCALDocumentType(str, Enum):
     """OSCAL document types"""
@@ -45,24 +85,351 @@ class ValidationResult(BaseModel):
     is_valid: bool
     document_type: OSCALDocumentType
     oscal_version: str = "1.2.0"
+    schema_validated: bool = False  # OSCAL-CLI or a JSON schema checked the document, not only structure
     messages: List[ValidationMessage] = []
     error_count: int = 0
     warning_count: int = 0
     info_count: int = 0
 
 
+_UUID_RE = regex.compile(
+    r"^[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[45][0-9A-Fa-f]{3}-[89ABab][0-9A-Fa-f]{3}-[0-9A-Fa-f]{12}$"
+)
+# OSCAL date-time-with-timezone (metaschema JSON pattern): valid calendar dates
+# only, including leap days, and the offsets the schema allows
+_DATETIME_TZ_RE = regex.compile(
+    r"^(((2000|2400|2800|(19|2[0-9](0[48]|[2468][048]|[13579][26])))-02-29)"
+    r"|(((19|2[0-9])[0-9]{2})-02-(0[1-9]|1[0-9]|2[0-8]))"
+    r"|(((19|2[0-9])[0-9]{2})-(0[13578]|10|12)-(0[1-9]|[12][0-9]|3[01]))"
+    r"|(((19|2[0-9])[0-9]{2})-(0[469]|11)-(0[1-9]|[12][0-9]|30)))"
+    r"T(2[0-3]|[01][0-9]):([0-5][0-9]):([0-5][0-9])(\.[0-9]+)?"
+    r"(Z|(-((0[0-9]|1[0-2]):00|0[39]:30)|\+((0[0-9]|1[0-4]):00|(0[34569]|10):30|(0[58]|12):45)))$"
+)
+
+
+# Messages produced when the validator itself failed; such results are not cached
+_TRANSIENT_MESSAGE_PREFIXES = (
+    "OSCAL-CLI validation timed out",
+    "OSCAL-CLI validation error:",
+    "JSON schema validation error:",
+)
+
+OSCAL_RELEASE_URL = "https://github.com/usnistgov/OSCAL/releases/download/v1.2.0"
+DEFAULT_SCHEMA_DIR = Path(__file__).parent.parent.parent / "data" / "oscal-schemas"
+
+
+def canonicalize_oscal_document(document: Any) -> Any:
+    """
+    Return a copy of a document with volatile values normalized
+    
+    Every generated document gets fresh uuid4 identifiers and a utcnow
+    timestamp, so two otherwise identical documents never compare equal.
+    Well-formed UUIDs are replaced by sequential placeholders in order of first
+    appearance (keeping cross-references between them intact) and well-formed
+    timezone-qualified timestamps by a fixed token. Only values that already
+    satisfy the OSCAL uuid/date-time patterns are normalized, so a malformed
+    value still changes the hash.
+    """
+    uuid_placeholders: Dict[str, str] = {}
+    
+    def normalize(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {key: normalize(value[key]) for key in sorted(value)}
+        if isinstance(value, list):
+            return [normalize(item) for item in value]
+        if isinstance(value, str):
+            if _UUID_RE.match(value):
+                key = value.lower()
+                if key not in uuid_placeholders:
+                    uuid_placeholders[key] = f"<uuid-{len(uuid_placeholders)}>"
+                return uuid_placeholders[key]
+            if _DATETIME_TZ_RE.match(value):
+                return "<date-time>"
+        return value
+    
+    return normalize(document)
+
+
+def oscal_document_hash(document: Dict[str, Any], document_type: "OSCALDocumentType") -> str:
+    """SHA-256 of the canonicalized document, scoped to its document type"""
+    canonical = json.dumps(
+        canonicalize_oscal_document(document),
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+        default=str
+    )
+    digest = hashlib.sha256(document_type.value.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(canonical.encode('utf-8'))
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def _compile_pattern(pattern: str):
+    """Compile a schema pattern once; OSCAL patterns use \\p{L}-style classes unsupported by re"""
+    return regex.compile(pattern)
+
+
+def _pattern_keyword(validator, pattern, instance, schema):
+    """JSON Schema 'pattern' keyword backed by the regex module"""
+    if not validator.is_type(instance, "string"):
+        return
+    if not _compile_pattern(pattern).search(instance):
+        yield SchemaValidationError(f"{instance!r} does not match {pattern!r}")
+
+
+class OSCALSchemaRegistry:
+    """
+    In-process OSCAL JSON Schema validation engine
+    
+    Each schema is loaded from disk and compiled into a reusable validator
+    object the first time its document type is validated; later documents
+    reuse it. Validation walks the document once and collects every error.
+    """
+    
+    SCHEMA_FILES = {
+        OSCALDocumentType.SSP: "oscal_ssp_schema.json",
+        OSCALDocumentType.POAM: "oscal_poam_schema.json",
+        OSCALDocumentType.ASSESSMENT_RESULTS: "oscal_assessment-results_schema.json",
+        OSCALDocumentType.COMPONENT_DEFINITION: "oscal_component_schema.json",
+    }
+    
+    MAX_ERRORS = 50  # Cap reported errors for badly broken documents
+    
+    def __init__(self, schema_dir: Optional[str] = None):
+        self.schema_dir = Path(schema_dir or DEFAULT_SCHEMA_DIR)
+        self._validators: Dict[OSCALDocumentType, Any] = {}
+        self._lock = threading.Lock()
+    
+    def missing_schemas(self) -> List[str]:
+        """Schema files not present in the schema directory"""
+        return [
+            filename for filename in self.SCHEMA_FILES.values()
+            if not (self.schema_dir / filename).exists()
+        ]
+    
+    def is_available(self, document_type: OSCALDocumentType) -> bool:
+        """Check whether a schema file exists for this document type"""
+        filename = self.SCHEMA_FILES.get(document_type)
+        return filename is not None and (self.schema_dir / filename).exists()
+    
+    def get_validator(self, document_type: OSCALDocumentType):
+        """Get the compiled validator for a document type (None if no schema)"""
+        validator = self._validators.get(document_type)
+        if validator is not None:
+            return validator
+        
+        if not self.is_available(document_type):
+            return None
+        
+        with self._lock:
+            if document_type not in self._validators:
+                schema_path = self.schema_dir / self.SCHEMA_FILES[document_type]
+                with open(schema_path, 'r', encoding='utf-8') as f:
+                    schema = json.load(f)
+                
+                base_cls = jsonschema_validators.validator_for(schema)
+                # Structural metaschema check only: check_schema() would also
+                # compile every pattern with re, which rejects \p{L}
+                base_cls(base_cls.META_SCHEMA).validate(schema)
+                validator_cls = jsonschema_validators.extend(
+                    base_cls,
+                    {"pattern": _pattern_keyword}
+                )
+                self._validators[document_type] = validator_cls(schema)
+        
+        return self._validators[document_type]
+    
+    def validate(
+        self,
+        document: Dict[str, Any],
+        document_type: OSCALDocumentType
+    ) -> Optional[List[ValidationMessage]]:
+        """
+        Validate a document against its OSCAL schema
+        
+        Returns:
+            Error messages (empty if valid), or None if no schema is available
+        """
+        validator = self.get_validator(document_type)
+        if validator is None:
+            return None
+        
+        messages = []
+        for error in validator.iter_errors(document):
+            if len(messages) >= self.MAX_ERRORS:
+                messages.append(ValidationMessage(
+                    severity=ValidationSeverity.ERROR,
+                    message=f"Schema validation stopped after {self.MAX_ERRORS} errors"
+                ))
+                break
+            messages.append(ValidationMessage(
+                severity=ValidationSeverity.ERROR,
+                message=error.message,
+                location=error.json_path
+            ))
+        
+        return messages
+
+
+def fetch_schemas(schema_dir: Optional[str] = None, base_url: str = OSCAL_RELEASE_URL) -> List[Path]:
+    """Download the OSCAL 1.2.0 JSON schemas from the usnistgov/OSCAL release into the schema directory"""
+    schema_dir = Path(schema_dir or DEFAULT_SCHEMA_DIR)
+    schema_dir.mkdir(parents=True, exist_ok=True)
+    fetched = []
+    for filename in OSCALSchemaRegistry.SCHEMA_FILES.values():
+        with urllib.request.urlopen(f"{base_url}/{filename}", timeout=60) as response:
+            schema = json.loads(response.read())
+        path = schema_dir / filename
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(schema), encoding="utf-8")
+        tmp.replace(path)
+        fetched.append(path)
+    return fetched
+
+
+class _ValidatorWorker:
+    """A single long-lived validator process speaking JSON lines over stdio"""
+    
+    def __init__(self, command: List[str]):
+        self.command = command
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._request_id = 0
+    
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+    
+    async def start(self) -> None:
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=16 * 1024 * 1024  # Responses for large documents can be long lines
+        )
+    
+    async def validate(
+        self,
+        document_type: str,
+        document: Dict[str, Any],
+        timeout: float
+    ) -> Dict[str, Any]:
+        if not self.alive:
+            await self.start()
+        
+        self._request_id += 1
+        request = {"id": self._request_id, "type": document_type, "document": document}
+        self.process.stdin.write((json.dumps(request, separators=(',', ':')) + "\n").encode('utf-8'))
+        await self.process.stdin.drain()
+        
+        line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        if not line:
+            raise RuntimeError("OSCAL validator worker exited unexpectedly")
+        
+        response = json.loads(line)
+        if response.get("id") != self._request_id:
+            raise RuntimeError("OSCAL validator worker returned an out-of-order response")
+        return response
+    
+    async def kill(self) -> None:
+        """Terminate and reap the process; a fresh one is started on next use"""
+        process, self.process = self.process, None
+        if process is None:
+            return
+        if process.returncode is None:
+            process.kill()
+        # Shielded so the exit status is collected even if the caller is cancelled again
+        await asyncio.shield(process.wait())
+    
+    async def close(self) -> None:
+        if self.alive:
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), 5)
+            except asyncio.TimeoutError:
+                pass
+        await self.kill()
+
+
+class OSCALValidatorPool:
+    """
+    Pool of warm validator worker processes
+    
+    Workers are started lazily and reused across documents and sessions, so
+    JVM startup is paid once per worker instead of once per document. A worker
+    that times out, crashes, or is interrupted mid-request is killed and
+    replaced on its next use.
+    """
+    
+    def __init__(self, command: str, size: int = 2, timeout: float = 30):
+        argv = shlex.split(command)
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._workers = [_ValidatorWorker(argv) for _ in range(self.size)]
+        self._idle: Optional[asyncio.Queue] = None
+    
+    async def validate(self, document_type: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate a document on the next idle worker"""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for worker in self._workers:
+                self._idle.put_nowait(worker)
+        
+        worker = await self._idle.get()
+        try:
+            return await worker.validate(document_type, document, self.timeout)
+        except BaseException:
+            # Stream state is unknown after a failure or cancellation
+            await worker.kill()
+            raise
+        finally:
+            self._idle.put_nowait(worker)
+    
+    async def close(self) -> None:
+        """Shut down all worker processes"""
+        for worker in self._workers:
+            await worker.close()
+        self._idle = None
+
+
 class OSCALValidatorService:
     """Service for validating OSCAL documents using OSCAL-CLI"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        cli_path: str = "oscal-cli",
+        cli_timeout: float = 30,
+        pool: Optional[OSCALValidatorPool] = None,
+        schema_dir: Optional[str] = None,
+        cache_size: int = 256
+    ):
         """Initialize the OSCAL validator service"""
-        self.oscal_cli_available = self._check_oscal_cli()
+        self.cli_path = cli_path
+        self.cli_timeout = cli_timeout
+        self.pool = pool
+        self.schema_registry = OSCALSchemaRegistry(schema_dir)
+        # Results keyed by canonical document hash, shared by all sessions
+        self.result_cache = BoundedLRUCache(cache_size)
+        self.oscal_cli_available = self.pool is not None or self._check_oscal_cli()
+        missing = self.schema_registry.missing_schemas()
+        if missing:
+            print(
+                f"⚠️  OSCAL JSON schemas missing from {self.schema_registry.schema_dir}: {', '.join(missing)}. "
+                "Downloads will report X-OSCAL-Valid: unknown; run "
+                "`python -m app.services.oscal_validator --fetch-schemas`"
+            )
     
     def _check_oscal_cli(self) -> bool:
         """Check if OSCAL-CLI is available"""
+        # Avoid spawning a JVM at all when the binary is not on PATH
+        if shutil.which(self.cli_path) is None:
+            print("Warning: OSCAL-CLI not found. Validation will use basic JSON schema checks.")
+            return False
         try:
             result = subprocess.run(
-                ['oscal-cli', '--version'],
+                [self.cli_path, '--version'],
                 capture_output=True,
                 text=True,
                 timeout=5
@@ -72,6 +439,11 @@ class OSCALValidatorService:
             print("Warning: OSCAL-CLI not found. Validation will use basic JSON schema checks.")
             return False
     
+    async def close(self) -> None:
+        """Release warm validator processes"""
+        if self.pool is not None:
+            await self.pool.close()
+    
     async def validate_document(
         self,
         document: Dict[str, Any],
@@ -87,6 +459,11 @@ class OSCALValidatorService:
         Returns:
             ValidationResult with validation status and messages
         """
+        cache_key = ("full", oscal_document_hash(document, document_type))
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return cached.model_copy(deep=True)
+        
         validation_result = ValidationResult(
             is_valid=True,
             document_type=document_type
@@ -97,15 +474,67 @@ class OSCALValidatorService:
         validation_result.messages.extend(structure_messages)
         
         # If OSCAL-CLI is available, use it for comprehensive validation
-        if self.oscal_cli_available:
+        if self.pool is not None:
+            pool_messages = await self._validate_with_pool(document, document_type)
+            validation_result.messages.extend(pool_messages)
+            validation_result.schema_validated = not self._is_transient(pool_messages)
+        elif self.oscal_cli_available:
             cli_messages = await self._validate_with_cli(document, document_type)
             validation_result.messages.extend(cli_messages)
+            validation_result.schema_validated = not self._is_transient(cli_messages)
         else:
             # Fallback to basic JSON schema validation
-            schema_messages = self._validate_with_json_schema(document, document_type)
+            schema_messages, validation_result.schema_validated = self._validate_with_json_schema(
+                document, document_type
+            )
             validation_result.messages.extend(schema_messages)
         
-        # Count messages by severity
+        return self._store(cache_key, self._tally(validation_result))
+    
+    def validate_with_schema(
+        self,
+        document: Dict[str, Any],
+        document_type: OSCALDocumentType
+    ) -> ValidationResult:
+        """
+        Validate structure and JSON schema in-process only (no OSCAL-CLI)
+        
+        Cheap enough to run on every OSCAL download.
+        """
+        cache_key = ("schema", oscal_document_hash(document, document_type))
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return cached.model_copy(deep=True)
+        
+        validation_result = ValidationResult(
+            is_valid=True,
+            document_type=document_type
+        )
+        validation_result.messages.extend(self._validate_structure(document, document_type))
+        schema_messages, validation_result.schema_validated = self._validate_with_json_schema(
+            document, document_type
+        )
+        validation_result.messages.extend(schema_messages)
+        return self._store(cache_key, self._tally(validation_result))
+    
+    @staticmethod
+    def _is_transient(messages: List[ValidationMessage]) -> bool:
+        """Whether messages report a validator failure rather than a verdict on the document"""
+        return any(msg.message.startswith(_TRANSIENT_MESSAGE_PREFIXES) for msg in messages)
+    
+    def _store(self, cache_key, validation_result: ValidationResult) -> ValidationResult:
+        """Cache a result unless it reflects a transient validator failure"""
+        if not self._is_transient(validation_result.messages):
+            self.result_cache.put(cache_key, validation_result.model_copy(deep=True))
+        return validation_result
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Validation result cache statistics"""
+        return self.result_cache.stats()
+    
+    @staticmethod
+    def _tally(validation_result: ValidationResult) -> ValidationResult:
+        """Count messages by severity"""
         for msg in validation_result.messages:
             if msg.severity == ValidationSeverity.ERROR:
                 validation_result.error_count += 1
@@ -184,13 +613,63 @@ class OSCALValidatorService:
         
         return messages
     
+    async def _validate_with_pool(
+        self,
+        document: Dict[str, Any],
+        document_type: OSCALDocumentType
+    ) -> List[ValidationMessage]:
+        """Validate document on a warm validator worker"""
+        messages = []
+        
+        try:
+            response = await self.pool.validate(document_type.value, document)
+            if "error" in response:
+                # No verdict: reported as a validator failure, so it is not cached
+                raise RuntimeError(response["error"])
+            
+            for error in response.get("errors", []):
+                messages.append(ValidationMessage(
+                    severity=ValidationSeverity.ERROR,
+                    message=str(error)
+                ))
+            for warning in response.get("warnings", []):
+                messages.append(ValidationMessage(
+                    severity=ValidationSeverity.WARNING,
+                    message=str(warning)
+                ))
+            if response.get("valid") and not messages:
+                messages.append(ValidationMessage(
+                    severity=ValidationSeverity.INFO,
+                    message="OSCAL validator worker: validation passed"
+                ))
+            elif not response.get("valid") and not response.get("errors"):
+                messages.append(ValidationMessage(
+                    severity=ValidationSeverity.ERROR,
+                    message="OSCAL validator worker: validation failed"
+                ))
+            
+        except asyncio.TimeoutError:
+            messages.append(ValidationMessage(
+                severity=ValidationSeverity.ERROR,
+                message="OSCAL-CLI validation timed out"
+            ))
+        except Exception as e:
+            messages.append(ValidationMessage(
+                severity=ValidationSeverity.ERROR,
+                message=f"OSCAL-CLI validation error: {str(e)}"
+            ))
+        
+        return messages
+    
     async def _validate_with_cli(
         self,
         document: Dict[str, Any],
         document_type: OSCALDocumentType
     ) -> List[ValidationMessage]:
-        """Validate document using OSCAL-CLI"""
+        """Validate document using a one-shot OSCAL-CLI process"""
         messages = []
+        temp_path = None
+        process = None
         
         try:
             # Write document to temporary file
@@ -199,21 +678,23 @@ class OSCALValidatorService:
                 suffix='.json',
                 delete=False
             ) as f:
-                json.dump(document, f, indent=2)
+                json.dump(document, f)
                 temp_path = f.name
             
-            # Run OSCAL-CLI validation
-            result = subprocess.run(
-                ['oscal-cli', 'validate', document_type.value, temp_path],
-                capture_output=True,
-                text=True,
-                timeout=30
+            # Run OSCAL-CLI validation without blocking the event loop
+            # Own process group: oscal-cli is a launcher script that starts the JVM
+            process = await asyncio.create_subprocess_exec(
+                self.cli_path, 'validate', document_type.value, temp_path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True
             )
+            _, stderr = await asyncio.wait_for(process.communicate(), self.cli_timeout)
             
             # Parse output
-            if result.returncode != 0:
+            if process.returncode != 0:
                 # Parse error messages from output
-                error_lines = result.stderr.split('\n')
+                error_lines = stderr.decode('utf-8', errors='replace').split('\n')
                 for line in error_lines:
                     if line.strip():
                         messages.append(ValidationMessage(
@@ -226,10 +707,7 @@ class OSCALValidatorService:
                     message="OSCAL-CLI validation passed"
                 ))
             
-            # Clean up temp file
-            Path(temp_path).unlink(missing_ok=True)
-            
-        except subprocess.TimeoutExpired:
+        except asyncio.TimeoutError:
             messages.append(ValidationMessage(
                 severity=ValidationSeverity.ERROR,
                 message="OSCAL-CLI validation timed out"
@@ -239,6 +717,17 @@ class OSCALValidatorService:
                 severity=ValidationSeverity.ERROR,
                 message=f"OSCAL-CLI validation error: {str(e)}"
             ))
+        finally:
+            # Timed out or cancelled mid-run: stop the launcher and the JVM, and reap them
+            if process is not None and process.returncode is None:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await asyncio.shield(process.wait())
+            # Clean up temp file
+            if temp_path:
+                Path(temp_path).unlink(missing_ok=True)
         
         return messages
     
@@ -246,19 +735,37 @@ class OSCALValidatorService:
         self,
         document: Dict[str, Any],
         document_type: OSCALDocumentType
-    ) -> List[ValidationMessage]:
-        """Fallback validation using basic JSON schema checks"""
-        messages = []
+    ) -> tuple[List[ValidationMessage], bool]:
+        """
+        Fallback validation against the local OSCAL JSON schemas
         
-        messages.append(ValidationMessage(
-            severity=ValidationSeverity.INFO,
-            message="Using basic JSON schema validation (OSCAL-CLI not available)"
-        ))
+        Returns:
+            (messages, whether a schema check actually ran)
+        """
+        try:
+            schema_messages = self.schema_registry.validate(document, document_type)
+        except Exception as e:
+            return [ValidationMessage(
+                severity=ValidationSeverity.ERROR,
+                message=f"JSON schema validation error: {str(e)}"
+            )], False
         
-        # Additional basic checks can be added here
-        # For now, structure validation is sufficient
+        if schema_messages is None:
+            return [ValidationMessage(
+                severity=ValidationSeverity.WARNING,
+                message=(
+                    f"No OSCAL JSON schema available for {document_type.value} in "
+                    f"{self.schema_registry.schema_dir}; document was not schema-validated"
+                )
+            )], False
         
-        return messages
+        if not schema_messages:
+            return [ValidationMessage(
+                severity=ValidationSeverity.INFO,
+                message="OSCAL 1.2.0 JSON schema validation passed"
+            )], True
+        
+        return schema_messages, True
     
     def _get_root_key(self, document_type: OSCALDocumentType) -> str:
         """Get the root key for a document type"""
@@ -302,6 +809,78 @@ class OSCALValidatorService:
         )
 
 
+@lru_cache()
 def get_oscal_validator_service() -> OSCALValidatorService:
-    """Get OSCAL validator service instance"""
-    return OSCALValidatorService()
+    """Get cached OSCAL validator service instance"""
+    settings = get_settings()
+    
+    pool = None
+    if settings.oscal_validator_worker_command and settings.oscal_validator_pool_size > 0:
+        pool = OSCALValidatorPool(
+            settings.oscal_validator_worker_command,
+            size=settings.oscal_validator_pool_size,
+            timeout=settings.oscal_cli_timeout_seconds
+        )
+    
+    return OSCALValidatorService(
+        cli_path=settings.oscal_cli_path,
+        cli_timeout=settings.oscal_cli_timeout_seconds,
+        pool=pool,
+        schema_dir=settings.oscal_schema_dir or None,
+        cache_size=settings.oscal_validation_cache_size
+    )
+
+
+def serve_worker(schema_dir: Optional[str] = None, stdin=None, stdout=None) -> None:
+    """
+    Validator worker loop for OSCALValidatorPool (JSON lines over stdio)
+    
+    Reads one request per line until stdin closes and answers each with the
+    JSON schema errors of its document. A document type without a schema is
+    answered with an error, never as valid.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    registry = OSCALSchemaRegistry(schema_dir)
+    
+    for line in stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        try:
+            messages = registry.validate(request["document"], OSCALDocumentType(request["type"]))
+        except Exception as e:
+            response = {"id": request.get("id"), "error": f"{type(e).__name__}: {e}"}
+        else:
+            if messages is None:
+                response = {"id": request["id"], "error": f"No OSCAL JSON schema for {request['type']} in {registry.schema_dir}"}
+            else:
+                response = {
+                    "id": request["id"],
+                    "valid": not messages,
+                    "errors": [f"{m.location}: {m.message}" if m.location else m.message for m in messages],
+                    "warnings": []
+                }
+        stdout.write(json.dumps(response, separators=(',', ':')) + "\n")
+        stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OSCAL validation utilities")
+    parser.add_argument("--fetch-schemas", action="store_true", help="Download the OSCAL 1.2.0 JSON schemas")
+    parser.add_argument("--worker", action="store_true", help="Serve validation requests on stdio (OSCAL_VALIDATOR_WORKER_COMMAND)")
+    parser.add_argument("--schema-dir", help="Schema directory (default: backend/data/oscal-schemas)")
+    args = parser.parse_args()
+    
+    if args.worker:
+        serve_worker(args.schema_dir)
+        return
+    if not args.fetch_schemas:
+        parser.print_help()
+        return
+    for path in fetch_schemas(args.schema_dir):
+        print(f"Fetched {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Assessment Pipeline Registry
+
+Tracks every running assessment pipeline with a cancellation handle so that
+deleting a session stops the background work (Gemini calls, document
+extraction) instead of leaving an orphaned task spending tokens.
+"""
+
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Optional
+
+
+class PipelineCancelled(Exception):
+    """Raised inside worker threads when their pipeline has been cancelled"""
+
+
+@dataclass
+class PipelineHandle:
+    """Cancellation handle for a single running assessment pipeline"""
+    session_id: str
+    task: asyncio.Task
+    # Shared with worker threads (document extraction) which cannot be
+    # interrupted by asyncio cancellation and must poll instead
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def check(self) -> None:
+        """Raise PipelineCancelled if cancellation was requested (thread-safe)"""
+        if self.cancel_event.is_set():
+            raise PipelineCancelled(f"Pipeline {self.session_id} was cancelled")
+
+    def cancel(self) -> bool:
+        """
+        Request cancellation of the pipeline
+
+        Signals worker threads and cancels the asyncio task, which raises
+        CancelledError at the pipeline's current await point (pending batch
+        calls included).
+
+        Returns:
+            True if the pipeline was still running
+        """
+        self.cancel_event.set()
+        if self.task.done():
+            return False
+        self.task.cancel()
+        return True
+
+
+class PipelineRegistry:
+    """Registry of in-flight assessment pipelines keyed by session ID"""
+
+    def __init__(self):
+        self._handles: Dict[str, PipelineHandle] = {}
+
+    def register(self, session_id: str, task: asyncio.Task) -> PipelineHandle:
+        """Track a pipeline task; it is dropped from the registry once it finishes"""
+        handle = PipelineHandle(session_id=session_id, task=task)
+        self._handles[session_id] = handle
+        task.add_done_callback(lambda _task: self._discard(session_id, handle))
+        return handle
+
+    def _discard(self, session_id: str, handle: PipelineHandle) -> None:
+        # Only remove the entry if it still belongs to this task
+        if self._handles.get(session_id) is handle:
+            del self._handles[session_id]
+
+    def get(self, session_id: str) -> Optional[PipelineHandle]:
+        """Get the handle for a running pipeline"""
+        return self._handles.get(session_id)
+
+    def cancel(self, session_id: str) -> bool:
+        """
+        Cancel a running pipeline
+
+        Returns:
+            True if a running pipeline was found and cancelled
+        """
+        handle = self._handles.pop(session_id, None)
+        if handle is None:
+            return False
+        return handle.cancel()
+
+    def is_running(self, session_id: str) -> bool:
+        handle = self._handles.get(session_id)
+        return handle is not None and not handle.task.done()
+
+    def active_count(self) -> int:
+        """Number of pipelines currently running"""
+        return sum(1 for handle in self._handles.values() if not handle.task.done())
+
+
+@lru_cache()
+def get_pipeline_registry() -> PipelineRegistry:
+    """Get cached pipeline registry instance"""
+    return PipelineRegistry()
@@ -0,0 +1,275 @@
+"""
+Prompt Prefix Cache
+
+Batch validation and deep-reasoning prompts repeat large blocks that do not
+change between calls: the shared response instructions, a control family's
+statements and guidance prose, and one session's evidence digest. With
+Gemini context caching such a prefix is uploaded once per model and later
+calls send only the part that differs, referencing the cached prefix by name.
+
+Prefixes are keyed by a hash of the model name and their content, so a
+family guidance block uploaded for one session is reused by every later
+session until it expires. Cached content is billed for as long as it is
+stored, so entries evicted from the bounded cache, a session's own prefixes
+once the session is done with them (release), and everything left at
+shutdown (close) are deleted remotely rather than left to their TTL.
+Backends:
+
+- GeminiContextCacheBackend: google.generativeai CachedContent (billed input
+  drops to the per-call suffix; cached tokens are charged at the cache rate)
+- LocalPromptCacheBackend: keeps prefixes in memory and prepends them to each
+  call, for development and tests that verify reuse without the API
+"""
+
+import asyncio
+import datetime
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.services.token_estimator import estimate_tokens
+from app.utils import run_metrics
+from app.utils.bounded_cache import BoundedLRUCache
+
+
+PROMPT_CACHE_MODES = ("off", "gemini", "local")
+
+# Stop referencing a cached prefix this long before its TTL ends
+EXPIRY_MARGIN_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """A stable prompt prefix: system instructions plus a reusable context block"""
+    kind: str  # family-guidance, evidence-digest
+    name: str  # family code or session evidence fingerprint (for logs and display names)
+    instructions: str
+    text: str
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.instructions) + estimate_tokens(self.text)
+
+    def key(self, model_name: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model_name, self.kind, self.instructions, self.text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def inline(self, suffix: str) -> str:
+        """The full prompt when the prefix is not cached"""
+        return f"{self.instructions}\n\n{self.text}\n\n{suffix}"
+
+
+class GeminiContextCacheBackend:
+    """Gemini context caching (google.generativeai.caching.CachedContent)"""
+
+    def __init__(self, generation_config: Optional[Dict[str, Any]] = None):
+        self.generation_config = generation_config
+
+    def create(self, model_name: str, prefix: PromptPrefix, ttl_seconds: int) -> str:
+        """Upload a prefix (blocking) and return the cache name"""
+        from google.generativeai import caching
+
+        cached = caching.CachedContent.create(
+            model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+            display_name=f"dave-{prefix.kind}-{prefix.name}"[:128],
+            system_instruction=prefix.instructions,
+            contents=[prefix.text],
+            ttl=datetime.timedelta(seconds=ttl_seconds)
+        )
+        return cached.name
+
+    def delete(self, handle: str) -> None:
+        """Delete uploaded cached content (blocking)"""
+        from google.generativeai import caching
+
+        caching.CachedContent.get(handle).delete()
+
+    def model_for(self, handle: str):
+        import google.generativeai as genai
+
+        return genai.GenerativeModel.from_cached_content(
+            cached_content=handle,
+            generation_config=self.generation_config
+        )
+
+
+class _LocalCachedModel:
+    """Stands in for a model bound to cached content: prepends the stored prefix"""
+
+    def __init__(self, backend: "LocalPromptCacheBackend", handle: str):
+        self.backend = backend
+        self.handle = handle
+
+    async def generate_content_async(self, contents):
+        prefix = self.backend.prefixes[self.handle]
+        self.backend.references[self.handle] = self.backend.references.get(self.handle, 0) + 1
+        model = self.backend.models.get(self.backend.model_names.get(self.handle), self.backend.model)
+        return await model.generate_content_async(prefix.inline(contents))
+
+
+class LocalPromptCacheBackend:
+    """In-memory stand-in for context caching (no billing effect)"""
+
+    def __init__(self, model, models: Optional[Dict[str, Any]] = None):
+        self.model = model
+        self.models = models or {}  # Model name -> client (default: model)
+        self.model_names: Dict[str, str] = {}
+        self.prefixes: Dict[str, PromptPrefix] = {}
+        self.uploads: Dict[str, int] = {}
+        self.references: Dict[str, int] = {}
+        self.deleted: List[str] = []
+
+    def create(self, model_name: str, prefix: PromptPrefix, ttl_seconds: int) -> str:
+        handle = f"cachedContents/local-{prefix.key(model_name)[:16]}"
+        self.prefixes[handle] = prefix
+        self.model_names[handle] = model_name
+        self.uploads[handle] = self.uploads.get(handle, 0) + 1
+        return handle
+
+    def delete(self, handle: str) -> None:
+        self.prefixes.pop(handle, None)
+        self.deleted.append(handle)
+
+    def model_for(self, handle: str):
+        return _LocalCachedModel(self, handle)
+
+
+class PromptCacheService:
+    """Uploads prompt prefixes once per model and hands out models bound to them"""
+
+    def __init__(
+        self,
+        backend,
+        model_name: str,
+        ttl_seconds: int = 3600,
+        min_tokens: int = 4096,
+        max_entries: int = 64
+    ):
+        self.backend = backend
+        self.model_name = model_name
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        # key -> (handle, bound model, expires at)
+        self._entries = BoundedLRUCache(max_entries)
+        self._locks: Dict[str, asyncio.Lock] = {}  # Only while an upload is pending
+        self._model_names = {model_name}  # Models prefixes were uploaded for
+        self.uploads = 0
+        self.uploaded_tokens = 0
+        self.reuses = 0
+        self.reused_tokens = 0
+        self.failures = 0
+        self.deletions = 0
+
+    def is_cacheable(self, prefix: PromptPrefix) -> bool:
+        """Prefixes below the provider's minimum cache size are sent inline"""
+        return prefix.tokens >= self.min_tokens
+
+    def _live_entry(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] - time.monotonic() > EXPIRY_MARGIN_SECONDS:
+            return entry
+        return None
+
+    async def model_for(self, prefix: PromptPrefix, model_name: Optional[str] = None):
+        """
+        Model bound to the cached prefix (uploading it on first use); None if not cacheable
+
+        Cached content belongs to one model, so each model a prefix is sent
+        to (default: model_name) holds its own copy.
+        """
+        if not self.is_cacheable(prefix):
+            return None
+
+        model_name = model_name or self.model_name
+        key = prefix.key(model_name)
+        entry = self._live_entry(key)
+        if entry is None:
+            # One upload per prefix even when several calls need it at once
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            try:
+                async with lock:
+                    entry = self._live_entry(key)
+                    if entry is None:
+                        handle = await asyncio.to_thread(self.backend.create, model_name, prefix, self.ttl_seconds)
+                        entry = (handle, self.backend.model_for(handle), time.monotonic() + self.ttl_seconds)
+                        self._model_names.add(model_name)
+                        evicted = self._entries.put(key, entry)
+                        self.uploads += 1
+                        self.uploaded_tokens += prefix.tokens
+                        run_metrics.add("prompt_cache.uploads")
+                        print(f"📦 PROMPT CACHE: uploaded {prefix.kind} {prefix.name} for {model_name} (~{prefix.tokens} tokens)")
+                        await self._delete(handle for handle, _, _ in evicted)
+                        return entry[1]
+            finally:
+                # Callers arriving later find the live entry and need no lock
+                if not lock.locked() and self._locks.get(key) is lock:
+                    del self._locks[key]
+
+        self.reuses += 1
+        self.reused_tokens += prefix.tokens
+        run_metrics.add("prompt_cache.reuses")
+        run_metrics.add("prompt_cache.reused_tokens", prefix.tokens)
+        return entry[1]
+
+    def invalidate(self, prefix: PromptPrefix, model_name: Optional[str] = None) -> None:
+        """Forget a prefix whose cached content was rejected (expired or deleted remotely)"""
+        self.failures += 1
+        self._entries.pop(prefix.key(model_name or self.model_name))
+
+    async def release(self, prefix: PromptPrefix) -> None:
+        """Delete every model's copy of a prefix no longer needed (e.g. a finished session's evidence digest)"""
+        entries = [self._entries.pop(prefix.key(model_name)) for model_name in list(self._model_names)]
+        await self._delete(entry[0] for entry in entries if entry is not None)
+
+    async def close(self) -> None:
+        """Delete all cached content still held (shutdown)"""
+        entries = self._entries.values()
+        self._entries.clear()
+        await self._delete(handle for handle, _, _ in entries)
+
+    async def _delete(self, handles: Iterable[str]) -> None:
+        for handle in handles:
+            try:
+                await asyncio.to_thread(self.backend.delete, handle)
+                self.deletions += 1
+            except Exception as e:  # Already expired or deleted; the TTL removes it otherwise
+                print(f"⚠️  PROMPT CACHE: could not delete {handle} ({e})")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "uploads": self.uploads,
+            "uploaded_tokens": self.uploaded_tokens,
+            "reuses": self.reuses,
+            "reused_tokens": self.reused_tokens,
+            "failures": self.failures,
+            "deletions": self.deletions
+        }
+
+
+def create_prompt_cache(
+    settings,
+    model,
+    generation_config: Optional[Dict[str, Any]] = None,
+    models: Optional[Dict[str, Any]] = None
+) -> Optional[PromptCacheService]:
+    """Prompt cache for the configured prompt_cache_mode (None when off)"""
+    mode = settings.prompt_cache_mode
+    if mode == "gemini":
+        backend = GeminiContextCacheBackend(generation_config)
+    elif mode == "local":
+        backend = LocalPromptCacheBackend(model, models)
+    else:
+        return None
+
+    return PromptCacheService(
+        backend,
+        model_name=settings.gemini_model,
+        ttl_seconds=settings.prompt_cache_ttl_seconds,
+        min_tokens=settings.prompt_cache_min_tokens,
+        max_entries=settings.prompt_cache_max_entries
+    )
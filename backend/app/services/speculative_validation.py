@@ -0,0 +1,129 @@
+"""
+Speculative Batch Validation
+
+Controls that evidence cites explicitly (EvidenceArtifact.controls_mentioned)
+are known as soon as Agent 1 finishes, while batch validation would otherwise
+wait for control mapping, OSCAL generation and prioritization. Batch
+validation depends only on the control IDs and the evidence, so the cited,
+in-scope controls can be validated while Agent 2 runs. Once the final set of
+batch-validated controls is known, speculative results for those controls are
+reused, the remaining controls are validated as usual, and results for
+controls that were not mapped or not routed to batch validation are discarded.
+
+Deep mode validates every control individually against its mapping, so only
+quick and smart modes speculate.
+
+A long document's mention index can cite hundreds of controls, most of which
+are never mapped. The speculative set is capped (speculative_validation_max_controls),
+keeping the controls cited most often (by more artifacts, or in more sections
+of a summarized document), which are the likeliest to be mapped.
+"""
+
+import asyncio
+from typing import Dict, Iterable, List, Optional
+
+from app.models import EvidenceArtifact, NISTValidationResult
+
+
+def cited_controls(
+    evidence_artifacts: List[EvidenceArtifact],
+    catalog,
+    control_filter: Optional[Iterable[str]] = None,
+    limit: Optional[int] = None
+) -> List[str]:
+    """
+    Catalog controls cited in evidence, limited to the scope
+
+    Returns every cited control in order of first mention, or with a limit
+    the limit most cited ones (ties in order of first mention).
+    """
+    in_scope = {cid.upper() for cid in control_filter} if control_filter else None
+    citations: Dict[str, int] = {}
+    rejected = set()
+    for artifact in evidence_artifacts:
+        sections = {
+            cid.upper(): len(found) for cid, found in (artifact.metadata.get("control_mention_index") or {}).items()
+        }
+        for control_id in artifact.controls_mentioned:
+            control_id = control_id.upper()
+            if control_id in rejected:
+                continue
+            if control_id not in citations:
+                if (in_scope is not None and control_id not in in_scope) or not catalog.has_control(control_id):
+                    rejected.add(control_id)
+                    continue
+                citations[control_id] = 0
+            citations[control_id] += max(sections.get(control_id, 1), 1)
+    cited = list(citations)
+    if limit is not None and len(cited) > limit:
+        cited = sorted(cited, key=lambda cid: -citations[cid])[:limit]
+    return cited
+
+
+class SpeculativeValidation:
+    """Batch validation of evidence-cited controls started before control mapping finishes"""
+
+    def __init__(self, service, control_ids: List[str], evidence_artifacts: List[EvidenceArtifact]):
+        self.service = service
+        self.control_ids = control_ids
+        self.evidence_artifacts = evidence_artifacts
+        self.task: Optional[asyncio.Future] = None
+        self.batch_calls = 0
+        self.reused = 0
+        self._results: Optional[Dict[str, NISTValidationResult]] = None
+        self._used = set()
+
+    def start(self) -> "SpeculativeValidation":
+        if self.control_ids:
+            self.task = asyncio.ensure_future(
+                self.service.validate_controls_by_family(
+                    self.control_ids, self.evidence_artifacts, on_call=self._count_call
+                )
+            )
+        return self
+
+    def _count_call(self) -> None:
+        # Counted as each call is made: a cancelled run has no result to read the count from
+        self.batch_calls += 1
+
+    async def results(self) -> Dict[str, NISTValidationResult]:
+        """Speculative results by control ID (waits for the speculative run)"""
+        if self._results is None:
+            results = []
+            if self.task is not None:
+                try:
+                    results, _ = await self.task
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"⚠️  Speculative validation failed ({e}); validating after mapping instead")
+            self._results = {result.control_id: result for result in results}
+        return self._results
+
+    async def validate(self, control_ids: List[str]) -> tuple[List[NISTValidationResult], int]:
+        """
+        Batch-validate controls, reusing speculative results where there are any
+
+        Returns:
+            (results in control_ids order, batch calls made for the remainder)
+        """
+        # Wait for the speculative run only if it covers any of these controls
+        cited = set(self.control_ids)
+        speculated = await self.results() if any(cid in cited for cid in control_ids) else {}
+        reuse = [cid for cid in control_ids if cid in speculated]
+        remaining = [cid for cid in control_ids if cid not in speculated]
+        fresh, batch_calls = await self.service.validate_controls_by_family(remaining, self.evidence_artifacts)
+
+        self._used.update(reuse)
+        self.reused += len(reuse)
+        by_id = {result.control_id: result for result in fresh}
+        by_id.update((cid, speculated[cid]) for cid in reuse)
+        return [by_id[cid] for cid in control_ids if cid in by_id], batch_calls
+
+    def discard(self) -> int:
+        """Stop a speculative run still in flight; returns the number of results never used"""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        if self._results is None:
+            return len(self.control_ids)
+        return len(set(self._results) - self._used)
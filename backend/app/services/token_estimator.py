@@ -0,0 +1,254 @@
+"""
+Token Estimation Service
+
+Cheap local estimate of how many tokens a prompt will use, so requests can be
+packed up to Settings.max_tokens_per_request and prompt detail can be scaled
+to a run's token budget before anything is sent. Images are estimated from
+their dimensions.
+
+Text is counted the way a subword tokenizer splits it (words, long words in
+several pieces, digits, symbols, line breaks) and scaled by a factor fitted
+to the prompt token counts the API reports for calls actually made
+(usage_metadata), so no count-tokens request is needed per prompt. Only
+these counts, never prompt text, are recorded for calibration. Samples are
+buffered in memory and written to the calibration file in batches off the
+event loop (and at shutdown), not once per model call.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.utils.cache_paths import cache_path
+
+
+# English prose and NIST control text average about four characters per token
+CHARS_PER_TOKEN = 4.0
+
+# Words up to this length are usually one token; longer ones split into pieces
+WORD_PIECE_CHARS = 10
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+_DIGIT_RE = re.compile(r"\d")
+_SYMBOL_RE = re.compile(r"[^\w\s]|_")
+
+# Calibration samples kept (in memory and on disk) and needed before scaling
+CALIBRATION_WINDOW = 500
+CALIBRATION_MIN_SAMPLES = 5
+
+# Buffered samples that make a write to the calibration file due
+CALIBRATION_FLUSH_SAMPLES = 50
+
+# Gemini bills an image whose sides are both <= 384px as one tile; larger
+# images are cropped and scaled into 768x768 tiles of the same cost each
+IMAGE_TOKENS_PER_TILE = 258
+IMAGE_SMALL_SIDE = 384
+IMAGE_TILE_SIDE = 768
+
+
+def token_features(text: str) -> Dict[str, int]:
+    """Counts the estimate is built from (also what calibration records)"""
+    words = _WORD_RE.findall(text)
+    return {
+        "chars": len(text),
+        "words": len(words),
+        "word_pieces": sum(len(word) // WORD_PIECE_CHARS for word in words),
+        "digits": len(_DIGIT_RE.findall(text)),
+        "symbols": len(_SYMBOL_RE.findall(text)),
+        "newlines": text.count("\n")
+    }
+
+
+def raw_token_count(features: Dict[str, int]) -> int:
+    """Uncalibrated token count from text features"""
+    return (
+        features["words"] + features["word_pieces"] + features["digits"]
+        + features["symbols"] + features["newlines"]
+    )
+
+
+class TokenEstimator:
+    """
+    Local token counter calibrated against actual prompt token counts
+    
+    The scale is the ratio of actual to raw counts summed over the most recent
+    samples, which weights long prompts (the ones that matter for packing and
+    budgets) most. Samples are appended to `calibration_file` when one is
+    given, so a new process starts calibrated; observe() only buffers them,
+    and flush() writes the buffer.
+    """
+
+    def __init__(
+        self,
+        calibration_file: Optional[str] = None,
+        window: int = CALIBRATION_WINDOW,
+        min_samples: int = CALIBRATION_MIN_SAMPLES,
+        flush_samples: int = CALIBRATION_FLUSH_SAMPLES
+    ):
+        self.min_samples = min_samples
+        self.flush_samples = flush_samples
+        self._samples: deque = deque(maxlen=window)  # (raw, actual)
+        self._pending: List[Dict[str, int]] = []  # Samples not yet written to the file
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._file_lines = 0
+        self.scale = 1.0
+        self.calibration_file: Optional[Path] = None
+        if calibration_file:
+            self.use_calibration_file(calibration_file)
+
+    def use_calibration_file(self, calibration_file: str) -> None:
+        """Load recorded samples from a file and append new ones to it"""
+        with self._file_lock, self._lock:
+            self.calibration_file = Path(calibration_file)
+            self._load()
+
+    @property
+    def calibrated(self) -> bool:
+        return len(self._samples) >= self.min_samples
+
+    @property
+    def flush_due(self) -> bool:
+        return len(self._pending) >= self.flush_samples
+
+    def estimate(self, text: str) -> int:
+        """Calibrated count, or the characters-per-token rule until enough samples are recorded"""
+        if not text:
+            return 0
+        if not self.calibrated:
+            return math.ceil(len(text) / CHARS_PER_TOKEN)
+        return math.ceil(raw_token_count(token_features(text)) * self.scale)
+
+    def estimate_counted(self, chars: int, raw_tokens: int) -> int:
+        """estimate() of a text whose length and raw_token_count were recorded earlier"""
+        if chars <= 0:
+            return 0
+        if not self.calibrated:
+            return math.ceil(chars / CHARS_PER_TOKEN)
+        return math.ceil(raw_tokens * self.scale)
+
+    def observe(self, text: str, actual_tokens: int) -> None:
+        """Record the actual prompt token count of a text prompt that was sent"""
+        features = token_features(text)
+        raw = raw_token_count(features)
+        if raw <= 0 or actual_tokens <= 0:
+            return
+        with self._lock:
+            self._add(raw, actual_tokens)
+            if self.calibration_file is not None:
+                self._pending.append({**features, "actual": actual_tokens})
+
+    def flush(self) -> None:
+        """Write buffered samples to the calibration file (blocking; run it off the event loop)"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            with self._file_lock:
+                self._append(pending)
+
+    def _add(self, raw: int, actual: int) -> None:
+        self._samples.append((raw, actual))
+        if self.calibrated:
+            self.scale = sum(a for _, a in self._samples) / sum(r for r, _ in self._samples)
+
+    def _load(self) -> None:
+        try:
+            with open(self.calibration_file, encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        self._file_lines = len(lines)
+        for line in lines[-self._samples.maxlen:]:
+            try:
+                sample = json.loads(line)
+                self._add(raw_token_count(sample), int(sample["actual"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    def _append(self, samples: List[Dict[str, int]]) -> None:
+        """Append samples; the file is trimmed to the window once it grows to 4x (file lock held)"""
+        try:
+            self.calibration_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.calibration_file, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(sample, separators=(",", ":")) + "\n" for sample in samples)
+            self._file_lines += len(samples)
+            if self._file_lines > 4 * self._samples.maxlen:
+                with open(self.calibration_file, encoding="utf-8") as f:
+                    keep = f.readlines()[-self._samples.maxlen:]
+                tmp = self.calibration_file.with_suffix(".tmp")
+                tmp.write_text("".join(keep), encoding="utf-8")
+                os.replace(tmp, self.calibration_file)
+                self._file_lines = len(keep)
+        except OSError as e:
+            print(f"⚠️  Token calibration write failed: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        """Calibration state and mean absolute error over the current samples"""
+        with self._lock:
+            samples = list(self._samples)
+        error = (
+            sum(abs(raw * self.scale - actual) / actual for raw, actual in samples) / len(samples)
+            if samples else 0.0
+        )
+        return {
+            "samples": len(samples),
+            "calibrated": len(samples) >= self.min_samples,
+            "scale": round(self.scale, 4),
+            "mean_abs_error_percent": round(error * 100, 2)
+        }
+
+
+DEFAULT_CALIBRATION_FILE = cache_path("token-calibration.jsonl")
+
+_estimator = TokenEstimator()
+
+
+def get_token_estimator() -> TokenEstimator:
+    """Process-wide token estimator (GeminiService attaches the calibration file)"""
+    return _estimator
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a piece of text"""
+    if not text:
+        return 0
+    return get_token_estimator().estimate(text)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimate the input tokens of an image of the given size"""
+    if width <= IMAGE_SMALL_SIDE and height <= IMAGE_SMALL_SIDE:
+        return IMAGE_TOKENS_PER_TILE
+    tiles = math.ceil(width / IMAGE_TILE_SIDE) * math.ceil(height / IMAGE_TILE_SIDE)
+    return tiles * IMAGE_TOKENS_PER_TILE
+
+
+@dataclass
+class PromptBudget:
+    """
+    Prompt token budget shared by the per-control calls of one run
+    
+    Controls are charged as they are sent; the allowance for the next control
+    keeps enough in reserve for every control still waiting to be sent at
+    the cheapest prompt size.
+    """
+    total: int
+    per_request: int
+    used: int = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.total - self.used)
+
+    def allowance(self, controls_after: int, reserve_per_control: int) -> int:
+        """Largest prompt the next control may use"""
+        return min(self.per_request, self.remaining - controls_after * reserve_per_control)
+
+    def charge(self, tokens: int) -> None:
+        self.used += tokens
@@ -0,0 +1,94 @@
+"""
+Bounded LRU cache with hit/miss/eviction statistics
+
+Used for caches that are shared across sessions and must not grow without
+limit (validation results, control requirements). A cache given a
+metrics_name also counts its hits, misses and evictions into the current
+run's metrics sink (see run_metrics).
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from app.utils import run_metrics
+
+
+class BoundedLRUCache:
+    """Thread-safe LRU cache with a fixed maximum number of entries"""
+
+    def __init__(self, maxsize: int = 1000, metrics_name: Optional[str] = None):
+        self.maxsize = max(1, maxsize)
+        self.metrics_name = metrics_name
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Return the cached value (marking it most recently used) or default"""
+        with self._lock:
+            hit = key in self._data
+            if hit:
+                self._data.move_to_end(key)
+                self.hits += 1
+                value = self._data[key]
+            else:
+                self.misses += 1
+                value = default
+        self._record("hits" if hit else "misses")
+        return value
+
+    def put(self, key: Hashable, value: Any) -> List[Any]:
+        """Insert or replace a value, evicting least recently used entries if full (returns their values)"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+            self._data[key] = value
+            evicted = []
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[1])
+            self.evictions += len(evicted)
+        if evicted:
+            self._record("evictions", len(evicted))
+        return evicted
+
+    def _record(self, counter: str, amount: int = 1) -> None:
+        if self.metrics_name is not None:
+            run_metrics.add(f"{self.metrics_name}.{counter}", amount)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def values(self) -> List[Any]:
+        with self._lock:
+            return list(self._data.values())
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of cache statistics"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hit_rate, 4)
+        }
@@ -0,0 +1,23 @@
+"""
+Runtime cache locations
+
+Files the service writes while running (extraction cache, token calibration
+samples, compiled catalog snapshot) default to the user cache directory
+($XDG_CACHE_HOME/dave, else ~/.cache/dave) rather than the source tree, so
+they are never committed or shipped with the code. Each has a setting to
+place it elsewhere.
+"""
+
+import os
+from pathlib import Path
+
+
+def cache_dir() -> Path:
+    """Base directory for runtime caches"""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "dave"
+
+
+def cache_path(name: str) -> str:
+    """Default location of one runtime cache file or directory"""
+    return str(cache_dir() / name)
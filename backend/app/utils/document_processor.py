@@ -2,66 +2,195 @@ import io
 import PyPDF2
 import pdfplumber
 from docx import Document
-from PIL import Image
+from PIL import Image, ImageOps
 import yaml
 import json
+import re
+import threading
+import time
 from typing import Dict, Any, Optional
 from pathlib import Path
 
 from app.models import EvidenceType
+from app.services.pipeline_registry import PipelineCancelled
+from app.services.token_estimator import estimate_image_tokens
+from app.utils.extraction_cache import ExtractionCache, extraction_key
+
+
+# Bump whenever extraction output changes so cached results are not reused
+PROCESSOR_VERSION = "3"
+
+PDF_TABLE_MODES = ("auto", "all", "off")
+# Content stream operators that draw line segments and rectangles (table rulings)
+_RULING_OPERATOR_RE = re.compile(rb"[\d.]\s+(?:re|l)(?=\s|$)")
+FORM_XOBJECT_DEPTH = 3  # Nested form XObjects scanned for rulings
+
+# Extraction results worth caching (parsing dominates; images and configs are cheap)
+CACHED_EVIDENCE_TYPES = (EvidenceType.PDF_DOCUMENT, EvidenceType.WORD_DOCUMENT)
+
+
+# Image preprocessing defaults (overridden from Settings by the pipeline)
+DEFAULT_IMAGE_MAX_DIMENSION = 1536  # Longest side sent to the model, in pixels
+DEFAULT_IMAGE_JPEG_QUALITY = 85
+
+# Formats the model accepts as-is, and their MIME types
+UPLOAD_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def _check_cancelled(cancel_event: Optional[threading.Event]) -> None:
+    """Abort extraction between pages once the owning pipeline is cancelled"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise PipelineCancelled("Document extraction cancelled")
 
 
 class DocumentProcessor:
     """Process various document types and extract content"""
     
     @staticmethod
-    def process_pdf(file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Extract text and metadata from PDF files"""
+    def draws_ruling(reader_page) -> bool:
+        """
+        Cheap check of a PyPDF2 page's raw content streams (its own and its
+        form XObjects') for line segments or rectangles, without any layout
+        analysis. pdfplumber finds tables from ruling lines, so a page that
+        draws none has no table to extract. Unreadable pages count as ruled.
+        """
+        try:
+            contents = reader_page.get_contents()
+            streams = [contents.get_data()] if contents is not None else []
+            pending = [(reader_page.get("/Resources"), 0)]
+            while pending:
+                resources, depth = pending.pop()
+                resources = resources.get_object() if resources is not None else None
+                xobjects = resources.get("/XObject") if resources else None
+                if not xobjects or depth >= FORM_XOBJECT_DEPTH:
+                    continue
+                for xobject in xobjects.get_object().values():
+                    xobject = xobject.get_object()
+                    if xobject.get("/Subtype") == "/Form":
+                        streams.append(xobject.get_data())
+                        pending.append((xobject.get("/Resources"), depth + 1))
+            return any(_RULING_OPERATOR_RE.search(data) for data in streams)
+        except Exception:
+            return True
+    
+    @staticmethod
+    def has_ruled_cells(plumber_page) -> bool:
+        """Whether a pdfplumber page has the two horizontal and two vertical edges a table cell needs"""
+        horizontal = vertical = 0
+        for edge in plumber_page.edges:
+            if edge["orientation"] == "h":
+                horizontal += 1
+            else:
+                vertical += 1
+            if horizontal >= 2 and vertical >= 2:
+                return True
+        return False
+    
+    @staticmethod
+    def process_pdf(
+        file_content: bytes,
+        filename: str,
+        cancel_event: Optional[threading.Event] = None,
+        table_mode: str = "auto"
+    ) -> Dict[str, Any]:
+        """
+        Extract text, tables and metadata from PDF files
+        
+        Text comes from PyPDF2 (fast); pdfplumber is opened only for pages
+        PyPDF2 cannot read and for table extraction, which runs on every page
+        (table_mode "all"), on pages that draw ruling lines forming at least
+        one cell ("auto") or not at all ("off"). Per-page timings are recorded
+        in the metadata; table_pages_checked counts pages pdfplumber examined
+        for tables.
+        """
+        text_parts = []
+        tables = []
+        page_timings = []
+        text_sources = {"pypdf2": 0, "pdfplumber": 0}
+        table_pages_checked = 0
+        plumber = None
+        
+        def open_plumber():
+            nonlocal plumber
+            if plumber is None:
+                plumber = pdfplumber.open(io.BytesIO(file_content))
+            return plumber
+        
         try:
-            # Try pdfplumber first (better for complex PDFs)
-            with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-                text = ""
-                tables = []
+            try:
+                reader_pages = PyPDF2.PdfReader(io.BytesIO(file_content)).pages
+                num_pages = len(reader_pages)
+            except Exception:
+                reader_pages = None
+                num_pages = len(open_plumber().pages)
+            
+            for index in range(num_pages):
+                _check_cancelled(cancel_event)
                 
-                for page in pdf.pages:
-                    # Extract text
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n\n"
-                    
-                    # Extract tables
-                    page_tables = page.extract_tables()
-                    if page_tables:
-                        tables.extend(page_tables)
+                # Text: PyPDF2 first, pdfplumber for this page only if that fails
+                start = time.perf_counter()
+                page_text = None
+                source = "pypdf2"
+                if reader_pages is not None:
+                    try:
+                        page_text = reader_pages[index].extract_text() or ""
+                    except Exception:
+                        page_text = None
+                if not (page_text and page_text.strip()):
+                    try:
+                        page_text = open_plumber().pages[index].extract_text() or ""
+                        source = "pdfplumber"
+                    except PipelineCancelled:
+                        raise
+                    except Exception:
+                        page_text = page_text or ""
+                text_sources[source] += 1
+                text_ms = (time.perf_counter() - start) * 1000
+                if page_text:
+                    text_parts.append(page_text)
                 
-                metadata = {
-                    "num_pages": len(pdf.pages),
-                    "has_tables": len(tables) > 0,
-                    "table_count": len(tables)
-                }
+                # Tables: the most expensive step, so only on pages with ruling geometry
+                table_ms = 0.0
+                if table_mode == "all" or (table_mode == "auto" and (
+                    reader_pages is None or DocumentProcessor.draws_ruling(reader_pages[index])
+                )):
+                    start = time.perf_counter()
+                    table_pages_checked += 1
+                    try:
+                        page = open_plumber().pages[index]
+                        if table_mode == "all" or DocumentProcessor.has_ruled_cells(page):
+                            tables.extend(page.extract_tables() or [])
+                    except PipelineCancelled:
+                        raise
+                    except Exception as e:
+                        print(f"⚠️  Table extraction failed on page {index + 1} of {filename}: {e}")
+                    table_ms = (time.perf_counter() - start) * 1000
                 
-                return {
-                    "text": text.strip(),
-                    "metadata": metadata,
-                    "tables": tables,
-                    "type": EvidenceType.PDF_DOCUMENT
-                }
+                page_timings.append({"page": index + 1, "text": round(text_ms, 2), "tables": round(table_ms, 2)})
+        except PipelineCancelled:
+            raise
         except Exception as e:
-            # Fallback to PyPDF2
-            try:
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n\n"
-                
-                return {
-                    "text": text.strip(),
-                    "metadata": {"num_pages": len(pdf_reader.pages)},
-                    "tables": [],
-                    "type": EvidenceType.PDF_DOCUMENT
-                }
-            except Exception as fallback_error:
-                raise Exception(f"PDF processing failed: {str(fallback_error)}")
+            raise Exception(f"PDF processing failed: {str(e)}")
+        finally:
+            if plumber is not None:
+                plumber.close()
+        
+        metadata = {
+            "num_pages": num_pages,
+            "has_tables": len(tables) > 0,
+            "table_count": len(tables),
+            "table_mode": table_mode,
+            "table_pages_checked": table_pages_checked,
+            "text_sources": text_sources,
+            "page_timings_ms": page_timings
+        }
+        
+        return {
+            "text": "\n\n".join(text_parts).strip(),
+            "metadata": metadata,
+            "tables": tables,
+            "type": EvidenceType.PDF_DOCUMENT
+        }
     
     @staticmethod
     def process_docx(file_content: bytes, filename: str) -> Dict[str, Any]:
@@ -95,8 +224,57 @@ class DocumentProcessor:
             raise Exception(f"DOCX processing failed: {str(e)}")
     
     @staticmethod
-    def process_image(file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Process image files (screenshots, diagrams)"""
+    def prepare_image_for_upload(
+        image: Image.Image,
+        file_content: bytes,
+        max_dimension: int = DEFAULT_IMAGE_MAX_DIMENSION,
+        jpeg_quality: int = DEFAULT_IMAGE_JPEG_QUALITY
+    ) -> tuple[bytes, str, tuple[int, int]]:
+        """
+        Downscale and re-encode an image for the model
+        
+        The longest side is capped at max_dimension. JPEG sources stay JPEG
+        (photos), everything else is sent as PNG so screenshot text stays
+        sharp; formats the model does not accept (BMP, TIFF, GIF) are
+        converted. The original bytes are kept when they are already an
+        accepted format within the size limit and re-encoding would not
+        make them smaller.
+        
+        Returns:
+            (upload bytes, MIME type, (width, height) sent)
+        """
+        source_format = image.format
+        image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > max_dimension
+        if resized:
+            image = image.copy()
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        
+        target_format = "JPEG" if source_format == "JPEG" else "PNG"
+        if target_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif target_format == "PNG" and image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        
+        buffer = io.BytesIO()
+        if target_format == "JPEG":
+            image.save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+        else:
+            image.save(buffer, format="PNG", optimize=True)
+        encoded = buffer.getvalue()
+        
+        if not resized and source_format in UPLOAD_MIME_TYPES and len(file_content) <= len(encoded):
+            return file_content, UPLOAD_MIME_TYPES[source_format], image.size
+        return encoded, UPLOAD_MIME_TYPES[target_format], image.size
+    
+    @staticmethod
+    def process_image(
+        file_content: bytes,
+        filename: str,
+        max_dimension: int = DEFAULT_IMAGE_MAX_DIMENSION,
+        jpeg_quality: int = DEFAULT_IMAGE_JPEG_QUALITY
+    ) -> Dict[str, Any]:
+        """Process image files (screenshots, diagrams) and prepare them for upload"""
         try:
             image = Image.open(io.BytesIO(file_content))
             
@@ -105,21 +283,33 @@ class DocumentProcessor:
             is_diagram = any(keyword in filename.lower() 
                            for keyword in ["diagram", "architecture", "network", "topology"])
             
+            image_data, mime_type, (upload_width, upload_height) = DocumentProcessor.prepare_image_for_upload(
+                image, file_content, max_dimension, jpeg_quality
+            )
+            
             metadata = {
                 "width": width,
                 "height": height,
                 "format": image.format,
                 "mode": image.mode,
-                "is_diagram": is_diagram
+                "is_diagram": is_diagram,
+                "original_bytes": len(file_content),
+                "upload_bytes": len(image_data),
+                "upload_width": upload_width,
+                "upload_height": upload_height,
+                "upload_mime_type": mime_type,
+                "image_tokens_original": estimate_image_tokens(width, height),
+                "image_tokens": estimate_image_tokens(upload_width, upload_height)
             }
             
             evidence_type = EvidenceType.NETWORK_DIAGRAM if is_diagram else EvidenceType.SCREENSHOT
             
-            # Convert to base64 for Gemini multimodal input (done by caller)
+            # Sent inline as a multimodal part by the caller
             return {
                 "text": None,  # Will be extracted by Gemini vision
                 "metadata": metadata,
-                "image_data": file_content,
+                "image_data": image_data,
+                "image_mime_type": mime_type,
                 "type": evidence_type
             }
         except Exception as e:
@@ -178,16 +368,49 @@ class DocumentProcessor:
             return EvidenceType.UNKNOWN
     
     @staticmethod
-    def process_file(file_content: bytes, filename: str, content_type: str) -> Dict[str, Any]:
-        """Main entry point to process any file type"""
+    def process_file(
+        file_content: bytes,
+        filename: str,
+        content_type: str,
+        cancel_event: Optional[threading.Event] = None,
+        image_max_dimension: int = DEFAULT_IMAGE_MAX_DIMENSION,
+        image_jpeg_quality: int = DEFAULT_IMAGE_JPEG_QUALITY,
+        extraction_cache: Optional[ExtractionCache] = None,
+        pdf_table_mode: str = "auto",
+        session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Main entry point to process any file type
+        
+        cancel_event is polled between pages so extraction running in a worker
+        thread stops promptly when the owning pipeline is cancelled. Images are
+        downscaled and re-encoded here too, so that work stays off the event loop.
+        PDF and DOCX results are served from extraction_cache when the same
+        bytes were extracted before by this processor version and table mode;
+        entries are recorded against session_id so they can be purged with it.
+        """
+        _check_cancelled(cancel_event)
         file_type = DocumentProcessor.detect_file_type(filename, content_type)
         
+        if extraction_cache is not None and file_type in CACHED_EVIDENCE_TYPES:
+            key = extraction_key(file_content, f"{PROCESSOR_VERSION}:{pdf_table_mode}")
+            cached = extraction_cache.get(key, session_id)
+            if cached is not None:
+                return cached
+            result = DocumentProcessor.process_file(
+                file_content, filename, content_type, cancel_event, pdf_table_mode=pdf_table_mode
+            )
+            extraction_cache.put(key, result, session_id)
+            return result
+        
         if file_type == EvidenceType.PDF_DOCUMENT:
-            return DocumentProcessor.process_pdf(file_content, filename)
+            return DocumentProcessor.process_pdf(file_content, filename, cancel_event, pdf_table_mode)
         elif file_type == EvidenceType.WORD_DOCUMENT:
             return DocumentProcessor.process_docx(file_content, filename)
         elif file_type in [EvidenceType.SCREENSHOT, EvidenceType.NETWORK_DIAGRAM]:
-            return DocumentProcessor.process_image(file_content, filename)
+            return DocumentProcessor.process_image(
+                file_content, filename, image_max_dimension, image_jpeg_quality
+            )
         elif file_type == EvidenceType.CONFIG_FILE:
             return DocumentProcessor.process_config_file(file_content, filename)
         else:
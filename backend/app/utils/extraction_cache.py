@@ -0,0 +1,195 @@
+"""
+On-disk cache of document extraction results
+
+The same policies and plans are uploaded again and again across sessions.
+Extraction results (text, tables, metadata) are stored as gzip-compressed
+JSON under a key derived from the SHA-256 of the file bytes and the document
+processor version, so a repeat upload skips parsing entirely and a processor
+change never serves stale output. The directory is bounded by total size;
+the least recently used entries (by file modification time, refreshed on
+every hit) are evicted first.
+
+Entries hold customer evidence text, so the cache is opt-in, lives outside
+the source tree, and the entries a session wrote or read are deleted with
+the session once no other live session references them (a shared entry is
+deleted with the last session using it).
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from app.config import get_settings
+from app.models import EvidenceType
+from app.utils import run_metrics
+from app.utils.cache_paths import cache_path
+
+
+ENTRY_SUFFIX = ".json.gz"
+
+
+def extraction_key(file_content: bytes, processor_version: str) -> str:
+    """Cache key for one file's bytes under one processor version"""
+    digest = hashlib.sha256(processor_version.encode("utf-8") + b"\x00")
+    digest.update(file_content)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Size-bounded directory of extraction results (safe across threads and processes)"""
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None  # Computed on first write
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._session_keys: Dict[str, Set[str]] = {}  # Session -> keys it wrote or read
+        self._key_sessions: Dict[str, Set[str]] = {}  # Key -> live sessions referencing it
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}{ENTRY_SUFFIX}"
+
+    def _track(self, key: str, session_id: Optional[str]) -> None:
+        if session_id is not None:
+            with self._lock:
+                self._session_keys.setdefault(session_id, set()).add(key)
+                self._key_sessions.setdefault(key, set()).add(session_id)
+
+    def get(self, key: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Cached extraction result, or None (a hit is recorded against session_id for purging)"""
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # Mark as recently used
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        run_metrics.add("extraction_cache_hits")
+        self._track(key, session_id)
+        result = entry["result"]
+        result["type"] = EvidenceType(result["type"])
+        return result
+
+    def put(self, key: str, result: Dict[str, Any], session_id: Optional[str] = None) -> None:
+        """Store an extraction result (failures to write are ignored)"""
+        payload = json.dumps(
+            {"result": {**result, "type": EvidenceType(result["type"]).value}},
+            ensure_ascii=False,
+            separators=(",", ":")
+        ).encode("utf-8")
+        data = gzip.compress(payload, compresslevel=6, mtime=0)
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        tmp_name = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename so readers never see a partial entry
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with self._lock:
+                self._ensure_size()
+                previous = path.stat().st_size if path.exists() else 0
+                os.replace(tmp_name, path)
+                tmp_name = None
+                self._size += len(data) - previous
+                if self._size > self.max_bytes:
+                    self._evict()
+            self._track(key, session_id)
+        except OSError as e:
+            print(f"⚠️  Extraction cache write failed: {e}")
+        finally:
+            if tmp_name is not None:
+                Path(tmp_name).unlink(missing_ok=True)
+
+    def purge_session(self, session_id: str) -> int:
+        """
+        Delete the entries a session wrote or read that no other live session references
+
+        Returns how many were removed.
+        """
+        with self._lock:
+            keys = self._session_keys.pop(session_id, set())
+            removed = 0
+            for key in keys:
+                sessions = self._key_sessions.get(key, set())
+                sessions.discard(session_id)
+                if sessions:
+                    continue  # Still in use by another session
+                self._key_sessions.pop(key, None)
+                path = self._path(key)
+                try:
+                    size = path.stat().st_size
+                    path.unlink()
+                except OSError:
+                    continue
+                removed += 1
+                if self._size is not None:
+                    self._size -= size
+            return removed
+
+    def _entries(self):
+        return self.directory.glob(f"*/*{ENTRY_SUFFIX}")
+
+    def _ensure_size(self) -> None:
+        if self._size is None:
+            self._size = sum(p.stat().st_size for p in self._entries())
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits (lock held)"""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(key=lambda entry: entry[0])
+
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._ensure_size()
+            return {
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+@lru_cache()
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Process-wide extraction cache (None when disabled)"""
+    settings = get_settings()
+    if not settings.extraction_cache_enabled:
+        return None
+    directory = settings.extraction_cache_dir or cache_path("extraction-cache")
+    return ExtractionCache(directory, max_bytes=settings.extraction_cache_max_mb * 1024 * 1024)
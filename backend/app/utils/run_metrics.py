@@ -0,0 +1,77 @@
+"""
+Per-run metrics sink
+
+Shared services (the NIST requirements cache, prompt coalescing, the model
+router, the batch size tuner, the prompt and extraction caches) keep
+process-wide counters. A pipeline run binds its own sink; whatever those
+services record while it is bound goes to that run only, so sessions
+processed concurrently never count each other's work.
+
+The sink lives in a context variable, which asyncio tasks and
+asyncio.to_thread calls started by the run inherit. Recording with no sink
+bound (API lookups, tests) is a no-op.
+"""
+
+import threading
+from collections import defaultdict
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional
+
+
+class RunMetricsSink:
+    """Counters and events recorded during one run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(int)
+        self._events: Dict[str, List[Any]] = defaultdict(list)
+
+    def add(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def append(self, name: str, event: Any) -> None:
+        with self._lock:
+            self._events[name].append(event)
+
+    def count(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def counters(self, prefix: str) -> Dict[str, float]:
+        """Counters under a dotted prefix, keyed by the rest of their name"""
+        prefix = f"{prefix}."
+        with self._lock:
+            return {
+                name[len(prefix):]: value for name, value in self._counters.items() if name.startswith(prefix)
+            }
+
+    def events(self, name: str) -> List[Any]:
+        with self._lock:
+            return list(self._events.get(name, ()))
+
+
+_sink: ContextVar[Optional[RunMetricsSink]] = ContextVar("run_metrics_sink", default=None)
+
+
+def bind(sink: RunMetricsSink) -> Token:
+    """Send metrics recorded in this context (and tasks/threads started from it) to a sink"""
+    return _sink.set(sink)
+
+
+def unbind(token: Token) -> None:
+    _sink.reset(token)
+
+
+def add(name: str, amount: float = 1) -> None:
+    """Add to a counter of the current run, if any"""
+    sink = _sink.get()
+    if sink is not None:
+        sink.add(name, amount)
+
+
+def append(name: str, event: Any) -> None:
+    """Record an event of the current run, if any"""
+    sink = _sink.get()
+    if sink is not None:
+        sink.append(name, event)
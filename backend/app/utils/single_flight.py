@@ -0,0 +1,62 @@
+"""
+Single-flight coalescing of identical concurrent async calls
+
+While a call for a key is in flight, later callers with the same key await
+the same result instead of starting their own. The shared call is cancelled
+only when every caller waiting on it has been cancelled.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from app.utils import run_metrics
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key (one event loop)"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await factory() for the first caller of a key; later callers share its result"""
+        flight = self._flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._finished(key, flight))
+        else:
+            self.coalesced += 1
+            run_metrics.add("coalesced_calls")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _finished(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": self.in_flight}
@@ -0,0 +1,115 @@
+"""
+Section-aware chunking of long document text
+
+Long policies and SSPs are split at section headings (markdown headings,
+numbered headings such as "3.2 Access Enforcement", "Section 4" or "Appendix
+B", and short all-caps lines) and consecutive sections are packed into chunks
+of at most a given token size. A section larger than one chunk is split at
+paragraph breaks, then line breaks, and only as a last resort mid-line.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from app.services.token_estimator import CHARS_PER_TOKEN, estimate_tokens
+
+
+_MARKDOWN_HEADING_RE = re.compile(r"^#{1,6}\s+\S")
+_NUMBERED_HEADING_RE = re.compile(
+    r"^(?:\d+(?:\.\d+)*\.?|[A-Z]\.|(?:SECTION|Section|APPENDIX|Appendix|CHAPTER|Chapter)\s+[\dA-Z]+[.:]?)\s+[A-Z]"
+)
+MAX_HEADING_CHARS = 100
+
+
+@dataclass
+class TextChunk:
+    """Consecutive sections of a document that fit in one summarization call"""
+    index: int
+    title: str  # Heading of the chunk's first section ("" before the first heading)
+    text: str
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+def is_heading(line: str) -> bool:
+    """Whether a line looks like a section heading"""
+    line = line.strip()
+    if not line or len(line) > MAX_HEADING_CHARS:
+        return False
+    if _MARKDOWN_HEADING_RE.match(line):
+        return True
+    if line.endswith((".", ",", ";")):
+        return False
+    if _NUMBERED_HEADING_RE.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters)
+
+
+def split_sections(text: str) -> List[Tuple[str, str]]:
+    """(heading, text including the heading) for each section, in document order"""
+    sections: List[Tuple[str, str]] = []
+    title, lines, has_body = None, [], False
+    for line in text.splitlines():
+        heading = is_heading(line)
+        if heading and has_body:
+            sections.append((title or "", "\n".join(lines).strip()))
+            title, lines, has_body = None, [], False
+        if heading:
+            # Consecutive headings (chapter, then first subsection) open one section
+            title = title or line.strip().lstrip("#").strip()
+        elif line.strip():
+            has_body = True
+        lines.append(line)
+    if any(line.strip() for line in lines):
+        sections.append((title or "", "\n".join(lines).strip()))
+    return sections
+
+
+def _split_oversized(text: str, max_tokens: int) -> List[str]:
+    """Pieces of one section, each within max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    for separator in ("\n\n", "\n"):
+        parts = [part for part in text.split(separator) if part.strip()]
+        if len(parts) > 1:
+            pieces, current = [], ""
+            for part in parts:
+                candidate = f"{current}{separator}{part}" if current else part
+                if current and estimate_tokens(candidate) > max_tokens:
+                    pieces.extend(_split_oversized(current, max_tokens))
+                    current = part
+                else:
+                    current = candidate
+            if current:
+                pieces.extend(_split_oversized(current, max_tokens))
+            return pieces
+    max_chars = max(1, int(max_tokens * CHARS_PER_TOKEN))
+    return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+
+
+def chunk_sections(text: str, max_tokens: int) -> List[TextChunk]:
+    """Pack a document's sections, in order, into chunks of at most max_tokens"""
+    chunks: List[TextChunk] = []
+    title, current = "", ""
+
+    def flush():
+        nonlocal current
+        if current.strip():
+            chunks.append(TextChunk(index=len(chunks), title=title, text=current.strip()))
+        current = ""
+
+    for section_title, section_text in split_sections(text):
+        for piece in _split_oversized(section_text, max_tokens):
+            candidate = f"{current}\n\n{piece}" if current else piece
+            if current and estimate_tokens(candidate) > max_tokens:
+                flush()
+                candidate = piece
+            if not current:
+                title = section_title
+            current = candidate
+    flush()
+    return chunks
@@ -0,0 +1 @@
+"""Standalone performance benchmarks (run from backend/, e.g. python -m benchmarks.token_estimation)"""
@@ -0,0 +1,121 @@
+"""
+Catalog Memory Benchmark
+
+Per-process memory held by the loaded NIST catalog in three layouts, each
+measured in a fresh interpreter:
+
+- compact: NISTCatalogService as loaded by every worker (slotted records,
+  interned IDs, shared prose, raw JSON released, prompt fragments included)
+- pydantic: the previous layout, rebuilt for comparison (raw catalog JSON
+  kept plus one NISTControl model per control)
+- snapshot: NISTCatalogService in mmap mode, mapping a compiled snapshot
+  (compiled beforehand, so only mapping and indexing are measured; the
+  mapped pages it touches are shared with every other worker)
+
+With --warm, the compact and snapshot layouts also fetch every control's
+requirements first, as a long-running worker eventually does, so the
+requirements cache is included.
+
+Usage (from backend/):
+    python -m benchmarks.catalog_memory [--warm]
+"""
+
+import argparse
+import gc
+import json
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Optional
+
+LAYOUTS = ("pydantic", "compact", "snapshot")
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), else peak RSS"""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(layout: str, snapshot_path: Optional[str] = None, warm: bool = False) -> Dict[str, float]:
+    """Memory retained by one catalog layout in this process"""
+    from app.services.nist_catalog_service import NISTCatalogService
+
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+
+    service = NISTCatalogService(snapshot_path=snapshot_path if layout == "snapshot" else None)
+    service.load_catalog()
+    if layout == "pydantic":
+        with open(service.catalog_path, encoding="utf-8") as f:
+            raw_catalog = json.load(f)
+        controls = service.get_all_controls()
+        del service
+        retained = (raw_catalog, controls)
+    else:
+        if warm:
+            service.get_control_requirements_batch(service.get_all_control_ids())
+        retained = service
+
+    gc.collect()
+    heap, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss_bytes()
+    del retained
+    return {
+        "layout": layout,
+        "rss_mb": round((rss_after - rss_before) / 2**20, 2),
+        "python_heap_mb": round(heap / 2**20, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layout", choices=LAYOUTS, help="Measure one layout in this process")
+    parser.add_argument("--snapshot", help="Compiled snapshot for the snapshot layout")
+    parser.add_argument("--warm", action="store_true", help="Fill the requirements cache before measuring")
+    args = parser.parse_args()
+
+    if args.layout:
+        print(json.dumps(measure(args.layout, args.snapshot, args.warm)))
+        return
+
+    from app.services.catalog_snapshot import compile_snapshot
+    from app.services.nist_catalog_service import NISTCatalogService
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = str(compile_snapshot(NISTCatalogService().catalog_path, Path(tmp) / "catalog.snapshot"))
+        for layout in LAYOUTS:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.catalog_memory", "--layout", layout, "--snapshot", snapshot]
+                + (["--warm"] if args.warm else []),
+                capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    baseline = results[0]
+    print(json.dumps({
+        "results": results,
+        "saved_vs_pydantic": {
+            result["layout"]: {
+                "rss_mb": round(baseline["rss_mb"] - result["rss_mb"], 2),
+                "python_heap_mb": round(baseline["python_heap_mb"] - result["python_heap_mb"], 2)
+            }
+            for result in results[1:]
+        }
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Token Estimation Benchmark
+
+Measures how fast the local token estimator counts prompts built from the
+NIST catalog, and how far its estimates are from the prompt token counts the
+API reported for calls actually made (the calibration file GeminiService
+records). Samples are split in order: the scale is fitted on the first part
+and errors are measured on the held-out rest, next to the plain
+characters-per-token rule and the uncalibrated feature count.
+
+Usage (from backend/):
+    python -m benchmarks.token_estimation [--calibration-file PATH] [--holdout 0.2]
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, List
+
+from app.services.nist_catalog_service import NISTCatalogService
+from app.services.token_estimator import (
+    CHARS_PER_TOKEN, DEFAULT_CALIBRATION_FILE, TokenEstimator, raw_token_count
+)
+
+
+def catalog_prompts(catalog: NISTCatalogService) -> List[str]:
+    """One quick-mode and one deep-mode control section per catalog control"""
+    prompts = []
+    for control_id in catalog.get_all_control_ids():
+        req = catalog.get_control_requirements(control_id)
+        prompts.append(f"{control_id}: {req['title']}\nStatement: {req['statement'][:200]}...")
+        enhancements = "\n".join(f"- {e['id']}: {e['title']}" for e in req['enhancements'])
+        prompts.append(
+            f"Control: {control_id} - {req['title']}\nRequirement: {req['statement']}\n"
+            f"Guidance: {req['guidance']}\nEnhancements:\n{enhancements}"
+        )
+    return prompts
+
+
+def throughput(prompts: List[str], rounds: int = 3) -> Dict[str, float]:
+    """Prompts counted per second by the calibrated (feature-count) path, best of several rounds"""
+    estimator = TokenEstimator(min_samples=1)
+    estimator.observe(prompts[0], len(prompts[0]) // 4)
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for prompt in prompts:
+            estimator.estimate(prompt)
+        best = min(best, time.perf_counter() - start)
+    return {
+        "prompts": len(prompts),
+        "seconds": round(best, 4),
+        "prompts_per_second": round(len(prompts) / best, 1),
+        "chars_per_second": round(sum(len(p) for p in prompts) / best, 1)
+    }
+
+
+def _error_percent(estimates: List[float], actuals: List[int]) -> Dict[str, float]:
+    errors = sorted(abs(e - a) / a * 100 for e, a in zip(estimates, actuals))
+    return {
+        "mean_abs_error_percent": round(sum(errors) / len(errors), 2),
+        "p95_abs_error_percent": round(errors[min(len(errors) - 1, int(0.95 * len(errors)))], 2)
+    }
+
+
+def accuracy(calibration_file: str, holdout: float) -> Dict[str, object]:
+    """Errors against recorded actual counts on the held-out samples"""
+    samples = []
+    with open(calibration_file, encoding="utf-8") as f:
+        for line in f:
+            try:
+                sample = json.loads(line)
+                samples.append((sample, raw_token_count(sample), int(sample["actual"])))
+            except (ValueError, KeyError, TypeError):
+                continue
+    split = int(len(samples) * (1 - holdout))
+    fit, test = samples[:split], samples[split:]
+    if not fit or not test:
+        return {"samples": len(samples), "error": "not enough samples to hold out"}
+
+    scale = sum(actual for _, _, actual in fit) / sum(raw for _, raw, _ in fit)
+    actuals = [actual for _, _, actual in test]
+    return {
+        "samples": len(samples),
+        "fit_samples": len(fit),
+        "holdout_samples": len(test),
+        "scale": round(scale, 4),
+        "chars_per_token": _error_percent([s["chars"] / CHARS_PER_TOKEN for s, _, _ in test], actuals),
+        "uncalibrated_features": _error_percent([raw for _, raw, _ in test], actuals),
+        "calibrated": _error_percent([raw * scale for _, raw, _ in test], actuals)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calibration-file", default=DEFAULT_CALIBRATION_FILE)
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of samples (most recent) held out")
+    args = parser.parse_args()
+
+    catalog = NISTCatalogService()
+    catalog.load_catalog()
+    results = {"throughput": throughput(catalog_prompts(catalog))}
+    try:
+        results["accuracy"] = accuracy(args.calibration_file, args.holdout)
+    except OSError:
+        results["accuracy"] = {"error": f"no calibration samples at {args.calibration_file} (recorded as the API is called)"}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Shared test helpers.
+"""
+
+import inspect
+from unittest.mock import Mock
+
+from app.services.gemini_service import GeminiService
+from app.services.model_router import ModelRouter
+from app.utils.single_flight import SingleFlight
+
+
+class FakeResponse:
+    """Minimal stand-in for a Gemini response"""
+    def __init__(self, text):
+        self.text = text
+
+
+def make_gemini_service(methods, respond=None, **settings):
+    """
+    GeminiService stand-in with only the given real methods bound (no Settings/API key needed)
+
+    Keyword arguments become attributes of service.settings. When respond is
+    given, it backs the "standard" model: it is called (or awaited) with the
+    prompt contents and may return response text or a response object.
+    """
+    service = Mock(spec=GeminiService)
+    for name in methods:
+        setattr(service, name, getattr(GeminiService, name).__get__(service))
+    service.settings = Mock(**settings)
+    service.single_flight = SingleFlight()
+
+    if respond is not None:
+        async def generate(contents):
+            reply = respond(contents)
+            if inspect.isawaitable(reply):
+                reply = await reply
+            return FakeResponse(reply) if isinstance(reply, str) else reply
+
+        service.model = Mock()
+        service.model.generate_content_async = generate
+        service.router = ModelRouter({"standard": service.model})
+    return service
@@ -5,9 +5,11 @@ Tests PDF, DOCX, image, and config file processing.
 
 import pytest
 import io
+import threading
 from PIL import Image
 from app.utils.document_processor import DocumentProcessor
 from app.models import EvidenceType
+from app.services.pipeline_registry import PipelineCancelled
 
 
 class TestDocumentProcessor:
@@ -134,6 +136,19 @@ controls:
         assert isinstance(result["parsed_data"], dict)
         assert result["parsed_data"]["version"] == "1.0"
     
+    def test_process_file_cancelled(self, sample_pdf_bytes):
+        """Test extraction stops when the owning pipeline has been cancelled."""
+        cancel_event = threading.Event()
+        cancel_event.set()
+        
+        with pytest.raises(PipelineCancelled):
+            DocumentProcessor.process_file(
+                sample_pdf_bytes,
+                "document.pdf",
+                "application/pdf",
+                cancel_event=cancel_event
+            )
+    
     def test_process_file_pdf(self, sample_pdf_bytes):
         """Test unified file processing for PDF."""
         result = DocumentProcessor.process_file(
@@ -243,3 +258,320 @@ logging:
         
         assert "api" in result["parsed_data"]
         assert result["parsed_data"]["api"]["version"] == "v1"
+
+
+class TestImagePreprocessing:
+    """Tests for downscaling and re-encoding images before upload."""
+    
+    @staticmethod
+    def _image_bytes(size, fmt, mode='RGB'):
+        img = Image.new(mode, size, color='white')
+        # Some detail so encoders have something to compress
+        for x in range(0, size[0], 7):
+            img.putpixel((x, x % size[1]), (0, 0, 0) if mode == 'RGB' else 0)
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format=fmt)
+        return img_bytes.getvalue()
+    
+    def test_large_screenshot_downscaled_as_png(self):
+        """Test the longest side is capped and screenshots stay PNG."""
+        content = self._image_bytes((4000, 2000), 'PNG')
+        
+        result = DocumentProcessor.process_image(content, "console.png", max_dimension=1000)
+        
+        uploaded = Image.open(io.BytesIO(result["image_data"]))
+        assert uploaded.size == (1000, 500)
+        assert uploaded.format == "PNG"
+        assert result["image_mime_type"] == "image/png"
+        assert result["metadata"]["width"] == 4000
+        assert result["metadata"]["image_tokens"] < result["metadata"]["image_tokens_original"]
+    
+    def test_jpeg_keeps_jpeg_mime_type(self):
+        """Test photos are re-encoded as JPEG and labeled image/jpeg."""
+        content = self._image_bytes((3000, 3000), 'JPEG')
+        
+        result = DocumentProcessor.process_image(content, "rack.jpg", max_dimension=1500)
+        
+        assert result["image_mime_type"] == "image/jpeg"
+        assert Image.open(io.BytesIO(result["image_data"])).size == (1500, 1500)
+        assert result["metadata"]["upload_bytes"] < result["metadata"]["original_bytes"]
+    
+    def test_unsupported_format_converted(self):
+        """Test formats the model does not accept are sent as PNG."""
+        content = self._image_bytes((100, 100), 'BMP')
+        
+        result = DocumentProcessor.process_image(content, "diagram.bmp")
+        
+        assert result["image_mime_type"] == "image/png"
+        assert Image.open(io.BytesIO(result["image_data"])).format == "PNG"
+    
+    def test_small_image_sent_unchanged(self):
+        """Test an accepted image within limits keeps its original bytes when re-encoding would not shrink it."""
+        img_bytes = io.BytesIO()
+        Image.new('RGB', (64, 64), color='red').save(img_bytes, format='PNG', optimize=True)
+        content = img_bytes.getvalue()
+        
+        result = DocumentProcessor.process_image(content, "small.png")
+        
+        assert result["image_data"] == content
+        assert result["image_mime_type"] == "image/png"
+
+
+class TestExtractionCache:
+    """Tests for the on-disk extraction cache."""
+    
+    def test_repeat_upload_skips_parsing(self, tmp_path, monkeypatch):
+        """Test identical bytes are extracted once and served from disk afterwards."""
+        from app.utils.extraction_cache import ExtractionCache
+        cache = ExtractionCache(str(tmp_path))
+        calls = []
+        
+        def fake_pdf(content, filename, cancel_event=None, table_mode="auto"):
+            calls.append(filename)
+            return {"text": "Access control policy", "metadata": {"num_pages": 1},
+                    "tables": [[["Role", None]]], "type": EvidenceType.PDF_DOCUMENT}
+        
+        monkeypatch.setattr(DocumentProcessor, "process_pdf", staticmethod(fake_pdf))
+        
+        first = DocumentProcessor.process_file(b"%PDF-same", "a.pdf", "application/pdf", extraction_cache=cache)
+        second = DocumentProcessor.process_file(b"%PDF-same", "b.pdf", "application/pdf", extraction_cache=cache)
+        DocumentProcessor.process_file(b"%PDF-other", "c.pdf", "application/pdf", extraction_cache=cache)
+        
+        assert calls == ["a.pdf", "c.pdf"]
+        assert second == first
+        assert second["type"] is EvidenceType.PDF_DOCUMENT
+        assert cache.stats()["hits"] == 1
+    
+    def test_session_entries_purged(self, tmp_path):
+        """Test deleting a session removes the entries it wrote or read, and only those."""
+        from app.utils.extraction_cache import ExtractionCache
+        cache = ExtractionCache(str(tmp_path))
+        result = {"text": "Evidence", "metadata": {}, "tables": [], "type": EvidenceType.PDF_DOCUMENT}
+        cache.put("aa1", result, "session-1")
+        cache.put("bb2", result, "session-2")
+        cache.put("cc3", result, "session-3")
+        assert cache.get("cc3", "session-1") is not None
+        
+        assert cache.purge_session("session-1") == 1
+        assert cache.purge_session("session-3") == 1
+        assert cache.get("aa1") is None and cache.get("cc3") is None
+        assert cache.purge_session("session-1") == 0
+        assert cache.get("bb2") is not None
+    
+    def test_shared_entry_kept_for_live_session(self, tmp_path):
+        """Test an entry two sessions use survives deleting one of them and goes with the last."""
+        from app.utils.extraction_cache import ExtractionCache
+        cache = ExtractionCache(str(tmp_path))
+        result = {"text": "Evidence", "metadata": {}, "tables": [], "type": EvidenceType.PDF_DOCUMENT}
+        cache.put("aa1", result, "session-1")
+        assert cache.get("aa1", "session-2") is not None
+        
+        assert cache.purge_session("session-1") == 0
+        assert cache.get("aa1", "session-2") is not None
+        
+        assert cache.purge_session("session-2") == 1
+        assert cache.get("aa1") is None
+        assert cache.stats()["size_bytes"] == 0
+    
+    def test_failed_write_leaves_no_temp_file(self, tmp_path, monkeypatch):
+        """Test a write that fails before the rename removes its temporary file."""
+        import os
+        from app.utils.extraction_cache import ExtractionCache
+        cache = ExtractionCache(str(tmp_path))
+        
+        def failing_replace(src, dst):
+            raise OSError("disk full")
+        
+        monkeypatch.setattr(os, "replace", failing_replace)
+        cache.put("aa1", {"text": "Evidence", "metadata": {}, "tables": [], "type": "pdf"})
+        
+        assert list(tmp_path.rglob("*.tmp")) == []
+        assert cache.get("aa1") is None
+    
+    def test_processor_version_is_part_of_key(self):
+        """Test a processor version change never reuses old results."""
+        from app.utils.extraction_cache import extraction_key
+        
+        assert extraction_key(b"data", "1") != extraction_key(b"data", "2")
+        assert extraction_key(b"data", "1") == extraction_key(b"data", "1")
+    
+    def test_least_recently_used_entries_evicted(self, tmp_path):
+        """Test the directory is kept under its size bound, oldest entries first."""
+        import os
+        import random
+        from app.utils.extraction_cache import ExtractionCache
+        rng = random.Random(7)
+        cache = ExtractionCache(str(tmp_path), max_bytes=25000)
+        
+        def result():
+            # Incompressible text so each entry is about 10 KB on disk
+            return {"text": "".join(rng.choice("abcdefghij0123456789") for _ in range(17000)),
+                    "metadata": {}, "tables": [], "type": "pdf"}
+        
+        for index, key in enumerate(["aa1", "bb2"]):
+            cache.put(key, result())
+            os.utime(cache._path(key), (1000 + index, 1000 + index))
+        assert cache.get("aa1") is not None  # Refreshes aa1, so bb2 is now oldest
+        cache.put("cc3", result())
+        
+        assert cache.get("bb2") is None
+        assert cache.get("aa1") is not None and cache.get("cc3") is not None
+        stats = cache.stats()
+        assert stats["evictions"] == 1 and stats["size_bytes"] <= 25000
+
+
+def _pdf_string(text):
+    return "(" + text.replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def _text_stream(lines):
+    return "BT /F1 10 Tf 14 TL 50 750 Td " + " ".join(f"{_pdf_string(line)} Tj T*" for line in lines) + " ET"
+
+
+def _ruled_table_stream(rows, left=50, top=700, width=120, height=20):
+    """Content stream drawing a grid of ruling lines with each cell's text positioned inside it."""
+    columns = len(rows[0])
+    right, bottom = left + columns * width, top - len(rows) * height
+    rules = [f"{left} {top - r * height} m {right} {top - r * height} l" for r in range(len(rows) + 1)]
+    rules += [f"{left + c * width} {top} m {left + c * width} {bottom} l" for c in range(columns + 1)]
+    cells = [
+        f"BT /F1 10 Tf {left + c * width + 5} {top - (r + 1) * height + 6} Td {_pdf_string(cell)} Tj ET"
+        for r, row in enumerate(rows) for c, cell in enumerate(row)
+    ]
+    return "0.5 w " + " ".join(rules) + " S " + " ".join(cells)
+
+
+def _text_pdf(pages):
+    """Build a PDF whose pages hold the given lines of Helvetica text (or a raw content stream)."""
+    objects = ["<</Type/Catalog/Pages 2 0 R>>", None, "<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>"]
+    kids = []
+    for page in pages:
+        stream = page if isinstance(page, str) else _text_stream(page)
+        objects.append(f"<</Length {len(stream)}>>stream\n{stream}\nendstream")
+        objects.append(
+            f"<</Type/Page/MediaBox[0 0 612 792]/Parent 2 0 R/Resources<</Font<</F1 3 0 R>>>>"
+            f"/Contents {len(objects)} 0 R>>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<</Type/Pages/Count {len(pages)}/Kids[{' '.join(kids)}]>>"
+    
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    body += f"trailer<</Size {len(objects) + 1}/Root 1 0 R>>\nstartxref\n{xref}\n%%EOF".encode("latin-1")
+    return body
+
+
+class TestPDFFastPath:
+    """Tests for text-first PDF extraction with selective table extraction."""
+    
+    PROSE = ["Access to systems is granted on least privilege.", "Accounts are reviewed every quarter."]
+    TABLE = ["Control    Owner    Status", "AC-2    IAM team    Implemented",
+             "AU-6    SOC    Planned", "IR-4    Security    Implemented"]
+    GRID = [["Control", "Owner", "Status"], ["AC-2", "IAM team", "Implemented"],
+            ["AU-6", "SOC", "Planned"], ["IR-4", "Security", "Implemented"]]
+    
+    def test_policy_pdf_skips_table_extraction(self):
+        """Test prose-only pages are read with PyPDF2 and never table-scanned."""
+        content = _text_pdf([self.PROSE, self.PROSE])
+        
+        result = DocumentProcessor.process_pdf(content, "policy.pdf")
+        
+        metadata = result["metadata"]
+        assert "least privilege" in result["text"]
+        assert metadata["num_pages"] == 2
+        assert metadata["table_pages_checked"] == 0
+        assert metadata["text_sources"] == {"pypdf2": 2, "pdfplumber": 0}
+        assert [t["page"] for t in metadata["page_timings_ms"]] == [1, 2]
+    
+    def test_tables_only_on_ruled_pages(self):
+        """Test auto mode extracts a ruled table of positioned cells and scans no other page."""
+        content = _text_pdf([self.PROSE, _ruled_table_stream(self.GRID), self.PROSE])
+        
+        auto = DocumentProcessor.process_pdf(content, "ssp.pdf")
+        everything = DocumentProcessor.process_pdf(content, "ssp.pdf", table_mode="all")
+        off = DocumentProcessor.process_pdf(content, "ssp.pdf", table_mode="off")
+        
+        assert auto["tables"] == [self.GRID]
+        assert auto["tables"] == everything["tables"]
+        assert auto["metadata"]["table_pages_checked"] == 1
+        assert auto["metadata"]["page_timings_ms"][0]["tables"] == 0.0
+        assert everything["metadata"]["table_pages_checked"] == 3
+        assert off["metadata"]["table_pages_checked"] == 0 and off["tables"] == []
+        assert auto["text"] == off["text"]
+    
+    def test_ruling_checks(self):
+        """Test pages are table-scanned on drawn ruling lines, not on how their text is spaced."""
+        import PyPDF2
+        import pdfplumber
+        
+        underlined = _text_stream(self.PROSE) + " 50 740 m 300 740 l S"
+        content = _text_pdf([self.TABLE, _ruled_table_stream(self.GRID), underlined])
+        pages = PyPDF2.PdfReader(io.BytesIO(content)).pages
+        
+        assert [DocumentProcessor.draws_ruling(page) for page in pages] == [False, True, True]
+        with pdfplumber.open(io.BytesIO(content)) as pdf:
+            assert [DocumentProcessor.has_ruled_cells(page) for page in pdf.pages] == [False, True, False]
+        result = DocumentProcessor.process_pdf(content, "ssp.pdf")
+        assert result["tables"] == [self.GRID]
+        assert result["metadata"]["table_pages_checked"] == 2
+    
+    def test_unreadable_page_falls_back_alone(self, monkeypatch):
+        """Test a page PyPDF2 cannot read is taken from pdfplumber without redoing the others."""
+        import PyPDF2
+        original = PyPDF2.PageObject.extract_text
+        calls = []
+        
+        def flaky_extract(page, *args, **kwargs):
+            calls.append(page)
+            if len(calls) == 2:
+                raise ValueError("broken content stream")
+            return original(page, *args, **kwargs)
+        
+        monkeypatch.setattr(PyPDF2.PageObject, "extract_text", flaky_extract)
+        content = _text_pdf([self.PROSE, ["Incident response plan tested annually."], self.PROSE])
+        
+        result = DocumentProcessor.process_pdf(content, "plan.pdf")
+        
+        assert len(calls) == 3
+        assert result["metadata"]["text_sources"] == {"pypdf2": 2, "pdfplumber": 1}
+        assert "Incident response plan" in result["text"]
+
+
+class TestTextSections:
+    """Test section-aware chunking of long document text."""
+    
+    def test_sections_split_at_headings(self):
+        """Test markdown, numbered and all-caps headings start sections."""
+        from app.utils.text_sections import split_sections
+        text = (
+            "Preamble text.\n\n"
+            "1 PURPOSE\nThis policy defines account handling.\n\n"
+            "2 ACCESS CONTROL\n2.1 Account Management\nAccounts are reviewed (AC-2).\n"
+            "## Logging\nLogs are reviewed weekly (AU-6)."
+        )
+        
+        sections = split_sections(text)
+        
+        assert [title for title, _ in sections] == ["", "1 PURPOSE", "2 ACCESS CONTROL", "Logging"]
+        assert sections[2][1].startswith("2 ACCESS CONTROL\n2.1 Account Management\nAccounts")
+        assert "".join(body for _, body in sections).replace("\n", "") == text.replace("\n", "")
+    
+    def test_chunks_respect_token_limit_and_order(self):
+        """Test sections are packed in order and oversized sections are split."""
+        from app.utils.text_sections import chunk_sections
+        from app.services.token_estimator import estimate_tokens
+        small = "\n\n".join(f"{i} SECTION {i}\n" + "Short body. " * 10 for i in range(1, 5))
+        huge = "9 APPENDIX\n" + "\n\n".join("Paragraph of evidence text. " * 20 for _ in range(30))
+        
+        chunks = chunk_sections(small + "\n\n" + huge, max_tokens=400)
+        
+        assert all(estimate_tokens(chunk.text) <= 400 for chunk in chunks)
+        assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+        assert chunks[0].title == "1 SECTION 1" and "4 SECTION 4" in chunks[0].text
+        assert chunks[1].title == "9 APPENDIX" and len(chunks) > 3
@@ -15,6 +15,9 @@ from app.models import (
     EvidenceType
 )
 from app.services.gemini_service import GeminiService
+from app.services.batch_tuning import BatchParseStats, BatchSizeTuner
+from app.services.model_router import ModelRouter
+from conftest import FakeResponse, make_gemini_service
 
 
 class TestControlGapIntegration:
@@ -224,3 +227,739 @@ class TestGeminiServiceAttributeAccess:
             if "severity" in str(e):
                 pytest.fail(f"Code tried to access gap.severity instead of gap.risk_level: {e}")
             raise
+
+
+class TestOSCALNarrativeEnrichment:
+    """Test opt-in narrative enrichment for OSCAL generation."""
+    
+    @pytest.mark.asyncio
+    async def test_only_thin_descriptions_are_sent(self):
+        """Test only short descriptions are batched to the model and replaced."""
+        import json
+        prompts = []
+        
+        def respond(prompt):
+            prompts.append(prompt)
+            return json.dumps({"narratives": [
+                {"control_id": "AC-2", "narrative": "Accounts are provisioned through the IdP with quarterly reviews."}
+            ]})
+        
+        service = make_gemini_service(
+            ("_generate_content", "_call_model", "needs_narrative", "enrich_control_narratives",
+             "_build_narrative_prompt", "_parse_narrative_response"),
+            respond,
+            oscal_narrative_min_chars=80, oscal_enrichment_batch_size=15, max_concurrent_batches=3
+        )
+        
+        mappings = [
+            ControlMapping(
+                control_id=control_id,
+                control_name="Control",
+                control_family=ControlFamily.AC,
+                evidence_ids=[],
+                implementation_status="implemented",
+                implementation_description=description,
+                confidence_score=0.9
+            )
+            for control_id, description in [
+                ("AC-2", "Yes"),
+                ("AC-3", "Access enforcement is handled by role-based policies in the application tier, reviewed monthly."),
+                ("AC-4", "No")
+            ]
+        ]
+        
+        enriched, calls, applied = await service.enrich_control_narratives(mappings, [])
+        
+        # AC-4 was sent but got no narrative back, so only AC-2 counts as enriched
+        assert calls == 1 and applied == 1
+        assert "AC-2" in prompts[0] and "AC-4" in prompts[0] and "AC-3" not in prompts[0]
+        assert enriched[0].implementation_description.startswith("Accounts are provisioned")
+        assert enriched[1] is mappings[1] and enriched[2] is mappings[2]
+
+
+class TestShardedControlMapping:
+    """Test Agent 2 control mapping is sharded across the whole scope."""
+    
+    @staticmethod
+    def _service(shard_size=4, respond=None):
+        service = make_gemini_service(
+            ("_generate_content", "_call_model", "map_controls_and_gaps", "_mapping_shards",
+             "_merge_mapping_results", "_map_controls_shard", "_map_shard_bisecting", "group_by_family",
+             "_load_batch_json", "_parse_control_mappings_json", "_parse_control_gaps_json"),
+            respond,
+            mapping_shard_size=shard_size, max_concurrent_batches=3
+        )
+        service.batch_stats = BatchParseStats()
+        return service
+    
+    @staticmethod
+    def _mapping_response(scope):
+        import json
+        return json.dumps({
+            "control_mappings": [
+                {"control_id": cid, "control_name": cid, "control_family": cid[:2],
+                 "implementation_status": "implemented", "implementation_description": "ok",
+                 "confidence_score": 0.9, "evidence_artifacts": [], "gaps_identified": []}
+                for cid in scope
+            ],
+            "control_gaps": []
+        })
+    
+    def test_shards_keep_families_together(self):
+        """Test small families share shards and large families are chunked."""
+        service = self._service(shard_size=4)
+        scope = ["AC-1", "AC-2", "AC-3", "AC-4", "AC-5", "AU-1", "AU-2", "CM-1", "AC-2"]
+        
+        shards = service._mapping_shards(scope)
+        
+        assert shards == [["AC-1", "AC-2", "AC-3", "AC-4"], ["AC-5", "AU-1", "AU-2", "CM-1"]]
+    
+    @pytest.mark.asyncio
+    async def test_every_scoped_control_is_sent_and_results_merged(self):
+        """Test scopes beyond 50 controls are fully covered and duplicates removed."""
+        import json
+        import re
+        prompts = []
+        
+        def respond(prompt):
+            prompts.append(prompt)
+            scope = re.search(r"in scope:\n(.*)\n", prompt).group(1).split(", ")
+            # Every shard also reports AC-1 (and an out-of-scope control) with
+            # higher confidence, which only the shard assigned AC-1 may keep
+            return json.dumps({
+                "control_mappings": [
+                    {"control_id": cid, "control_name": cid, "control_family": cid[:2],
+                     "implementation_status": "implemented",
+                     "implementation_description": "ok" if cid in scope else "off-shard",
+                     "confidence_score": 0.9 if cid in scope else 0.99,
+                     "evidence_artifacts": [], "gaps_identified": []}
+                    for cid in scope + ["AC-1", "PM-9"]
+                ],
+                "control_gaps": []
+            })
+        
+        service = self._service(shard_size=20, respond=respond)
+        scope = [f"AC-{i}" for i in range(1, 31)] + [f"SC-{i}" for i in range(1, 41)]
+        
+        mappings, gaps = await service.map_controls_and_gaps([], control_filter=scope)
+        
+        assert len(prompts) == 4
+        assert sorted(m.control_id for m in mappings) == sorted(scope)
+        assert all(m.implementation_description == "ok" for m in mappings)
+        assert gaps == []
+    
+    @pytest.mark.asyncio
+    async def test_failed_shard_split_and_retried(self):
+        """Test a shard whose response does not parse is retried in halves, not dropped."""
+        import re
+        scopes = []
+        
+        def respond(prompt):
+            scope = re.search(r"in scope:\n(.*)\n", prompt).group(1).split(", ")
+            scopes.append(scope)
+            if len(scope) == 4:
+                return "The response was cut off mid-sentence"
+            return self._mapping_response(scope)
+        
+        service = self._service(shard_size=4, respond=respond)
+        scope = ["AC-1", "AC-2", "AC-3", "AC-4"]
+        
+        mappings, _ = await service.map_controls_and_gaps([], control_filter=scope)
+        
+        assert scopes == [scope, scope[:2], scope[2:]]
+        assert sorted(m.control_id for m in mappings) == scope
+        assert service.batch_stats.retry_calls["mapping"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_unmappable_control_fails_the_run(self):
+        """Test a control whose mapping keeps failing raises instead of vanishing from the results."""
+        import re
+        from app.services.gemini_service import ControlMappingError
+        
+        def respond(prompt):
+            scope = re.search(r"in scope:\n(.*)\n", prompt).group(1).split(", ")
+            if "AC-3" in scope:
+                raise RuntimeError("503 Service Unavailable")
+            return self._mapping_response(scope)
+        
+        service = self._service(shard_size=4, respond=respond)
+        
+        with pytest.raises(ControlMappingError, match="AC-3"):
+            await service.map_controls_and_gaps([], control_filter=["AC-1", "AC-2", "AC-3", "AC-4"])
+
+
+class TestFamilyBatchPacking:
+    """Test token-aware family batch packing for NIST validation."""
+    
+    @staticmethod
+    def _service(max_tokens):
+        service = make_gemini_service(
+            ("pack_family_batches", "group_by_family", "_format_family_control",
+             "_build_family_validation_prompt", "_get_family_info"),
+            max_tokens_per_request=max_tokens, max_concurrent_batches=3
+        )
+        service.batch_tuner = None
+        service.nist_service = Mock()
+        service.nist_service.get_control_requirements_batch = lambda ids: {
+            cid: {"title": f"Title {cid}", "statement": "x" * 400} for cid in ids
+        }
+        return service
+    
+    def test_batches_never_mix_families(self):
+        """Test each batch belongs to a single family and small families fit in one call."""
+        service = self._service(max_tokens=8000)
+        controls = ["AC-1", "AC-2", "AU-1", "AC-3", "SC-7"]
+        
+        batches = service.pack_family_batches(controls, [])
+        
+        assert batches == [("AC", ["AC-1", "AC-2", "AC-3"]), ("AU", ["AU-1"]), ("SC", ["SC-7"])]
+    
+    def test_large_family_split_to_fit_budget(self):
+        """Test a family is split once the token budget would be exceeded."""
+        from app.services.token_estimator import estimate_tokens
+        service = self._service(max_tokens=1200)
+        controls = [f"AC-{i}" for i in range(1, 21)]
+        
+        batches = service.pack_family_batches(controls, [])
+        
+        assert len(batches) > 1
+        assert [cid for _, batch in batches for cid in batch] == controls
+        for family, batch in batches:
+            prompt = service._build_family_validation_prompt(
+                family, service._get_family_info(family),
+                service.nist_service.get_control_requirements_batch(batch), []
+            )
+            assert estimate_tokens(prompt) + 150 * len(batch) <= 1200
+
+
+class TestAdaptiveValidationPrompts:
+    """Test adaptive per-control validation prompt selection."""
+    
+    REQUIREMENTS = {
+        "control_id": "AC-2",
+        "title": "Account Management",
+        "statement": "Define and document the types of accounts allowed. " * 20,
+        "guidance": "Examples of system account types include individual, shared, group. " * 30,
+        "related_controls": ["AC-3", "AC-5"],
+        "enhancements": [
+            {"id": "AC-2(1)", "title": "Automated System Account Management", "statement": "Support the management of accounts. " * 5}
+        ],
+        "assessment_methods": ["EXAMINE", "INTERVIEW", "TEST"],
+        "family": "AC"
+    }
+    
+    @staticmethod
+    def _service(mode="adaptive"):
+        return make_gemini_service(
+            ("build_validation_prompt", "select_validation_prompt"), validation_prompt_mode=mode
+        )
+    
+    @staticmethod
+    def _evidence():
+        return [EvidenceArtifact(
+            id="ev-1", filename="iam-policy.pdf", file_type=EvidenceType.POLICY_DOCUMENT,
+            content_summary="Account lifecycle policy", controls_mentioned=["AC-2"], confidence_score=0.9
+        )]
+    
+    def test_all_modes_render_with_evidence(self):
+        """Test every mode uses EvidenceArtifact fields that exist."""
+        service = self._service()
+        prompts = {
+            mode: service.build_validation_prompt("AC-2", self.REQUIREMENTS, self._evidence(), mode)
+            for mode in ("detailed", "concise", "minimal")
+        }
+        
+        assert "Account lifecycle policy" in prompts["detailed"]
+        assert "AC-2(1)" in prompts["detailed"] and "AC-2(1)" in prompts["concise"]
+        assert len(prompts["minimal"]) < len(prompts["concise"]) < len(prompts["detailed"])
+    
+    def test_mode_follows_tier_and_budget(self):
+        """Test the tier caps the mode and a tight budget steps it down."""
+        from app.services.token_estimator import PromptBudget
+        service = self._service()
+        
+        roomy = PromptBudget(total=100000, per_request=8000)
+        assert service.select_validation_prompt("AC-2", self.REQUIREMENTS, self._evidence(), "critical", roomy, 0)[0] == "detailed"
+        assert service.select_validation_prompt("AC-2", self.REQUIREMENTS, self._evidence(), "standard", roomy, 0)[0] == "concise"
+        
+        # 50 controls still to go must each keep a minimal prompt's worth of budget
+        tight = PromptBudget(total=10800, per_request=8000)
+        mode, _, tokens = service.select_validation_prompt("AC-2", self.REQUIREMENTS, self._evidence(), "critical", tight, 50)
+        assert mode == "concise"
+        assert tokens <= tight.allowance(50, 200)
+    
+    def test_fixed_mode_is_respected(self):
+        """Test a non-adaptive setting forces the configured mode."""
+        from app.services.token_estimator import PromptBudget
+        service = self._service(mode="minimal")
+        
+        mode, _, _ = service.select_validation_prompt(
+            "AC-2", self.REQUIREMENTS, self._evidence(), "critical", PromptBudget(total=100000, per_request=8000), 0
+        )
+        assert mode == "minimal"
+
+
+class TestPromptPrefixCache:
+    """Test stable prompt prefixes are uploaded once and reused."""
+    
+    @staticmethod
+    def _service(min_tokens=0):
+        import json
+        from app.services.prompt_cache import LocalPromptCacheBackend, PromptCacheService
+        prompts = []
+        
+        def respond(prompt):
+            import re
+            prompts.append(prompt)
+            batch = re.search(r"Controls to validate: (.*)", prompt)
+            batch = batch.group(1).split(", ") if batch else re.findall(r"^(AC-\d+):", prompt, re.M)
+            return json.dumps({"validations": [
+                {"control_id": cid, "is_valid": True, "coverage_score": 0.8} for cid in batch
+            ]})
+        
+        service = make_gemini_service(
+            ("validate_family_batch", "_generate_content", "_generate_with_prefix",
+             "_call_model", "_uses_cached_prefix", "family_guidance_prefix", "_get_family_info",
+             "_build_family_batch_suffix", "_build_family_validation_prompt",
+             "_format_family_control", "_resolve_batch", "_load_batch_json",
+             "_parse_batch_validation_items", "_validation_fallback"),
+            respond
+        )
+        service.prompts = prompts
+        service.batch_stats = BatchParseStats()
+        service.batch_tuner = None
+        service._family_prefixes = {}
+        
+        requirements = {
+            f"AC-{i}": {"control_id": f"AC-{i}", "title": f"Title AC-{i}", "statement": "Statement. " * 40,
+                        "guidance": "Guidance prose. " * 60, "enhancements": [], "family": "AC"}
+            for i in range(1, 6)
+        }
+        service.nist_service = Mock()
+        service.nist_service.get_controls_by_family = lambda family: [{"id": cid} for cid in requirements]
+        service.nist_service.get_control_requirements = lambda cid: requirements.get(cid, {})
+        service.nist_service.get_control_requirements_batch = lambda ids: {cid: requirements[cid] for cid in ids}
+        
+        service.backend = LocalPromptCacheBackend(service.model)
+        service.prompt_cache = PromptCacheService(service.backend, "gemini-test", min_tokens=min_tokens)
+        return service
+    
+    @pytest.mark.asyncio
+    async def test_family_guidance_uploaded_once_across_calls(self):
+        """Test every batch of a family references one uploaded guidance block."""
+        from app.services.token_estimator import estimate_tokens
+        service = self._service()
+        evidence = TestAdaptiveValidationPrompts._evidence()
+        
+        # Two batches of one session, then a later session with other evidence
+        await service.validate_family_batch("AC", ["AC-1", "AC-2"], evidence)
+        await service.validate_family_batch("AC", ["AC-3"], evidence)
+        await service.validate_family_batch("AC", ["AC-4", "AC-5"], [])
+        
+        assert list(service.backend.uploads.values()) == [1]
+        assert list(service.backend.references.values()) == [3]
+        stats = service.prompt_cache.stats()
+        assert stats["uploads"] == 1 and stats["reuses"] == 2
+        
+        # Only the per-call suffix is new input for each call
+        prefix = service.family_guidance_prefix("AC")
+        suffix = service._build_family_batch_suffix("AC", ["AC-1", "AC-2"], evidence)
+        assert estimate_tokens(suffix) * 5 < prefix.tokens
+        assert all(prompt.startswith(f"{prefix.instructions}\n\n{prefix.text}") for prompt in service.prompts)
+    
+    @pytest.mark.asyncio
+    async def test_small_prefix_keeps_inline_prompt(self):
+        """Test a prefix under the provider minimum is never uploaded."""
+        service = self._service(min_tokens=10 ** 6)
+        
+        await service.validate_family_batch("AC", ["AC-1"], [])
+        
+        assert service.backend.uploads == {}
+        assert "FAMILY CONTEXT" in service.prompts[0]
+    
+    @pytest.mark.asyncio
+    async def test_rejected_cache_falls_back_inline(self):
+        """Test a cached prefix that fails is dropped and the prompt sent whole."""
+        service = self._service()
+        await service.validate_family_batch("AC", ["AC-1"], [])
+        
+        failing = Mock()
+        failing.generate_content_async = AsyncMock(side_effect=RuntimeError("cache expired"))
+        service.backend.model_for = lambda handle: failing
+        service.prompt_cache._entries.clear()
+        service.backend.create = lambda model_name, prefix, ttl: "cachedContents/expired"
+        
+        await service.validate_family_batch("AC", ["AC-2"], [])
+        
+        assert service.prompt_cache.stats()["failures"] == 1
+        assert "AC-2" in service.prompts[-1] and "Guidance prose" in service.prompts[-1]
+    
+    @pytest.mark.asyncio
+    async def test_evicted_and_released_prefixes_deleted(self):
+        """Test cached content is deleted remotely on eviction, release and close, and upload locks are dropped."""
+        from app.services.prompt_cache import LocalPromptCacheBackend, PromptCacheService, PromptPrefix
+        backend = LocalPromptCacheBackend(Mock())
+        cache = PromptCacheService(backend, "gemini-test", min_tokens=0, max_entries=2)
+        prefixes = [PromptPrefix("family-guidance", family, "Instructions", f"{family} guidance") for family in ("AC", "AU", "IA")]
+        handles = [f"cachedContents/local-{prefix.key('gemini-test')[:16]}" for prefix in prefixes]
+        
+        for prefix in prefixes:
+            await cache.model_for(prefix)
+        await cache.model_for(prefixes[1], "gemini-pro")
+        
+        # AC then AU (gemini-test) fall out of the two-entry cache
+        assert backend.deleted == handles[:2]
+        assert cache._locks == {}
+        
+        # A released session prefix is deleted for every model it was uploaded for
+        await cache.release(prefixes[1])
+        assert backend.deleted[2:] == [f"cachedContents/local-{prefixes[1].key('gemini-pro')[:16]}"]
+        
+        await cache.close()
+        assert backend.deleted[3:] == [handles[2]]
+        assert backend.prefixes == {} and cache.stats()["deletions"] == 4
+
+
+class TestPromptCoalescing:
+    """Test identical concurrent prompts are sent once."""
+    
+    @pytest.mark.asyncio
+    async def test_identical_prompts_share_one_request(self):
+        """Test concurrent identical prompts coalesce and different prompts do not."""
+        import asyncio
+        sent = []
+        
+        async def respond(contents):
+            sent.append(contents)
+            await asyncio.sleep(0.01)
+            return f"analysis of {len(sent)}"
+        
+        service = make_gemini_service(("_generate_content", "_call_model"), respond)
+        image_part = [{"mime_type": "image/png", "data": b"\x89PNG"}, "Describe the diagram"]
+        
+        responses = await asyncio.gather(
+            service._generate_content("Analyze access-control-policy.pdf"),
+            service._generate_content("Analyze access-control-policy.pdf"),
+            service._generate_content(list(image_part)),
+            service._generate_content(list(image_part)),
+            service._generate_content("Analyze incident-response-plan.pdf")
+        )
+        
+        assert len(sent) == 3
+        assert responses[0] is responses[1] and responses[2] is responses[3]
+        assert service.single_flight.coalesced == 2
+        
+        # Once finished, the same prompt is sent again
+        await service._generate_content("Analyze access-control-policy.pdf")
+        assert len(sent) == 4
+
+
+class TestEvidenceImageUpload:
+    """Test images are sent with the MIME type of their preprocessed bytes."""
+    
+    @pytest.mark.asyncio
+    async def test_png_screenshot_not_labeled_jpeg(self):
+        """Test analyze_evidence uses the processor's MIME type."""
+        import io
+        from PIL import Image
+        from app.utils.document_processor import DocumentProcessor
+        sent = []
+        
+        def respond(parts):
+            sent.append(parts)
+            return "MFA is enforced for console access (IA-2)."
+        
+        service = make_gemini_service(
+            ("analyze_evidence", "_generate_content", "_call_model", "_extract_control_ids", "_extract_summary"),
+            respond,
+            long_document_threshold_tokens=30000
+        )
+        
+        img_bytes = io.BytesIO()
+        Image.new('RGB', (2400, 1200), color='white').save(img_bytes, format='PNG')
+        processed = DocumentProcessor.process_file(img_bytes.getvalue(), "mfa-console.png", "image/png")
+        processed["filename"] = "mfa-console.png"
+        
+        artifacts = await service.analyze_evidence([processed])
+        
+        image_part = sent[0][-1]
+        assert image_part["mime_type"] == "image/png"
+        assert Image.open(io.BytesIO(image_part["data"])).size == (1536, 768)
+        assert artifacts[0].controls_mentioned == ["IA-2"]
+
+
+class TestBatchFailureBisection:
+    """Test unresolved controls in a batch response are retried in smaller batches."""
+    
+    @staticmethod
+    def _service(respond):
+        import re
+        batches = []
+        
+        def record(prompt):
+            batch = re.findall(r"^(?:- )?([A-Z]{2}-\d+):", prompt, re.M)
+            batches.append(batch)
+            return respond(batch)
+        
+        service = make_gemini_service(
+            ("validate_family_batch", "_generate_content", "_call_model", "_get_family_info",
+             "_build_family_validation_prompt", "_format_family_control", "_resolve_batch",
+             "_load_batch_json", "_parse_batch_validation_items", "_validation_fallback",
+             "_batch_remediation", "_build_batch_remediation_prompt", "batch_size",
+             "_parse_batch_remediation_items", "_remediation_fallback",
+             "_generate_fallback_implementation_guide", "_generate_fallback_verification_steps"),
+            record,
+            batch_remediation_size=15
+        )
+        service.batches = batches
+        service.batch_stats = BatchParseStats()
+        service.batch_tuner = None
+        service.prompt_cache = None
+        service.nist_service = Mock()
+        service.nist_service.get_control_requirements_batch = lambda ids: {
+            cid: {"title": f"Title {cid}", "statement": "Statement"} for cid in ids
+        }
+        return service
+    
+    @pytest.mark.asyncio
+    async def test_only_missing_controls_are_retried(self):
+        """Test a response that drops or garbles entries is retried for those controls only."""
+        import json
+        
+        def respond(batch):
+            # AC-3 is dropped and AC-5 garbled whenever they share a batch with others
+            entries = [{"control_id": cid, "is_valid": True, "coverage_score": 0.9}
+                       for cid in batch if len(batch) == 1 or cid not in ("AC-3", "AC-5")]
+            if "AC-5" in batch and len(batch) > 1:
+                entries.append({"control_id": "AC-5", "is_valid": True, "coverage_score": "high"})
+            return json.dumps({"validations": entries})
+        
+        service = self._service(respond)
+        
+        results = await service.validate_family_batch("AC", ["AC-1", "AC-2", "AC-3", "AC-4", "AC-5"], [])
+        
+        assert service.batches == [["AC-1", "AC-2", "AC-3", "AC-4", "AC-5"], ["AC-3", "AC-5"], ["AC-3"], ["AC-5"]]
+        assert [r.control_id for r in results] == ["AC-1", "AC-2", "AC-3", "AC-4", "AC-5"]
+        assert all(r.is_valid for r in results)
+        assert service.batch_stats.failure_rate("validation", 5) == 1.0
+        assert service.batch_stats.failure_rate("validation", 1) == 0.0
+    
+    @pytest.mark.asyncio
+    async def test_unparseable_batch_is_bisected_to_single_gaps(self):
+        """Test a truncated response is split in halves down to single gaps."""
+        import json
+        
+        def respond(batch):
+            if len(batch) > 1:
+                return '{"tasks": [{"control_id": "AU-1", "action": "Enable'  # Truncated
+            return json.dumps({"tasks": [{"control_id": batch[0], "action": f"Fix {batch[0]}", "priority": "high"}]})
+        
+        service = self._service(respond)
+        gaps = [
+            ControlGap(control_id=f"AU-{i}", control_name="Audit", gap_description="Missing",
+                       risk_level=RiskLevel.MEDIUM, risk_score=50.0, affected_requirements=[], recommended_actions=[])
+            for i in range(1, 5)
+        ]
+        
+        tasks = await service._batch_remediation(gaps, [])
+        
+        assert service.batches[0] == ["AU-1", "AU-2", "AU-3", "AU-4"]
+        assert sorted(service.batches[1:]) == [["AU-1"], ["AU-1", "AU-2"], ["AU-2"], ["AU-3"], ["AU-3", "AU-4"], ["AU-4"]]
+        assert [t.description for t in tasks] == ["Fix AU-1", "Fix AU-2", "Fix AU-3", "Fix AU-4"]
+        snapshot = service.batch_stats.snapshot()["remediation"]
+        assert snapshot["retry_calls"] == 6
+        assert snapshot["by_batch_size"][2]["failure_rate"] == 1.0
+
+
+class TestBatchSizeAutotuning:
+    """Test batch calls feed the batch size tuner and use its sizes."""
+    
+    @staticmethod
+    def _service(tuner):
+        import json
+        import re
+        batches = []
+        
+        def respond(prompt):
+            batch = re.findall(r"^([A-Z]{2}-\d+):", prompt, re.M)
+            batches.append(batch)
+            response = FakeResponse(json.dumps({"validations": [
+                {"control_id": cid, "is_valid": True, "coverage_score": 0.9} for cid in batch
+            ]}))
+            response.usage_metadata = Mock(candidates_token_count=40 * len(batch))
+            response.candidates = [Mock(finish_reason=1)]
+            return response
+        
+        service = make_gemini_service(
+            ("validate_controls_batch", "_generate_content", "_call_model", "_resolve_batch",
+             "_response_usage", "batch_size", "_build_batch_validation_prompt", "_load_batch_json",
+             "_parse_batch_validation_items", "_validation_fallback",
+             "pack_family_batches", "group_by_family", "_format_family_control",
+             "_build_family_validation_prompt", "_get_family_info"),
+            respond,
+            batch_validation_size=10, batch_remediation_size=15, max_tokens_per_request=100000
+        )
+        service.batches = batches
+        service.batch_stats = BatchParseStats()
+        service.batch_tuner = tuner
+        service.nist_service = Mock()
+        service.nist_service.get_control_requirements_batch = lambda ids: {
+            cid: {"title": f"Title {cid}", "statement": "Statement"} for cid in ids
+        }
+        return service
+    
+    @pytest.mark.asyncio
+    async def test_batches_use_tuned_size_and_report_calls(self):
+        """Test batch validation slices by the tuned size and reports each call."""
+        tuner = BatchSizeTuner({"validation": 4}, min_size=2, max_size=20, window=10)
+        service = self._service(tuner)
+        
+        results = await service.validate_controls_batch([f"AC-{i}" for i in range(1, 10)], [])
+        
+        assert [len(batch) for batch in service.batches] == [4, 4, 1]
+        assert len(results) == 9
+        observations = tuner._observations["validation"]
+        assert [(obs.size, obs.resolved, obs.output_tokens) for obs in observations] == [(4, 4, 160), (4, 4, 160), (1, 1, 40)]
+    
+    def test_family_packing_capped_at_tuned_size(self):
+        """Test family batches hold at most the tuned validation size."""
+        service = self._service(BatchSizeTuner({"validation": 3}, min_size=2, max_size=20))
+        
+        batches = service.pack_family_batches([f"AC-{i}" for i in range(1, 8)] + ["AU-1"], [])
+        
+        assert [(family, len(batch)) for family, batch in batches] == [("AC", 3), ("AC", 3), ("AC", 1), ("AU", 1)]
+    
+    def test_static_size_when_autotune_off(self):
+        """Test the configured size is used when the tuner is disabled."""
+        service = self._service(None)
+        
+        assert service.batch_size("validation") == 10
+        assert service.batch_size("remediation") == 15
+
+
+class TestModelRouting:
+    """Test model calls are routed by stage and fall back across tiers."""
+    
+    @staticmethod
+    def _service(fail_fast=False):
+        service = make_gemini_service(("_generate_content", "_call_model"))
+        service.calls = []
+        
+        def client(name, fail=False):
+            async def generate(prompt):
+                service.calls.append(name)
+                if fail:
+                    raise RuntimeError("503 model overloaded")
+                return FakeResponse(f"{name} answer")
+            model = Mock()
+            model.generate_content_async = generate
+            return model
+        
+        service.router = ModelRouter(
+            {"fast": client("flash", fail=fail_fast), "standard": client("pro"), "reasoning": client("thinking")},
+            model_names={"fast": "flash", "standard": "pro", "reasoning": "thinking"},
+            routes={"batch_validation": "fast"},
+            risk_routes={"critical": "reasoning"},
+            fallback_order=["standard", "fast"]
+        )
+        return service
+    
+    @pytest.mark.asyncio
+    async def test_stages_and_risk_tiers_use_their_models(self):
+        """Test bulk batches go to the fast model and critical controls to the reasoning model."""
+        service = self._service()
+        
+        await service._generate_content("batch", stage="batch_validation")
+        await service._generate_content("control", stage="validation", risk="standard")
+        await service._generate_content("critical control", stage="validation", risk="critical")
+        
+        assert service.calls == ["flash", "pro", "thinking"]
+        stats = service.router.stats()
+        assert [stats[tier]["calls"] for tier in ("fast", "standard", "reasoning")] == [1, 1, 1]
+    
+    @pytest.mark.asyncio
+    async def test_failed_tier_falls_back_in_order(self):
+        """Test a failing fast model falls back to the standard model."""
+        service = self._service(fail_fast=True)
+        
+        response = await service._generate_content("batch", stage="batch_validation")
+        
+        assert response.text == "pro answer"
+        assert service.calls == ["flash", "pro"]
+        stats = service.router.stats()
+        assert (stats["fast"]["failures"], stats["fast"]["fallbacks"]) == (1, 1)
+        assert stats["standard"]["calls"] == 1 and stats["standard"]["output_tokens"] > 0
+
+
+class TestLongDocumentSummarization:
+    """Test long documents are summarized section by section before analysis."""
+    
+    @staticmethod
+    def _service(threshold, chunk_tokens):
+        import re
+        prompts = []
+        
+        def respond(parts):
+            prompt = parts if isinstance(parts, str) else "\n".join(parts)
+            prompts.append(prompt)
+            if prompt.startswith("You are a security compliance expert summarizing"):
+                section = re.search(r"section (\d+) of", prompt).group(1)
+                return f"Section {section} covers account reviews. " * 40
+            if prompt.startswith("Combine"):
+                return "Combined: accounts and audit logs are reviewed."
+            return "Policy summary of the whole document.\nCites AC-2 and AU-6."
+        
+        service = make_gemini_service(
+            ("analyze_evidence", "_summarize_long_document", "_generate_content", "_call_model",
+             "_extract_control_ids", "_extract_summary"),
+            respond,
+            long_document_threshold_tokens=threshold, summary_chunk_tokens=chunk_tokens, max_concurrent_batches=3
+        )
+        service.prompts = prompts
+        return service
+    
+    @staticmethod
+    def _document(sections):
+        return "\n\n".join(
+            f"{i} SECTION {i}\n" + f"Accounts are reviewed quarterly under {'AC-2' if i % 2 else 'AU-6'}. " * 60
+            for i in range(1, sections + 1)
+        )
+    
+    @pytest.mark.asyncio
+    async def test_long_document_map_reduce(self):
+        """Test sections are summarized, reduced, and indexed by control mention."""
+        from app.services.token_estimator import estimate_tokens
+        service = self._service(threshold=2000, chunk_tokens=1200)
+        text = self._document(12)
+        
+        artifacts = await service.analyze_evidence([{"filename": "ssp.pdf", "type": EvidenceType.PDF_DOCUMENT,
+                                                     "text": text, "metadata": {"num_pages": 300}}])
+        
+        map_prompts = [p for p in service.prompts if p.startswith("You are a security compliance expert summarizing")]
+        reduce_prompts = [p for p in service.prompts if p.startswith("Combine")]
+        final_prompt = service.prompts[-1]
+        assert len(map_prompts) == 12
+        assert all(estimate_tokens(p) < 1200 + 200 for p in map_prompts)
+        assert reduce_prompts
+        assert "Accounts are reviewed quarterly" not in final_prompt
+        assert estimate_tokens(final_prompt) < estimate_tokens(text) / 5
+        
+        metadata = artifacts[0].metadata
+        assert metadata["num_pages"] == 300
+        assert metadata["summary_sections"] == 12 and metadata["summary_levels"] >= 2
+        assert metadata["control_mention_index"]["AC-2"] == [1, 3, 5, 7, 9, 11]
+        assert metadata["control_mention_index"]["AU-6"] == [2, 4, 6, 8, 10, 12]
+        assert artifacts[0].controls_mentioned == ["AC-2", "AU-6"]
+    
+    @pytest.mark.asyncio
+    async def test_short_document_sent_whole(self):
+        """Test documents below the threshold keep the single-prompt path."""
+        service = self._service(threshold=30000, chunk_tokens=6000)
+        text = self._document(3)
+        
+        artifacts = await service.analyze_evidence([{"filename": "policy.docx", "type": EvidenceType.WORD_DOCUMENT,
+                                                     "text": text, "metadata": {}}])
+        
+        assert len(service.prompts) == 1
+        assert text in service.prompts[0]
+        assert "control_mention_index" not in artifacts[0].metadata
@@ -31,3 +31,109 @@ async def test_analyze_endpoint():
         files = {"file": ("dummy.txt", b"dummy content")}
         response = await ac.post("/api/analyze", files=files)
         assert response.status_code in (200, 422)
+
+
+def _oscal_result(session_id):
+    from app.models import AnalysisResult, ControlMapping, ControlGap, ControlFamily, RiskLevel
+    return AnalysisResult(
+        session_id=session_id,
+        evidence_artifacts=[],
+        control_mappings=[
+            ControlMapping(
+                control_id=f"AC-{i}",
+                control_name=f"Access Control {i}",
+                control_family=ControlFamily.AC,
+                evidence_ids=[],
+                implementation_status="implemented",
+                implementation_description="Implements access control",
+                confidence_score=0.9
+            )
+            for i in range(1, 51)
+        ],
+        control_gaps=[
+            ControlGap(
+                control_id="AU-2",
+                control_name="Event Logging",
+                gap_description="Audit events not defined",
+                risk_level=RiskLevel.HIGH,
+                risk_score=70,
+                affected_requirements=["AU-2a"],
+                recommended_actions=["Define auditable events"]
+            )
+        ],
+        oscal_components=[],
+        poam_entries=[],
+        remediation_tasks=[],
+        total_controls_analyzed=50,
+        implemented_controls=50,
+        gaps_identified=1,
+        critical_gaps=0,
+        overall_compliance_score=90.0
+    )
+
+
+@pytest.mark.asyncio
+async def test_download_oscal_etag_and_encoding():
+    import json
+    from app import main
+
+    session_id = "oscal-export-test"
+    main.analysis_results[session_id] = _oscal_result(session_id)
+    transport = ASGITransport(app=app)
+    try:
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            url = f"/api/results/{session_id}/oscal"
+            plain = await ac.get(url, headers={"Accept-Encoding": "identity"})
+            assert plain.status_code == 200
+            document = json.loads(plain.content)
+            requirements = document["system-security-plan"]["control-implementation"]["implemented-requirements"]
+            assert len(requirements) == 51
+            assert len(document["plan-of-action-and-milestones"]["poam-items"]) == 1
+            etag = plain.headers["etag"]
+
+            # Served from cache: same bytes, same ETag
+            again = await ac.get(url, headers={"Accept-Encoding": "identity"})
+            assert again.content == plain.content
+            assert again.headers["etag"] == etag
+
+            not_modified = await ac.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+            assert not_modified.status_code == 304
+            assert not_modified.content == b""
+
+            compressed = await ac.get(url, headers={"Accept-Encoding": "gzip"})
+            assert compressed.headers["content-encoding"] == "gzip"
+            assert compressed.headers["etag"] != etag
+            assert json.loads(compressed.content) == document  # httpx decodes gzip
+
+            refused = await ac.get(url, headers={"Accept-Encoding": "identity;q=0, *;q=0"})
+            assert refused.status_code == 406
+
+            # First download streamed compressed, with the same ETag a cached body gets
+            main.oscal_exports.invalidate(session_id)
+            streamed = await ac.get(url, headers={"Accept-Encoding": "gzip, identity;q=0"})
+            assert streamed.headers["content-encoding"] == "gzip"
+            assert streamed.headers["etag"] == compressed.headers["etag"]
+            assert json.loads(streamed.content) == document
+    finally:
+        main.analysis_results.pop(session_id, None)
+        main.oscal_exports.invalidate(session_id)
+
+
+def test_oscal_latency_saved_uses_this_run_and_never_negative():
+    from app.main import ProcessingMetrics
+    from app.utils.run_metrics import RunMetricsSink
+
+    metrics = ProcessingMetrics(session_id="latency-test")
+    run = RunMetricsSink()
+    metrics.record_oscal_latency_saved(run)
+    assert metrics.oscal_latency_saved_seconds is None  # No model call to compare with
+
+    run.add("model_tiers.standard.calls", 2)
+    run.add("model_tiers.standard.latency_seconds", 3.0)
+    metrics.oscal_generation_seconds = 0.5
+    metrics.record_oscal_latency_saved(run)
+    assert metrics.oscal_latency_saved_seconds == 1.0
+
+    metrics.oscal_generation_seconds = 4.0  # Enrichment slower than a round trip
+    metrics.record_oscal_latency_saved(run)
+    assert metrics.oscal_latency_saved_seconds == 0.0
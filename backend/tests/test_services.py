@@ -3,10 +3,18 @@ Test suite for D.A.V.E service layer modules.
 Tests baseline_service, nist_catalog_service, and oscal_validator.
 """
 
+import asyncio
+import json
+import sys
 import pytest
+from collections.abc import Mapping
 from app.services.baseline_service import BaselineService, BaselineLevel, BaselineProfile
 from app.services.nist_catalog_service import NISTCatalogService, NISTControl, ControlFamily
-from app.services.oscal_validator import OSCALValidatorService, OSCALDocumentType, ValidationResult
+from app.services.oscal_validator import (
+    OSCALValidatorService, OSCALValidatorPool, OSCALSchemaRegistry,
+    OSCALDocumentType, ValidationResult, oscal_document_hash
+)
+from app.services.pipeline_registry import PipelineRegistry
 
 
 class TestBaselineService:
@@ -86,6 +94,20 @@ class TestBaselineService:
         assert "AU" in grouped
         assert len(grouped["AC"]) == 2
         assert len(grouped["IA"]) == 1
+    
+    def test_estimate_from_catalog_text(self, baseline_service):
+        """Test token estimates follow each control's catalog text when it is given."""
+        short = {"title": "Short", "statement": "Do the thing.", "guidance": "", "enhancements": []}
+        long = {"title": "Long", "statement": "Do the thing. " * 200, "guidance": "Guidance. " * 300, "enhancements": []}
+        
+        average = baseline_service.estimate_processing(2, "deep")
+        catalog = baseline_service.estimate_processing(2, "deep", {"AC-1": short, "AC-2": long})
+        quick = baseline_service.estimate_processing(2, "quick", {"AC-1": short, "AC-2": long})
+        
+        assert average["token_estimate_basis"] == "average"
+        assert catalog["token_estimate_basis"] == "catalog"
+        assert catalog["estimated_tokens"] > quick["estimated_tokens"]
+        assert quick["estimated_tokens"] < 2 * 300  # Statements are truncated in batch prompts
 
 
 class TestNISTCatalogService:
@@ -151,10 +173,84 @@ class TestNISTCatalogService:
         """Test retrieving control requirements."""
         requirements = catalog_service.get_control_requirements("AC-2")
         
-        assert isinstance(requirements, dict)
+        assert isinstance(requirements, Mapping)
         assert "control_id" in requirements
         assert requirements["control_id"] == "AC-2"
     
+    def test_compact_records_back_pydantic_views(self, catalog_service):
+        """Test controls are held as slotted read-only records and API views are built from them."""
+        record = catalog_service.get_control_record("AC-2")
+        view = catalog_service.get_control("AC-2")
+        
+        assert not hasattr(record, "__dict__")
+        with pytest.raises(AttributeError):
+            record.title = "changed"
+        assert record.family is sys.intern("AC")
+        assert view.id == record.id and view.statement == record.statement
+        assert [e.id for e in view.enhancements] == [e.id for e in record.enhancements]
+        assert "groups" not in catalog_service._catalog_data["catalog"]  # Raw controls released
+    
+    def test_requirements_cache_bounded_and_read_only(self):
+        """Test the requirements cache evicts beyond its size, counts lookups and shares read-only values."""
+        service = NISTCatalogService(cache_size=2)
+        service.load_catalog()
+        
+        first = service.get_control_requirements("AC-2")
+        assert service.get_control_requirements("ac-2") is first
+        service.get_control_requirements("AC-3")
+        service.get_control_requirements("AC-4")
+        
+        stats = service.cache_stats()
+        assert stats["size"] == 2 and stats["maxsize"] == 2
+        assert stats["hits"] == 1 and stats["misses"] == 3 and stats["evictions"] == 1
+        with pytest.raises(TypeError):
+            first["title"] = "changed"
+        with pytest.raises((TypeError, AttributeError)):
+            first["related_controls"].append("XX-1")
+        if first["enhancements"]:
+            with pytest.raises(TypeError):
+                first["enhancements"][0]["statement"] = "changed"
+    
+    def test_mmap_snapshot_matches_parsed_catalog(self, catalog_service, tmp_path, monkeypatch):
+        """Test a service mapping the compiled snapshot serves the same controls, requirements and fragments."""
+        snapshot_path = tmp_path / "catalog.snapshot"
+        service = NISTCatalogService(snapshot_path=str(snapshot_path))
+        service.load_catalog()
+        compiled_at = snapshot_path.stat().st_mtime_ns
+        
+        for control_id in ("AC-1", "AC-2", "SC-7"):
+            assert service.get_control(control_id) == catalog_service.get_control(control_id)
+            mapped = dict(service.get_control_requirements(control_id))
+            parsed = dict(catalog_service.get_control_requirements(control_id))
+            mapped_fragments, parsed_fragments = mapped.pop("prompt_fragments"), parsed.pop("prompt_fragments")
+            assert mapped == parsed
+            for level, fragment in parsed_fragments.items():
+                assert mapped_fragments[level].text == fragment.text
+                assert mapped_fragments[level].tokens == fragment.tokens
+        assert service.get_all_control_ids() == catalog_service.get_all_control_ids()
+        
+        # Cached requirements read the snapshot instead of holding decoded text
+        from app.services.nist_catalog_service import RequirementsView
+        requirements = service.get_control_requirements("AC-2")
+        assert isinstance(requirements, RequirementsView)
+        assert requirements is service.get_control_requirements("ac-2")
+        with pytest.raises(TypeError):
+            requirements["title"] = "changed"
+        with pytest.raises(KeyError):
+            requirements["missing"]
+        
+        # Another worker maps the existing snapshot without recompiling it
+        worker = NISTCatalogService(snapshot_path=str(snapshot_path))
+        worker.load_catalog()
+        assert snapshot_path.stat().st_mtime_ns == compiled_at
+        assert worker.get_control("AC-2") == catalog_service.get_control("AC-2")
+        
+        # Changed fragment templates or token counting code recompile it
+        from app.services import catalog_snapshot
+        assert catalog_snapshot.snapshot_is_current(snapshot_path, service.catalog_path)
+        monkeypatch.setattr(catalog_snapshot, "fragment_fingerprint", lambda: b"\x00" * 16)
+        assert not catalog_snapshot.snapshot_is_current(snapshot_path, service.catalog_path)
+    
     def test_get_all_control_ids(self, catalog_service):
         """Test retrieving all control IDs."""
         control_ids = catalog_service.get_all_control_ids()
@@ -163,6 +259,34 @@ class TestNISTCatalogService:
         assert len(control_ids) > 300
         assert "AC-1" in control_ids
         assert "AC-2" in control_ids
+    
+    def test_prompt_fragments_precomputed(self, catalog_service):
+        """Test every control carries prompt text per verbosity level with its token count."""
+        from app.services.nist_catalog_service import PROMPT_FRAGMENT_LEVELS, build_prompt_fragments
+        from app.services.token_estimator import estimate_tokens
+        requirements = catalog_service.get_control_requirements("AC-2")
+        fragments = requirements["prompt_fragments"]
+        
+        assert tuple(fragments) == PROMPT_FRAGMENT_LEVELS
+        assert fragments["minimal"].text.startswith(f"AC-2: {requirements['title']}")
+        assert requirements["statement"] in fragments["full"].text
+        assert all(f.tokens == estimate_tokens(f.text) for f in fragments.values())
+        assert fragments["minimal"].tokens < fragments["full"].tokens
+        # Same text as rendering on demand
+        assert build_prompt_fragments(requirements) == dict(fragments)
+    
+    def test_fragment_tokens_follow_later_calibration(self, catalog_service, monkeypatch):
+        """Test fragment token counts apply calibration attached after the catalog loaded."""
+        from app.services import token_estimator
+        fragment = catalog_service.get_control_requirements("AC-2")["prompt_fragments"]["full"]
+        uncalibrated = fragment.tokens
+        
+        calibrated = token_estimator.TokenEstimator(min_samples=1)
+        calibrated.observe(fragment.text, 3 * uncalibrated)
+        monkeypatch.setattr(token_estimator, "_estimator", calibrated)
+        
+        assert fragment.tokens == calibrated.estimate(fragment.text)
+        assert fragment.tokens != uncalibrated
 
 
 class TestOSCALValidator:
@@ -268,6 +392,389 @@ class TestOSCALValidator:
         assert result.document_type == OSCALDocumentType.SSP
 
 
+# Trimmed OSCAL-style schema: draft-07, $id anchors and \p{L} patterns like the real ones
+MINI_SSP_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "$id": "http://csrc.nist.gov/ns/oscal/1.2.0/oscal-ssp-schema.json",
+    "definitions": {
+        "ssp": {
+            "$id": "#assembly_oscal-ssp_system-security-plan",
+            "type": "object",
+            "properties": {
+                "uuid": {"$ref": "#/definitions/UUIDDatatype"},
+                "metadata": {"type": "object"},
+                "components": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "type": {"type": "string", "pattern": "^(\\p{L}|_)(\\p{L}|\\p{N}|[.\\-_])*$"}
+                        }
+                    }
+                }
+            },
+            "required": ["uuid", "metadata"],
+            "additionalProperties": False
+        },
+        "UUIDDatatype": {
+            "type": "string",
+            "pattern": "^[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[45][0-9A-Fa-f]{3}-[89ABab][0-9A-Fa-f]{3}-[0-9A-Fa-f]{12}$"
+        }
+    },
+    "type": "object",
+    "properties": {"system-security-plan": {"$ref": "#assembly_oscal-ssp_system-security-plan"}},
+    "required": ["system-security-plan"]
+}
+
+
+class TestOSCALSchemaRegistry:
+    """Tests for in-process OSCAL JSON schema validation."""
+    
+    @pytest.fixture
+    def schema_dir(self, tmp_path):
+        (tmp_path / "oscal_ssp_schema.json").write_text(json.dumps(MINI_SSP_SCHEMA))
+        return tmp_path
+    
+    def test_validator_compiled_once(self, schema_dir):
+        """Test the compiled validator object is reused across documents."""
+        registry = OSCALSchemaRegistry(str(schema_dir))
+        
+        assert registry.get_validator(OSCALDocumentType.SSP) is registry.get_validator(OSCALDocumentType.SSP)
+        assert registry.get_validator(OSCALDocumentType.POAM) is None  # No schema file
+    
+    def test_reports_all_errors_in_one_pass(self, schema_dir):
+        """Test invalid UUIDs, unicode patterns and extra fields are all reported."""
+        registry = OSCALSchemaRegistry(str(schema_dir))
+        messages = registry.validate({
+            "system-security-plan": {
+                "uuid": "not-a-uuid",
+                "metadata": {},
+                "components": [{"type": "software"}, {"type": "1-invalid"}],
+                "unexpected": True
+            }
+        }, OSCALDocumentType.SSP)
+        
+        locations = {m.location for m in messages}
+        assert "$.system-security-plan.uuid" in locations
+        assert "$.system-security-plan.components[1].type" in locations
+        assert len(messages) == 3
+    
+    def test_service_uses_schema_without_cli(self, schema_dir):
+        """Test schema validation runs in-process when OSCAL-CLI is not installed."""
+        validator = OSCALValidatorService(cli_path="oscal-cli-not-installed", schema_dir=str(schema_dir))
+        
+        valid = validator.validate_with_schema({
+            "system-security-plan": {
+                "uuid": "12345678-1234-4234-8234-123456789012",
+                "metadata": {
+                    "title": "Test",
+                    "last-modified": "2026-02-05T00:00:00Z",
+                    "version": "1.0",
+                    "oscal-version": "1.2.0"
+                }
+            }
+        }, OSCALDocumentType.SSP)
+        invalid = validator.validate_with_schema({
+            "system-security-plan": {"uuid": "bad", "metadata": {}}
+        }, OSCALDocumentType.SSP)
+        
+        assert validator.oscal_cli_available is False
+        assert valid.is_valid is True and valid.schema_validated is True
+        assert invalid.is_valid is False
+    
+    def test_missing_schema_reported_unknown(self, schema_dir, tmp_path_factory):
+        """Test a document no schema could check is flagged, and its download reports unknown, not true."""
+        from app.services.oscal_export import oscal_valid_header
+        document = {
+            "system-security-plan": {
+                "uuid": "12345678-1234-4234-8234-123456789012",
+                "metadata": {"title": "Test", "last-modified": "2026-02-05T00:00:00Z",
+                             "version": "1.0", "oscal-version": "1.2.0"}
+            }
+        }
+        unchecked = OSCALValidatorService(
+            cli_path="oscal-cli-not-installed", schema_dir=str(tmp_path_factory.mktemp("no-schemas"))
+        ).validate_with_schema(document, OSCALDocumentType.SSP)
+        checked = OSCALValidatorService(
+            cli_path="oscal-cli-not-installed", schema_dir=str(schema_dir)
+        ).validate_with_schema(document, OSCALDocumentType.SSP)
+        
+        assert unchecked.is_valid is True and unchecked.schema_validated is False
+        assert unchecked.warning_count == 1 and "not schema-validated" in unchecked.messages[0].message
+        assert oscal_valid_header([unchecked]) == "unknown"
+        assert oscal_valid_header([checked]) == "true"
+        assert oscal_valid_header([checked, unchecked]) == "unknown"
+        assert oscal_valid_header([checked.model_copy(update={"is_valid": False}), unchecked]) == "false"
+
+
+
+class TestOSCALValidationCache:
+    """Tests for the validation result cache keyed by canonical document hash."""
+    
+    @staticmethod
+    def _ssp(ssp_uuid, component_uuid, timestamp, title="Test"):
+        return {
+            "system-security-plan": {
+                "uuid": ssp_uuid,
+                "metadata": {
+                    "title": title,
+                    "last-modified": timestamp,
+                    "version": "1.0",
+                    "oscal-version": "1.2.0"
+                },
+                "components": [{"uuid": component_uuid, "type": "software"}],
+                "by-components": [{"component-uuid": component_uuid}]
+            }
+        }
+    
+    def test_hash_ignores_volatile_fields(self):
+        """Test fresh uuid4 values and timestamps do not change the hash."""
+        first = self._ssp(
+            "11111111-1111-4111-8111-111111111111",
+            "22222222-2222-4222-8222-222222222222",
+            "2026-02-05T00:00:00Z"
+        )
+        second = self._ssp(
+            "33333333-3333-4333-8333-333333333333",
+            "44444444-4444-4444-8444-444444444444",
+            "2026-03-01T12:34:56.789012+00:00"
+        )
+        
+        assert oscal_document_hash(first, OSCALDocumentType.SSP) == oscal_document_hash(second, OSCALDocumentType.SSP)
+        assert oscal_document_hash(first, OSCALDocumentType.SSP) != oscal_document_hash(first, OSCALDocumentType.POAM)
+    
+    def test_hash_keeps_structure_and_invalid_values(self):
+        """Test content changes, broken references and malformed values change the hash."""
+        ssp_uuid = "11111111-1111-4111-8111-111111111111"
+        component_uuid = "22222222-2222-4222-8222-222222222222"
+        base = self._ssp(ssp_uuid, component_uuid, "2026-02-05T00:00:00Z")
+        retitled = self._ssp(ssp_uuid, component_uuid, "2026-02-05T00:00:00Z", title="Other")
+        broken_reference = self._ssp(ssp_uuid, component_uuid, "2026-02-05T00:00:00Z")
+        broken_reference["system-security-plan"]["by-components"][0]["component-uuid"] = ssp_uuid
+        naive_timestamp = self._ssp(ssp_uuid, component_uuid, "2026-02-05T00:00:00")
+        
+        base_hash = oscal_document_hash(base, OSCALDocumentType.SSP)
+        assert oscal_document_hash(retitled, OSCALDocumentType.SSP) != base_hash
+        assert oscal_document_hash(broken_reference, OSCALDocumentType.SSP) != base_hash
+        assert oscal_document_hash(naive_timestamp, OSCALDocumentType.SSP) != base_hash
+    
+    @pytest.mark.asyncio
+    async def test_repeated_documents_skip_validation(self, monkeypatch):
+        """Test an unchanged document with new uuids/timestamps is served from cache."""
+        validator = OSCALValidatorService(cli_path="oscal-cli-not-installed")
+        calls = []
+        original = validator._validate_with_json_schema
+        
+        def counting(document, document_type):
+            calls.append(document_type)
+            return original(document, document_type)
+        
+        monkeypatch.setattr(validator, "_validate_with_json_schema", counting)
+        
+        first = await validator.validate_ssp(self._ssp(
+            "11111111-1111-4111-8111-111111111111",
+            "22222222-2222-4222-8222-222222222222",
+            "2026-02-05T00:00:00Z"
+        ))
+        first.messages.clear()  # Callers mutating a result must not corrupt the cache
+        second = await validator.validate_ssp(self._ssp(
+            "33333333-3333-4333-8333-333333333333",
+            "44444444-4444-4444-8444-444444444444",
+            "2026-02-06T00:00:00Z"
+        ))
+        
+        assert len(calls) == 1
+        assert second.messages
+        assert validator.cache_stats()["hits"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_out_of_range_timestamp_not_served_from_cache(self, monkeypatch):
+        """Test a timestamp OSCAL's date-time pattern rejects is validated, not matched to a valid document."""
+        validator = OSCALValidatorService(cli_path="oscal-cli-not-installed")
+        calls = []
+        original = validator._validate_with_json_schema
+        
+        def counting(document, document_type):
+            calls.append(document["system-security-plan"]["metadata"]["last-modified"])
+            return original(document, document_type)
+        
+        monkeypatch.setattr(validator, "_validate_with_json_schema", counting)
+        uuids = ("11111111-1111-4111-8111-111111111111", "22222222-2222-4222-8222-222222222222")
+        
+        await validator.validate_ssp(self._ssp(*uuids, "2026-02-05T00:00:00Z"))
+        for timestamp in ("2024-13-45T99:99:99Z", "2023-02-29T00:00:00Z", "2026-02-05T00:00:00+05:17"):
+            await validator.validate_ssp(self._ssp(*uuids, timestamp))
+        await validator.validate_ssp(self._ssp(*uuids, "2024-02-29T23:59:59.5-03:30"))
+        
+        assert calls == ["2026-02-05T00:00:00Z", "2024-13-45T99:99:99Z", "2023-02-29T00:00:00Z", "2026-02-05T00:00:00+05:17"]
+        assert validator.cache_stats()["hits"] == 1
+    
+    def test_cache_is_bounded(self):
+        """Test least recently used results are evicted beyond the cache size."""
+        validator = OSCALValidatorService(cli_path="oscal-cli-not-installed", cache_size=2)
+        
+        for title in ("A", "B", "C"):
+            validator.validate_with_schema(
+                self._ssp("11111111-1111-4111-8111-111111111111",
+                          "22222222-2222-4222-8222-222222222222",
+                          "2026-02-05T00:00:00Z", title=title),
+                OSCALDocumentType.SSP
+            )
+        
+        stats = validator.cache_stats()
+        assert stats["size"] == 2
+        assert stats["evictions"] == 1
+
+
+# Stub standing in for a warm OSCAL-CLI validator worker (JSON lines over stdio)
+STUB_VALIDATOR_WORKER = """
+import json, os, sys, time
+barrier = sys.argv[1] if len(sys.argv) > 1 else None
+for line in sys.stdin:
+    request = json.loads(line)
+    peers = 1
+    if barrier:
+        # Hold each request until two workers are serving one at the same time
+        open(os.path.join(barrier, str(os.getpid())), "w").close()
+        deadline = time.time() + 5
+        while len(os.listdir(barrier)) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        peers = len(os.listdir(barrier))
+    root = next(iter(request["document"].values()))
+    errors = [] if "uuid" in root else ["missing uuid"]
+    print(json.dumps({"id": request["id"], "valid": not errors, "errors": errors,
+                      "warnings": [], "pid": os.getpid(), "peers": peers}), flush=True)
+"""
+
+
+class TestOSCALValidatorPool:
+    """Tests for pooled validation against warm validator workers."""
+    
+    @pytest.fixture
+    def worker_command(self, tmp_path):
+        script = tmp_path / "stub_validator.py"
+        script.write_text(STUB_VALIDATOR_WORKER)
+        return f"{sys.executable} {script}"
+    
+    @pytest.mark.asyncio
+    async def test_pool_reuses_warm_worker(self, worker_command):
+        """Test consecutive validations are served by the same long-lived process."""
+        pool = OSCALValidatorPool(worker_command, size=1, timeout=10)
+        try:
+            first = await pool.validate("ssp", {"system-security-plan": {"uuid": "a"}})
+            second = await pool.validate("ssp", {"system-security-plan": {}})
+        finally:
+            await pool.close()
+        
+        assert first["valid"] is True
+        assert second["valid"] is False
+        assert first["pid"] == second["pid"]
+    
+    @pytest.mark.asyncio
+    async def test_pool_validates_concurrently(self, worker_command, tmp_path):
+        """Test concurrent validations are in flight on both workers at once."""
+        barrier = tmp_path / "in-flight"
+        barrier.mkdir()
+        pool = OSCALValidatorPool(f"{worker_command} {barrier}", size=2, timeout=10)
+        doc = {"system-security-plan": {"uuid": "a"}}
+        try:
+            results = await asyncio.gather(*[pool.validate("ssp", doc) for _ in range(6)])
+        finally:
+            await pool.close()
+        
+        assert all(r["valid"] for r in results)
+        assert len({r["pid"] for r in results}) == 2
+        # A worker only answers once the other has a request in flight too
+        assert all(r["peers"] == 2 for r in results)
+    
+    @pytest.mark.asyncio
+    async def test_killed_worker_is_reaped(self):
+        """Test a worker killed after a timeout is waited for, leaving no zombie."""
+        pool = OSCALValidatorPool(f"{sys.executable} -c 'import time; time.sleep(60)'", size=1, timeout=0.2)
+        worker = pool._workers[0]
+        started = []
+        start = worker.start
+        
+        async def tracked_start():
+            await start()
+            started.append(worker.process)
+        
+        worker.start = tracked_start
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.validate("ssp", {"system-security-plan": {"uuid": "a"}})
+        
+        assert worker.process is None
+        assert started[0].returncode is not None
+    
+    @pytest.mark.asyncio
+    async def test_service_reports_worker_errors(self, worker_command):
+        """Test worker errors surface as validation errors."""
+        pool = OSCALValidatorPool(worker_command, size=1, timeout=10)
+        validator = OSCALValidatorService(pool=pool)
+        try:
+            result = await validator.validate_ssp({
+                "system-security-plan": {"metadata": {"title": "Test SSP"}}
+            })
+        finally:
+            await validator.close()
+        
+        assert result.is_valid is False
+        assert any("missing uuid" in m.message for m in result.messages)
+    
+    @pytest.mark.asyncio
+    async def test_bundled_schema_worker(self, tmp_path, monkeypatch):
+        """Test the shipped worker speaks the pool protocol and never reports an unchecked type as valid."""
+        from pathlib import Path
+        (tmp_path / "oscal_ssp_schema.json").write_text(json.dumps(MINI_SSP_SCHEMA))
+        monkeypatch.chdir(Path(__file__).parent.parent)  # backend/, so -m finds the app package
+        pool = OSCALValidatorPool(
+            f"{sys.executable} -m app.services.oscal_validator --worker --schema-dir {tmp_path}", size=1, timeout=30
+        )
+        validator = OSCALValidatorService(pool=pool)
+        metadata = {"title": "Test", "last-modified": "2026-02-05T00:00:00Z", "version": "1.0", "oscal-version": "1.2.0"}
+        try:
+            valid = await validator.validate_ssp({
+                "system-security-plan": {"uuid": "12345678-1234-4234-8234-123456789012", "metadata": metadata}
+            })
+            invalid = await validator.validate_ssp({"system-security-plan": {"uuid": "bad", "metadata": metadata}})
+            unchecked = await validator.validate_poam({
+                "plan-of-action-and-milestones": {"uuid": "12345678-1234-4234-8234-123456789012", "metadata": metadata}
+            })
+        finally:
+            await validator.close()
+        
+        assert valid.is_valid is True and valid.schema_validated is True
+        assert invalid.is_valid is False
+        assert any(m.message.startswith("$.system-security-plan.uuid") for m in invalid.messages)
+        assert unchecked.schema_validated is False
+        assert any("No OSCAL JSON schema for poam" in m.message for m in unchecked.messages)
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_cli_validation_kills_process(self, tmp_path, monkeypatch):
+        """Test cancelling a one-shot oscal-cli validation stops and reaps the child process."""
+        script = tmp_path / "oscal-cli"
+        script.write_text("#!/bin/sh\nsleep 60\n")
+        script.chmod(0o755)
+        validator = OSCALValidatorService(cli_path="oscal-cli-not-installed")
+        validator.cli_path, validator.oscal_cli_available = str(script), True
+        processes = []
+        create = asyncio.create_subprocess_exec
+        
+        async def tracked(*args, **kwargs):
+            processes.append(await create(*args, **kwargs))
+            return processes[-1]
+        
+        monkeypatch.setattr(asyncio, "create_subprocess_exec", tracked)
+        task = asyncio.ensure_future(validator.validate_ssp({"system-security-plan": {"uuid": "a"}}))
+        while not processes:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        
+        assert processes[0].returncode is not None
+
+
 class TestServiceIntegration:
     """Integration tests across services."""
     
@@ -320,3 +827,601 @@ class TestServiceIntegration:
         # Verify AC family has many controls
         assert "AC" in grouped
         assert len(grouped["AC"]) >= 10
+
+
+class TestPipelineRegistry:
+    """Tests for cooperative cancellation of in-flight assessments."""
+    
+    @pytest.mark.asyncio
+    async def test_cancel_propagates_into_pending_await(self):
+        """Test cancelling a session interrupts the pipeline at its pending call."""
+        registry = PipelineRegistry()
+        reached_cleanup = asyncio.Event()
+        
+        async def pipeline():
+            try:
+                await asyncio.sleep(3600)  # Stands in for a pending Gemini batch call
+            except asyncio.CancelledError:
+                reached_cleanup.set()
+                raise
+        
+        task = asyncio.create_task(pipeline())
+        handle = registry.register("session-1", task)
+        await asyncio.sleep(0)
+        
+        assert registry.is_running("session-1")
+        assert registry.cancel("session-1") is True
+        
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        
+        assert reached_cleanup.is_set()
+        assert handle.cancel_event.is_set()  # Worker threads see the cancellation too
+        assert registry.get("session-1") is None
+        assert registry.active_count() == 0
+    
+    @pytest.mark.asyncio
+    async def test_finished_pipeline_is_unregistered(self):
+        """Test completed pipelines drop out of the registry and cannot be cancelled."""
+        registry = PipelineRegistry()
+        
+        async def pipeline():
+            return "done"
+        
+        task = asyncio.create_task(pipeline())
+        registry.register("session-2", task)
+        await task
+        await asyncio.sleep(0)  # Let done callbacks run
+        
+        assert registry.get("session-2") is None
+        assert registry.cancel("session-2") is False
+
+
+class TestOSCALExport:
+    """Tests for content negotiation helpers of the OSCAL export."""
+    
+    def test_negotiate_encoding(self):
+        """Test Accept-Encoding q-values and wildcards are honoured."""
+        from app.services.oscal_export import negotiate_encoding, supported_encodings
+        
+        assert negotiate_encoding(None) == "identity"
+        assert negotiate_encoding("gzip;q=0, identity") == "identity"
+        assert negotiate_encoding("deflate, gzip") in supported_encodings()
+        assert negotiate_encoding("*") == supported_encodings()[0]
+        assert negotiate_encoding("br;q=0, gzip;q=0.5") == "gzip"
+        assert negotiate_encoding("gzip;q=0, *;q=0, identity") == "identity"
+        assert negotiate_encoding("gzip, identity;q=0") == "gzip"
+        assert negotiate_encoding("identity;q=0") is None
+        assert negotiate_encoding("*;q=0") is None
+    
+    def test_stream_chunks_and_caches_completed_body(self):
+        """Test streamed compression round-trips and only a finished pass is cached."""
+        import gzip
+        import json
+        from datetime import datetime
+        from app.models import AnalysisResult
+        from app.services import oscal_export
+        
+        result = AnalysisResult(
+            session_id="stream-test", created_at=datetime(2024, 1, 1), evidence_artifacts=[],
+            control_mappings=[], control_gaps=[], oscal_components=[], poam_entries=[],
+            remediation_tasks=[], total_controls_analyzed=0, implemented_controls=0,
+            gaps_identified=0, critical_gaps=0, overall_compliance_score=0.0
+        )
+        artifacts = oscal_export.build_export_artifacts(result)
+        artifacts.ssp = {"system-security-plan": {"notes": ["x" * 100] * 2000}}
+        export = oscal_export.OSCALExport(
+            result=result, digest=oscal_export.export_fingerprint(result), headers={}, artifacts=artifacts
+        )
+        
+        partial = export.stream("gzip")
+        next(partial)
+        partial.close()  # Client disconnected
+        assert export.cached_body("identity") is None
+        
+        chunks = list(export.stream("gzip"))
+        assert len(chunks) > 1
+        body = gzip.decompress(b"".join(chunks))
+        assert json.loads(body) == artifacts.ssp
+        assert export.cached_body("identity") == body
+        assert export.cached_body("gzip") == b"".join(chunks)
+        assert export.artifacts is None
+        assert b"".join(export.stream("identity")) == body
+    
+    def test_etag_matches(self):
+        """Test If-None-Match lists, weak validators and wildcard."""
+        from app.services.oscal_export import etag_matches
+        
+        assert etag_matches('"abc"', '"abc"')
+        assert etag_matches('"x", W/"abc"', '"abc"')
+        assert etag_matches('*', '"abc"')
+        assert not etag_matches('"abc-gzip"', '"abc"')
+        assert not etag_matches(None, '"abc"')
+
+
+class TestOSCALBuilder:
+    """Tests for the deterministic OSCAL SSP/POA&M builder."""
+    
+    @pytest.fixture
+    def inputs(self):
+        from app.models import ControlMapping, ControlGap, ControlFamily, EvidenceArtifact, EvidenceType, RiskLevel
+        artifacts = [EvidenceArtifact(
+            id="ev-1", filename="policy.pdf", file_type=EvidenceType.PDF_DOCUMENT,
+            content_summary="Access control policy", confidence_score=0.9
+        )]
+        mappings = [
+            ControlMapping(
+                control_id=control_id, control_name=f"Control {control_id}",
+                control_family=ControlFamily.AC, evidence_ids=["ev-1"],
+                implementation_status=status, implementation_description=f"{control_id} is in place",
+                confidence_score=0.8
+            )
+            for control_id, status in [(f"AC-{i}", "implemented") for i in range(1, 9)]
+            + [("AC-2(1)", "partially_implemented"), ("AC-2", "planned")]
+        ]
+        gaps = [
+            ControlGap(
+                control_id=control_id, control_name=f"Control {control_id}",
+                gap_description=f"{control_id} missing", risk_level=RiskLevel.CRITICAL,
+                risk_score=90, affected_requirements=[], recommended_actions=["Fix it"]
+            )
+            for control_id in ("AC-2(1)", "SC-7")
+        ]
+        return mappings, gaps, artifacts
+    
+    def test_emits_every_mapping_and_gap(self, inputs):
+        """Test all mappings become by-components and all gaps become POA&M items."""
+        from app.services.oscal_builder import OSCALBuilder
+        mappings, gaps, artifacts = inputs
+        
+        built = OSCALBuilder("session-1").build(mappings, gaps, artifacts)
+        ssp = built.ssp["system-security-plan"]
+        requirements = {
+            r["control-id"]: r for r in ssp["control-implementation"]["implemented-requirements"]
+        }
+        
+        assert len(built.components) == 10
+        assert len(ssp["system-implementation"]["components"]) == 11  # + this-system
+        assert len(requirements) == 10  # AC-1..8, AC-2(1), SC-7; AC-2 mapped twice
+        assert len(requirements["ac-2"]["by-components"]) == 2
+        assert requirements["ac-2.1"]["by-components"][0]["implementation-status"]["state"] == "partial"
+        assert requirements["sc-7"]["by-components"][0]["implementation-status"]["state"] == "planned"
+        assert requirements["ac-1"]["by-components"][0]["links"][0]["href"] == f"#{ssp['back-matter']['resources'][0]['uuid']}"
+        
+        poam = built.poam["plan-of-action-and-milestones"]
+        risk_ids = {risk["uuid"] for risk in poam["risks"]}
+        assert len(poam["poam-items"]) == 2
+        assert all(item["related-risks"][0]["risk-uuid"] in risk_ids for item in poam["poam-items"])
+    
+    def test_build_is_deterministic(self, inputs):
+        """Test the same session and inputs produce byte-identical documents."""
+        from datetime import datetime
+        from app.services.oscal_builder import OSCALBuilder
+        mappings, gaps, artifacts = inputs
+        generated_at = datetime(2026, 2, 5, 12, 0, 0)
+        
+        first = OSCALBuilder("session-1", generated_at).build(mappings, gaps, artifacts)
+        second = OSCALBuilder("session-1", generated_at).build(mappings, gaps, artifacts)
+        other = OSCALBuilder("session-2", generated_at).build(mappings, gaps, artifacts)
+        
+        assert json.dumps(first.ssp) == json.dumps(second.ssp)
+        assert json.dumps(first.poam) == json.dumps(second.poam)
+        assert first.ssp["system-security-plan"]["uuid"] != other.ssp["system-security-plan"]["uuid"]
+        assert first.poam_entries[0].milestones[0]["target_date"] == "2026-02-12"
+    
+    def test_empty_documents_omitted(self, inputs):
+        """Test documents OSCAL would reject as empty are not generated, exported or validated."""
+        from app.services.oscal_builder import NIST_PROFILE_HREF, OSCALBuilder
+        from app.services.oscal_export import iter_oscal_json, oscal_valid_header
+        mappings, _, artifacts = inputs
+        
+        empty = OSCALBuilder("session-1").build([], [], artifacts)
+        no_gaps = OSCALBuilder("session-1").build(mappings, [], artifacts)
+        
+        assert empty.ssp == {} and empty.poam == {} and empty.documents() == []
+        assert "".join(iter_oscal_json(empty)) == "{}"
+        assert oscal_valid_header([]) == "unknown"
+        assert [name for name, _ in no_gaps.documents()] == ["ssp"]
+        ssp = no_gaps.ssp["system-security-plan"]
+        assert ssp["control-implementation"]["implemented-requirements"]
+        assert ssp["import-profile"]["href"] == NIST_PROFILE_HREF
+    
+    @pytest.mark.skipif(
+        bool(OSCALSchemaRegistry().missing_schemas()),
+        reason="Official OSCAL 1.2.0 schemas not installed (python -m app.services.oscal_validator --fetch-schemas)"
+    )
+    def test_documents_pass_official_schemas(self, inputs):
+        """Test generated SSP and POA&M validate against the official OSCAL 1.2.0 JSON schemas."""
+        from app.services.oscal_builder import OSCALBuilder
+        built = OSCALBuilder("session-1").build(*inputs)
+        registry = OSCALSchemaRegistry()
+        
+        assert registry.validate(built.ssp, OSCALDocumentType.SSP) == []
+        assert registry.validate(built.poam, OSCALDocumentType.POAM) == []
+    
+    def test_oscal_control_id(self):
+        """Test NIST control IDs are converted to OSCAL control-id tokens."""
+        from app.services.oscal_builder import oscal_control_id
+        
+        assert oscal_control_id("AC-2") == "ac-2"
+        assert oscal_control_id("AC-2(12)") == "ac-2.12"
+        assert oscal_control_id("SI-04") == "si-4"
+
+
+class TestSingleFlight:
+    """Test coalescing of identical concurrent calls."""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_share_one_call(self):
+        """Test callers with the same key await one call and get its result."""
+        from app.utils.single_flight import SingleFlight
+        flight = SingleFlight()
+        started = []
+        release = asyncio.Event()
+        
+        async def call(value):
+            started.append(value)
+            await release.wait()
+            return value
+        
+        waiters = [asyncio.create_task(flight.do("same", lambda: call("first"))) for _ in range(3)]
+        other = asyncio.create_task(flight.do("other", lambda: call("second")))
+        await asyncio.sleep(0)
+        release.set()
+        
+        assert await asyncio.gather(*waiters) == ["first"] * 3
+        assert await other == "second"
+        assert started == ["first", "second"]
+        assert flight.stats() == {"calls": 2, "coalesced": 2, "in_flight": 0}
+    
+    @pytest.mark.asyncio
+    async def test_shared_call_cancelled_only_with_last_waiter(self):
+        """Test one cancelled caller leaves the shared call running for the others."""
+        from app.utils.single_flight import SingleFlight
+        flight = SingleFlight()
+        release = asyncio.Event()
+        
+        async def call():
+            await release.wait()
+            return "done"
+        
+        first = asyncio.create_task(flight.do("key", call))
+        second = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == "done"
+        
+        release.clear()
+        lone = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        shared = flight._flights["key"].task
+        lone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lone
+        await asyncio.sleep(0)
+        assert shared.cancelled()
+
+
+class TestRunMetrics:
+    """Tests for per-run attribution of shared service counters."""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_runs_counted_separately(self):
+        """Test two runs sharing a cache, single-flight and router only see their own work."""
+        from app.services.model_router import ModelRouter
+        from app.utils import run_metrics
+        from app.utils.bounded_cache import BoundedLRUCache
+        from app.utils.single_flight import SingleFlight
+        cache = BoundedLRUCache(3, metrics_name="requirements_cache")
+        flight = SingleFlight()
+        router = ModelRouter({"standard": object()})
+        release = asyncio.Event()
+        
+        async def shared_call():
+            router.record("standard", 0.5, "prompt", type("Response", (), {"text": "ok"})())
+            await release.wait()
+            return "ok"
+        
+        async def run(lookups, sink):
+            token = run_metrics.bind(sink)
+            try:
+                for key in lookups:
+                    if cache.get(key) is None:
+                        await asyncio.to_thread(cache.put, key, key)  # Threads inherit the sink
+                return await flight.do("prompt", shared_call)
+            finally:
+                run_metrics.unbind(token)
+        
+        first, second = run_metrics.RunMetricsSink(), run_metrics.RunMetricsSink()
+        tasks = [
+            asyncio.create_task(run(["AC-1", "AC-1"], first)),
+            asyncio.create_task(run(["AC-2", "AC-3", "AC-2"], second))
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(*tasks)
+        
+        assert first.counters("requirements_cache") == {"misses": 1, "hits": 1}
+        assert second.counters("requirements_cache") == {"misses": 2, "hits": 1}
+        # The first run made the call; the second was coalesced onto it
+        assert first.count("model_tiers.standard.calls") == 1 and first.count("coalesced_calls") == 0
+        assert second.count("model_tiers.standard.calls") == 0 and second.count("coalesced_calls") == 1
+        assert cache.stats()["hits"] == 2 and router.stats()["standard"]["calls"] == 1
+        
+        # Nothing is recorded outside a run; evictions go to the run that caused them
+        cache.get("AC-9")
+        assert first.count("requirements_cache.misses") == 1 and second.count("requirements_cache.misses") == 2
+        third = run_metrics.RunMetricsSink()
+        token = run_metrics.bind(third)
+        cache.put("AC-4", "AC-4")
+        run_metrics.unbind(token)
+        assert third.counters("requirements_cache") == {"evictions": 1}
+
+
+class TestBatchSizeTuner:
+    """Test online batch size tuning from measured batch calls."""
+    
+    def test_size_grows_while_throughput_rises(self):
+        """Test the size keeps climbing while controls per second improve."""
+        from app.services.batch_tuning import BatchSizeTuner
+        tuner = BatchSizeTuner({"validation": 10}, min_size=3, max_size=30, window=1)
+        
+        tuner.observe("validation", 10, 10, seconds=5.0)
+        tuner.observe("validation", 12, 12, seconds=5.0)
+        
+        assert tuner.size("validation") == 14
+        assert [(d["from"], d["to"]) for d in tuner.decisions] == [(10, 12), (12, 14)]
+    
+    def test_direction_reverses_when_throughput_falls(self):
+        """Test the size turns around once a larger batch is slower per control."""
+        from app.services.batch_tuning import BatchSizeTuner
+        tuner = BatchSizeTuner({"validation": 10}, window=1)
+        
+        tuner.observe("validation", 10, 10, seconds=5.0)
+        tuner.observe("validation", 12, 12, seconds=12.0)
+        
+        assert tuner.size("validation") == 10
+        assert tuner.decisions[-1]["reason"] == "throughput fell"
+    
+    def test_recent_decisions_bounded(self):
+        """Test the process-wide tuner keeps only the most recent decisions."""
+        from app.services.batch_tuning import MAX_RECENT_DECISIONS, BatchSizeTuner
+        tuner = BatchSizeTuner({"validation": 10}, window=1)
+        
+        for i in range(3 * MAX_RECENT_DECISIONS):
+            size = tuner.size("validation")
+            tuner.observe("validation", size, size, seconds=1.0 + 2 * (i % 2))
+        
+        assert len(tuner.decisions) == MAX_RECENT_DECISIONS
+    
+    def test_failures_and_truncation_shrink_size(self):
+        """Test parse failures or truncated responses cut the size multiplicatively."""
+        from app.services.batch_tuning import BatchSizeTuner
+        tuner = BatchSizeTuner({"validation": 20, "remediation": 20}, window=2)
+        
+        tuner.observe("validation", 20, 12, seconds=5.0)
+        tuner.observe("validation", 20, 20, seconds=5.0)
+        tuner.observe("remediation", 20, 20, seconds=5.0, truncated=True)
+        tuner.observe("remediation", 20, 20, seconds=5.0)
+        
+        assert tuner.size("validation") == 14
+        assert tuner.size("remediation") == 14
+        assert tuner.decisions[-1]["reason"] == "truncated response"
+    
+    def test_bounds_and_output_token_ceiling(self):
+        """Test sizes stay within bounds and below the output token limit."""
+        from app.services.batch_tuning import BatchSizeTuner
+        tuner = BatchSizeTuner({"validation": 50, "remediation": 20}, min_size=3, max_size=30,
+                               max_output_tokens=1000, window=1)
+        assert tuner.size("validation") == 30
+        
+        # 100 output tokens per control: at most 8 fit in 80% of 1000
+        tuner.observe("remediation", 20, 20, seconds=1.0, output_tokens=2000)
+        assert tuner.size("remediation") == 8
+        
+        for _ in range(10):
+            tuner.observe("validation", 3, 0, seconds=1.0)
+        assert tuner.size("validation") == 3
+
+
+class TestModelRouter:
+    """Test stage and risk-tier model routing."""
+    
+    def _router(self, **kwargs):
+        from app.services.model_router import ModelRouter
+        fast, standard = object(), object()
+        return ModelRouter(
+            {"fast": fast, "standard": standard},
+            model_names={"fast": "flash", "standard": "pro"},
+            routes={"batch_validation": "fast", "validation": "standard"},
+            risk_routes={"critical": "reasoning"},
+            **kwargs
+        )
+    
+    def test_stage_and_risk_routes(self):
+        """Test stages map to tiers and a routed risk tier overrides the stage."""
+        from app.models import RiskLevel
+        router = self._router()
+        
+        assert router.tier_for("batch_validation") == "fast"
+        assert router.tier_for("validation", "standard") == "standard"
+        assert router.tier_for("validation", "critical") == "reasoning"
+        assert router.tier_for("deep_remediation", RiskLevel.CRITICAL) == "reasoning"
+        assert router.tier_for("unknown-stage") == "standard"
+        # The reasoning tier has no client of its own here
+        assert router.model("reasoning") is router.model("standard")
+        assert router.model_name("reasoning") == "pro"
+    
+    def test_fallback_candidates_skip_shared_clients(self):
+        """Test fallbacks follow the configured order without repeating a client."""
+        router = self._router(fallback_order=["standard", "fast", "reasoning"])
+        
+        assert router.candidates("batch_validation") == ["fast", "standard"]
+        assert router.candidates("validation", "critical") == ["reasoning", "fast"]
+    
+    def test_usage_and_cost_per_tier(self):
+        """Test usage metadata is billed at the tier's rates (cached tokens excluded)."""
+        from types import SimpleNamespace
+        router = self._router(costs={"fast": [1.0, 4.0]})
+        response = SimpleNamespace(
+            text="ok",
+            usage_metadata=SimpleNamespace(prompt_token_count=3000, candidates_token_count=500,
+                                           cached_content_token_count=1000)
+        )
+        
+        router.record("fast", 0.5, "prompt", response)
+        router.record("fast", 1.5, "prompt", failed=True)
+        router.record_fallback("fast")
+        
+        stats = router.stats()["fast"]
+        assert stats["model"] == "flash"
+        assert (stats["calls"], stats["failures"], stats["fallbacks"]) == (2, 1, 1)
+        assert (stats["input_tokens"], stats["output_tokens"]) == (2000, 500)
+        assert stats["cost_usd"] == pytest.approx((2000 * 1.0 + 500 * 4.0) / 1_000_000)
+        assert stats["latency_seconds"] == pytest.approx(2.0)
+
+
+class TestSpeculativeValidation:
+    """Test speculative batch validation of evidence-cited controls."""
+    
+    class FakeService:
+        def __init__(self):
+            self.calls = []
+            self.release = asyncio.Event()
+        
+        async def validate_controls_by_family(self, control_ids, evidence_artifacts, on_call=None):
+            from app.models import NISTValidationResult
+            self.calls.append(list(control_ids))
+            if on_call is not None and control_ids:
+                on_call()
+            if len(self.calls) == 1:
+                await self.release.wait()
+            results = [
+                NISTValidationResult(control_id=cid, control_title=cid, is_valid=True, coverage_score=0.9)
+                for cid in control_ids
+            ]
+            return results, (1 if control_ids else 0)
+    
+    def test_cited_controls_limited_to_catalog_and_scope(self):
+        """Test only catalog controls in scope are speculated, in order of first mention."""
+        from app.models import EvidenceArtifact, EvidenceType
+        from app.services.speculative_validation import cited_controls
+        catalog = type("Catalog", (), {"has_control": lambda self, cid: cid != "ZZ-9"})()
+        artifacts = [
+            EvidenceArtifact(id="a", filename="a.pdf", file_type=EvidenceType.PDF_DOCUMENT, content_summary="", confidence_score=0.9,
+                             controls_mentioned=["AC-2", "ZZ-9", "IA-2"]),
+            EvidenceArtifact(id="b", filename="b.pdf", file_type=EvidenceType.PDF_DOCUMENT, content_summary="", confidence_score=0.9,
+                             controls_mentioned=["ia-2", "SC-7", "AU-6"])
+        ]
+        
+        assert cited_controls(artifacts, catalog) == ["AC-2", "IA-2", "SC-7", "AU-6"]
+        assert cited_controls(artifacts, catalog, ["AC-2", "SC-7", "ZZ-9"]) == ["AC-2", "SC-7"]
+    
+    def test_cited_controls_capped_to_most_cited(self):
+        """Test a long document's mention index is capped, keeping controls cited in the most sections."""
+        from app.models import EvidenceArtifact, EvidenceType
+        from app.services.speculative_validation import cited_controls
+        catalog = type("Catalog", (), {"has_control": lambda self, cid: True})()
+        mention_index = {f"CM-{i}": [0] for i in range(1, 200)}
+        mention_index.update({"AU-2": [0, 3, 7], "SC-7": [1, 2]})
+        artifacts = [
+            EvidenceArtifact(id="a", filename="a.pdf", file_type=EvidenceType.PDF_DOCUMENT, content_summary="", confidence_score=0.9,
+                             controls_mentioned=list(mention_index), metadata={"control_mention_index": mention_index}),
+            EvidenceArtifact(id="b", filename="b.pdf", file_type=EvidenceType.PDF_DOCUMENT, content_summary="", confidence_score=0.9,
+                             controls_mentioned=["CM-150"])
+        ]
+        
+        assert len(cited_controls(artifacts, catalog)) == 201
+        assert cited_controls(artifacts, catalog, limit=5) == ["AU-2", "CM-150", "SC-7", "CM-1", "CM-2"]
+    
+    @pytest.mark.asyncio
+    async def test_reuses_speculated_results_and_discards_the_rest(self):
+        """Test mapped controls reuse speculative results; unmapped ones are dropped."""
+        from app.services.speculative_validation import SpeculativeValidation
+        service = self.FakeService()
+        speculation = SpeculativeValidation(service, ["AC-2", "IA-2", "SC-7"], []).start()
+        await asyncio.sleep(0)
+        assert service.calls == [["AC-2", "IA-2", "SC-7"]]  # Running before mapping finishes
+        service.release.set()
+        
+        results, batch_calls = await speculation.validate(["AU-6", "AC-2", "SC-7"])
+        
+        assert [r.control_id for r in results] == ["AU-6", "AC-2", "SC-7"]
+        assert service.calls[1] == ["AU-6"]
+        assert batch_calls == 1 and speculation.batch_calls == 1
+        assert speculation.reused == 2
+        assert speculation.discard() == 1  # IA-2 was cited but not batch-validated
+    
+    @pytest.mark.asyncio
+    async def test_discard_cancels_pending_run(self):
+        """Test discarding a speculative run still in flight cancels it."""
+        from app.services.speculative_validation import SpeculativeValidation
+        service = self.FakeService()
+        speculation = SpeculativeValidation(service, ["AC-2"], []).start()
+        await asyncio.sleep(0)
+        
+        assert speculation.discard() == 1
+        await asyncio.sleep(0)
+        assert speculation.task.cancelled()
+        assert speculation.batch_calls == 1  # The call already made still counts
+
+
+class TestTokenEstimator:
+    """Test the locally calibrated token estimator."""
+    
+    def test_uncalibrated_uses_chars_per_token(self):
+        """Test the characters-per-token rule is used until enough samples are recorded."""
+        from app.services.token_estimator import TokenEstimator
+        estimator = TokenEstimator(min_samples=3)
+        
+        assert estimator.estimate("x" * 400) == 100
+        assert estimator.estimate("") == 0
+    
+    def test_scale_fitted_to_actual_counts(self):
+        """Test the scale converges to the ratio of actual to raw counts."""
+        from app.services.token_estimator import TokenEstimator, raw_token_count, token_features
+        estimator = TokenEstimator(min_samples=3)
+        texts = [
+            "AC-2 Account Management: the organization manages system accounts.",
+            "Audit records are reviewed weekly for indications of inappropriate activity.",
+            "Multi-factor authentication is required for privileged accounts (IA-2(1))."
+        ]
+        for text in texts:
+            estimator.observe(text, 2 * raw_token_count(token_features(text)))
+        
+        assert estimator.calibrated
+        assert estimator.scale == pytest.approx(2.0)
+        assert estimator.stats()["mean_abs_error_percent"] == 0.0
+    
+    def test_calibration_file_keeps_counts_not_text(self, tmp_path):
+        """Test samples persist across processes without recording prompt text."""
+        from app.services.token_estimator import TokenEstimator
+        path = tmp_path / "calibration.jsonl"
+        first = TokenEstimator(str(path), min_samples=2)
+        first.observe("Secret system security plan paragraph one.", 12)
+        first.observe("Secret system security plan paragraph two.", 12)
+        first.flush()
+        
+        assert "Secret" not in path.read_text()
+        second = TokenEstimator(str(path), min_samples=2)
+        assert second.calibrated
+        assert second.scale == pytest.approx(first.scale)
+    
+    def test_calibration_samples_buffered_until_flush(self, tmp_path):
+        """Test observing a call only buffers its sample; flush() writes the buffer in one append."""
+        from app.services.token_estimator import TokenEstimator
+        path = tmp_path / "calibration.jsonl"
+        estimator = TokenEstimator(str(path), min_samples=2, flush_samples=3)
+        estimator.observe("Audit records are reviewed weekly.", 8)
+        estimator.observe("Accounts are disabled after 90 days of inactivity.", 12)
+        
+        assert not path.exists()
+        assert not estimator.flush_due
+        estimator.observe("Sessions lock after 15 minutes.", 8)
+        assert estimator.flush_due
+        estimator.flush()
+        assert len(path.read_text().splitlines()) == 3
+        assert not estimator.flush_due
@@ -231,20 +231,28 @@ export default function ResultsDashboard({ results, sessionId, onReset }: Result
               {/* OSCAL Validation Status */}
               {results.oscal_validation_result && (
                 <div className={`border-2 rounded-xl p-6 ${
-                  results.oscal_validation_result.is_valid 
-                    ? 'border-green-500/30 bg-green-500/10' 
-                    : 'border-red-500/30 bg-red-500/10'
+                  !results.oscal_validation_result.is_valid
+                    ? 'border-red-500/30 bg-red-500/10'
+                    : results.oscal_validation_result.schema_validated === false
+                      ? 'border-yellow-500/30 bg-yellow-500/10'
+                      : 'border-green-500/30 bg-green-500/10'
                 }`}>
                   <div className="flex items-center justify-between mb-4">
                     <h3 className="text-lg font-semibold text-white flex items-center gap-2">
-                      {results.oscal_validation_result.is_valid ? '✅' : '❌'} OSCAL 1.2.0 Validation
+                      {!results.oscal_validation_result.is_valid
+                        ? '❌'
+                        : results.oscal_validation_result.schema_validated === false ? '⚠️' : '✅'} OSCAL 1.2.0 Validation
                     </h3>
                     <span className={`px-3 py-1 text-sm font-bold rounded-lg ${
-                      results.oscal_validation_result.is_valid 
-                        ? 'bg-green-500/30 text-green-300 border border-green-400/30' 
-                        : 'bg-red-500/30 text-red-300 border border-red-400/30'
+                      !results.oscal_validation_result.is_valid
+                        ? 'bg-red-500/30 text-red-300 border border-red-400/30'
+                        : results.oscal_validation_result.schema_validated === false
+                          ? 'bg-yellow-500/30 text-yellow-300 border border-yellow-400/30'
+                          : 'bg-green-500/30 text-green-300 border border-green-400/30'
                     }`}>
-                      {results.oscal_validation_result.is_valid ? 'VALID' : 'INVALID'}
+                      {!results.oscal_validation_result.is_valid
+                        ? 'INVALID'
+                        : results.oscal_validation_result.schema_validated === false ? 'NOT SCHEMA-CHECKED' : 'VALID'}
                     </span>
                   </div>
                   <div className="grid grid-cols-3 gap-4 mb-4">